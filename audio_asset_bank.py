@@ -0,0 +1,82 @@
+import wave
+from pathlib import Path
+
+import numpy as np
+
+import args
+import utils
+import global_constants as gc
+
+# sample width (bytes) -> NumPy type of the WAV samples
+_SAMPLE_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+
+class AudioAssetBank:
+    """
+    Pre-recorded prompt clips (es. the TTS request limit message), loaded once at startup from the WAV files of a
+    folder and converted to the speaker format (see SpeakerClient: 24 kHz mono int16 PCM, no header). Each clip is
+    served by key (the file name without extension) straight to the playback queue, without touching the disk or the
+    network again.
+    """
+
+    def __init__(self, **kwargs):
+        parameters = args.import_args(yaml_path=gc.CONFIG_FOLDER_PATH + 'audio_asset_bank.yaml', **kwargs)
+        self.folder_path = Path(parameters['folder_path'])
+        # must match the RDK X3 playback config (audio_bridge_server.yaml: speaker_sample_rate)
+        self.sample_rate = parameters['sample_rate']
+        self.verbose = parameters['verbose']
+        # key -> PCM bytes
+        self.clips = {}
+        for file_path in sorted(self.folder_path.glob('*.wav')):
+            try:
+                self.clips[file_path.stem] = self.load_clip(file_path=file_path)
+            except Exception as e:
+                utils.print_exception(exception=e, message=f'Error loading the audio asset "{file_path}"')
+        if self.verbose >= 2:
+            print(f'Audio asset bank: {len(self.clips)} clips loaded ({", ".join(self.clips)}).')
+
+    def load_clip(self, file_path: Path) -> bytes:
+        """
+        Reads a WAV file and converts it to mono int16 PCM at self.sample_rate (linear interpolation).
+        """
+        with wave.open(str(file_path), mode='rb') as wf:
+            sample_width = wf.getsampwidth()
+            assert sample_width in _SAMPLE_TYPES, f'Unsupported sample width: {sample_width} bytes'
+            samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=_SAMPLE_TYPES[sample_width])
+            channels = wf.getnchannels()
+            file_rate = wf.getframerate()
+        if sample_width == 2 and channels == 1 and file_rate == self.sample_rate:
+            # already in the speaker format
+            return samples.tobytes()
+
+        # to float in [-1, 1), mono
+        samples = samples.astype(np.float64)
+        if sample_width == 1:
+            samples = (samples - 128) / 128
+        else:
+            samples /= 2 ** (8 * sample_width - 1)
+        samples = samples.reshape(-1, channels).mean(axis=1)
+        if file_rate != self.sample_rate:
+            num_samples = int(len(samples) * self.sample_rate / file_rate)
+            samples = np.interp(np.arange(num_samples) * file_rate / self.sample_rate, np.arange(len(samples)), samples)
+        return np.clip(np.rint(samples * 32768), -32768, 32767).astype(np.int16).tobytes()
+
+    def get(self, key: str):
+        """
+        :return: the PCM of the clip, or None if there is no clip with this key.
+        """
+        clip = self.clips.get(key)
+        if clip is None and self.verbose >= 1:
+            print(f'Audio asset "{key}" not found in "{self.folder_path}".')
+        return clip
+
+    def play(self, shared_variable_manager, key: str) -> bool:
+        """
+        Queues the clip for playback on the RDK X3 speakers (queue 'audio_to_play').
+        :return: False if there is no clip with this key.
+        """
+        clip = self.get(key)
+        if clip is None:
+            return False
+        shared_variable_manager.add_to(queue_name='audio_to_play', value=clip)
+        return True
@@ -1,14 +1,22 @@
-import time
-import socket
+import struct
+import asyncio
 
 import args
-import utils
 import global_constants as gc
+from ethernet_connection.transport import FramedLink, run_together
 
 
-# Formats (as stored in 'latest_camera_image'["format"]) that we can forward to the RDK X3 as-is.
+# Formats (as stored in the camera frames "format") that we can forward to the RDK X3 as-is.
 _JPEG_FORMATS = ('.jpg', '.jpeg', 'jpg', 'jpeg')
 
+PULL_MODE = 'pull'
+PUSH_MODE = 'push'
+# push mode control messages from the RDK X3: [1-byte command][1-byte target fps]
+_SUBSCRIBE_COMMAND = b'S'
+_UNSUBSCRIBE_COMMAND = b'U'
+# push mode frame header: [4-byte sequence number][8-byte capture timestamp (float)][4-byte JPEG length]
+_PUSH_FRAME_HEADER = struct.Struct('>IdI')
+
 
 class FrameStreamerClient:
     """
@@ -17,15 +25,25 @@ class FrameStreamerClient:
     (Option B).
 
     It does NOT open the camera itself: it reuses the JPEG frames already captured by UsbCamera and stored
-    in the shared variable manager ('latest_camera_image'), so the single /dev/video device is never opened
-    twice.
+    in its frame ring buffer (shared variable 'camera_frame_buffer'), so the single /dev/video device is never
+    opened twice. Frames are sent straight from the ring buffer slots, header and JPEG in a single scatter-gather
+    send, so the JPEG bytes are never copied on the way to the wire.
+
+    Two protocols are available (see "mode" in frame_streamer.yaml), in both the RDK X3 is the TCP server:
+
+    Pull: the RDK X3 sends a 1-byte request for each frame it wants, but only while an app is subscribed to the
+    topic. This client replies with a 4-byte big-endian length prefix followed by the JPEG bytes (a length of 0
+    means "no frame available yet"). So nothing is sent unless the RDK X3 asks, and when no app is watching this
+    coroutine simply waits idle for the next request. Every frame costs a full network round trip.
 
-    Protocol (pull): the RDK X3 is the TCP server. It sends a 1-byte request for each frame it wants, but
-    only while an app is subscribed to the topic. This client replies with a 4-byte big-endian length prefix
-    followed by the JPEG bytes (a length of 0 means "no frame available yet"). So nothing is sent unless the
-    RDK X3 asks, and when no app is watching this thread simply blocks idle on recv().
+    Push: the RDK X3 sends [b'S'][target fps] once when an app subscribes and [b'U'][0] when the last one leaves.
+    While subscribed, this client sends a frame as soon as UsbCamera publishes a new one, as
+    [4-byte sequence][8-byte capture timestamp][4-byte length][JPEG bytes]. Frames published faster than the
+    target fps are dropped (the latest one is sent when the rate allows it), and a sequence number already sent
+    is never sent again.
 
-    This is a separate socket/port from the JSON command channel (EthernetClient), so the two never mix.
+    This is a separate socket/port from the JSON command channel (EthernetClient), so the two never mix. Like the
+    other RDK X3 links it runs as a coroutine on the main event loop (see FramedLink), not on its own thread.
     """
 
     def __init__(self, shared_variable_manager, **kwargs):
@@ -34,76 +52,162 @@ class FrameStreamerClient:
         self.host = parameters['host']
         self.port = parameters['port']
         self.retry_interval = parameters['retry_interval']
+        self.mode = parameters['mode']
+        self.max_push_fps = parameters['max_push_fps']
         self.verbose = parameters['verbose']
-        self.socket = None
+        assert self.mode in (PULL_MODE, PUSH_MODE), f'Unknown frame streamer mode "{self.mode}"'
+        # pull requests are a single byte, push control messages are two bytes, neither has a payload
+        self.link = FramedLink(
+            name='Frame streamer',
+            host=self.host,
+            port=self.port,
+            receive_header_format='>B' if self.mode == PULL_MODE else '>cB',
+            receive_length_index=None,
+            min_retry_interval=parameters['min_retry_interval'],
+            max_retry_interval=self.retry_interval,
+            verbose=self.verbose,
+        )
 
-    def connect(self) -> None:
-        connection_established = False
-        if self.verbose >= 2:
-            print('Starting frame streamer client...')
-        while not connection_established:
-            try:
-                self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                self.socket.connect((self.host, self.port))
-                if self.verbose >= 1:
-                    print(f'\tFrame streamer connected to {self.host}:{self.port}')
-                connection_established = True
-            except socket.error as e:
-                utils.print_exception(exception=e, message='Error connecting frame streamer')
-                if self.verbose >= 1:
-                    print(f'\tConnection failed. Retrying in {self.retry_interval} seconds...')
-                connection_established = False
-                time.sleep(self.retry_interval)
-
-    def _get_latest_jpeg(self) -> bytes:
-        frame_dict = self.shared_variable_manager.get_variable(variable_name='latest_camera_image')
-        if frame_dict is None:
-            return b''
-        image_format = frame_dict.get('format')
-        if image_format not in _JPEG_FORMATS:
+        # push mode state, reset at every connection
+        self.target_fps = 0
+        self.last_sent_sequence = None
+        # set when a new frame is published or the subscription changes
+        self._wakeup = None
+
+    async def _get_latest_frame(self):
+        """
+        :return: the latest camera Frame if it is a JPEG frame, None otherwise. If it still has to be encoded, it is
+            encoded off the event loop.
+        """
+        frame_buffer = self.shared_variable_manager.get_variable(variable_name='camera_frame_buffer')
+        if frame_buffer is None:
+            return None
+        frame = await frame_buffer.read_latest_async()
+        if frame is None:
+            return None
+        if frame.format not in _JPEG_FORMATS:
             if self.verbose >= 1:
-                print(f'Frame streamer: camera format "{image_format}" is not JPEG, skipping frame. '
+                print(f'Frame streamer: camera format "{frame.format}" is not JPEG, skipping frame. '
                       f'Set image_format to ".jpg" in usb_camera.yaml.')
+            return None
+        return frame
+
+    async def _get_latest_jpeg(self):
+        """
+        :return: the latest JPEG as a memoryview into the camera ring buffer (empty if not available).
+        """
+        frame = await self._get_latest_frame()
+        if frame is None:
             return b''
-        return frame_dict.get('image', b'')
+        return frame.image
 
-    def _serve(self) -> None:
+    async def _serve_pull(self) -> None:
         """Respond to frame requests until the connection drops."""
-        while self.socket:
-            try:
-                request = self.socket.recv(1)
-                if not request:
-                    # the RDK X3 closed the connection
-                    self.close()
-                    return
-                jpeg_bytes = self._get_latest_jpeg()
-                length_prefix = len(jpeg_bytes).to_bytes(length=4, byteorder='big')
-                self.socket.sendall(length_prefix + jpeg_bytes)
-                if self.verbose >= 3:
-                    print(f'Frame streamer sent {len(jpeg_bytes)} bytes')
-            except Exception as e:
-                utils.print_exception(exception=e, message='Error in frame streamer "_serve"')
-                self.close()
-                return
-
-    def close(self) -> None:
-        if self.socket:
-            try:
-                self.socket.close()
-            except Exception:
-                pass
-            if self.verbose >= 1:
-                print(f'Frame streamer connection to {self.host}:{self.port} closed.')
-            self.socket = None
+        while True:
+            await self.link.receive_frame()
+            jpeg_bytes = await self._get_latest_jpeg()
+            length_prefix = len(jpeg_bytes).to_bytes(length=4, byteorder='big')
+            await self.link.send(length_prefix, jpeg_bytes)
+            if self.verbose >= 3:
+                print(f'Frame streamer sent {len(jpeg_bytes)} bytes')
 
-    def run_forever(self) -> None:
-        """Connect, serve frames until the link drops, then reconnect. Self-healing."""
+    async def _receive_subscriptions(self) -> None:
+        """Updates the target fps from the RDK X3 subscribe/unsubscribe messages."""
         while True:
-            self.connect()
-            self.shared_variable_manager.add_to(queue_name='running_components', value='frame_streamer')
-            try:
-                self._serve()
-            finally:
-                self.shared_variable_manager.remove_from(queue_name='running_components', value='frame_streamer')
-                self.close()
-            time.sleep(self.retry_interval)
+            (command, fps), _ = await self.link.receive_frame()
+            if command == _SUBSCRIBE_COMMAND:
+                # 0 means "as fast as the camera", always capped by max_push_fps
+                self.target_fps = self.max_push_fps if fps == 0 else min(fps, self.max_push_fps)
+            elif command == _UNSUBSCRIBE_COMMAND:
+                self.target_fps = 0
+            elif self.verbose >= 1:
+                print(f'Frame streamer: unknown command {command}, ignored.')
+            if self.verbose >= 2:
+                print(f'Frame streamer: target fps set to {self.target_fps}')
+            self._update_camera_demand()
+            self._wakeup.set()
+
+    def _update_camera_demand(self) -> None:
+        # while subscribed, the camera encodes every frame on its own thread; otherwise it can go low-power
+        frame_buffer = self.shared_variable_manager.get_variable(variable_name='camera_frame_buffer')
+        if frame_buffer is None:
+            return
+        if self.target_fps > 0:
+            frame_buffer.add_streaming_consumer(name='frame_streamer')
+        else:
+            frame_buffer.remove_streaming_consumer(name='frame_streamer')
+
+    async def _push_frames(self) -> None:
+        """Sends every new frame to the RDK X3 while it is subscribed, at most target_fps times per second."""
+        loop = asyncio.get_running_loop()
+        next_send_time = 0.0
+        while True:
+            # cleared before looking at the latest frame, so a frame published from now on is never missed
+            self._wakeup.clear()
+            # read once: the subscription can change (es. to 0 fps) at every await below
+            target_fps = self.target_fps
+            if target_fps <= 0:
+                await self._wakeup.wait()
+                continue
+            # rate control: frames published before next_send_time are skipped, only the latest one is sent
+            delay = next_send_time - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                # check the subscription again before sending
+                continue
+            frame = await self._get_latest_frame()
+            if self.target_fps <= 0:
+                # unsubscribed while the frame was being encoded
+                continue
+            if frame is None or frame.sequence == self.last_sent_sequence:
+                # nothing new yet: wait for the camera (or for a subscription change)
+                await self._wakeup.wait()
+                continue
+            jpeg_bytes = frame.image
+            header = _PUSH_FRAME_HEADER.pack(frame.sequence, frame.timestamp, len(jpeg_bytes))
+            await self.link.send(header, jpeg_bytes)
+            self.last_sent_sequence = frame.sequence
+            next_send_time = loop.time() + 1 / target_fps
+            if self.verbose >= 3:
+                print(f'Frame streamer pushed frame {self.last_sent_sequence} ({len(jpeg_bytes)} bytes)')
+
+    async def _serve_push(self) -> None:
+        """Push frames to the RDK X3 while it is subscribed, until the connection drops."""
+        self.target_fps = 0
+        self.last_sent_sequence = None
+        try:
+            await run_together(self._receive_subscriptions(), self._push_frames())
+        finally:
+            # the RDK X3 is gone, so is its subscription
+            self.target_fps = 0
+            self._update_camera_demand()
+
+    async def run(self) -> None:
+        """Connect, serve frames until the link drops, then reconnect. Self-healing."""
+        if self.verbose >= 2:
+            print(f'Starting frame streamer client ({self.mode} mode)...')
+        loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+
+        # woken up by UsbCamera (on its own thread) every time a new frame is published
+        def new_frame_listener():
+            loop.call_soon_threadsafe(self._wakeup.set)
+
+        frame_buffer = self.shared_variable_manager.get_variable(variable_name='camera_frame_buffer')
+        if self.mode == PUSH_MODE and frame_buffer is not None:
+            frame_buffer.add_listener(new_frame_listener)
+        try:
+            await self.link.run(
+                session=self._serve_pull if self.mode == PULL_MODE else self._serve_push,
+                on_connect=lambda: self.shared_variable_manager.add_to(
+                    queue_name='running_components',
+                    value='frame_streamer',
+                ),
+                on_disconnect=lambda: self.shared_variable_manager.remove_from(
+                    queue_name='running_components',
+                    value='frame_streamer',
+                ),
+            )
+        finally:
+            if self.mode == PUSH_MODE and frame_buffer is not None:
+                frame_buffer.remove_listener(new_frame_listener)
@@ -0,0 +1,115 @@
+import struct
+
+
+class FrameBuffer:
+    """
+    Reusable receive buffer for length-prefixed streams (es. [4-byte big-endian length][payload]).
+
+    Bytes are received straight into a preallocated bytearray with socket.recv_into (no per-chunk bytes objects),
+    and complete frames are parsed incrementally: a frame split over several recv calls is reassembled in place,
+    and several frames merged in one recv are all returned. Payloads are handed out as memoryviews into the buffer,
+    so they are only valid until the next receive: consumers must decode (or copy) them before receiving again.
+
+    The header layout is configurable with a struct format, "length_index" is the position of the payload length
+    in the unpacked header (the other header fields are returned together with the payload). With length_index=None
+    every message is a fixed-size header without payload (es. the 1-byte frame requests of the frame streamer).
+    """
+
+    def __init__(self, header_format: str = '>I', length_index: int = 0, capacity: int = 64 * 1024,
+                 max_frame_size: int = 16 * 1024 * 1024):
+        """
+        :param header_format: struct format of the frame header, es. '>I' (4-byte big-endian length).
+        :param length_index: index of the payload length in the unpacked header, None for header-only messages.
+        :param capacity: initial size of the buffer in bytes, it grows only if a single frame does not fit.
+        :param max_frame_size: frames announcing a bigger payload are considered a corrupted stream.
+        """
+        self.header = struct.Struct(header_format)
+        self.length_index = length_index
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray(capacity)
+        self._view = memoryview(self._buffer)
+        # unparsed data is in self._buffer[self._start:self._end]
+        self._start = 0
+        self._end = 0
+
+    def __len__(self) -> int:
+        """Number of received bytes not yet returned as part of a frame."""
+        return self._end - self._start
+
+    def reset(self) -> None:
+        """Discards any unparsed data, es. after a reconnection (a partial frame from the old stream is garbage)."""
+        self._start = self._end = 0
+
+    def writable_view(self, min_free_space: int = 1) -> memoryview:
+        """
+        Returns the free tail of the buffer, to be filled by recv_into (then call commit). Makes room first, moving
+        the unparsed bytes to the front or growing the buffer if needed.
+        """
+        if self._start == self._end:
+            self._start = self._end = 0
+        needed_space = max(min_free_space, self._missing_bytes())
+        if len(self._buffer) - self._end < needed_space:
+            pending = self._end - self._start
+            if pending + needed_space <= len(self._buffer):
+                # compact: move the partial frame to the front of the same buffer
+                self._view[:pending] = self._view[self._start:self._end]
+            else:
+                # a single frame is bigger than the buffer: replace it with a bigger one. Views already handed out
+                # keep the old buffer alive, so they stay valid.
+                new_buffer = bytearray(max(2 * len(self._buffer), pending + needed_space))
+                new_buffer[:pending] = self._view[self._start:self._end]
+                self._buffer = new_buffer
+                self._view = memoryview(self._buffer)
+            self._start = 0
+            self._end = pending
+        return self._view[self._end:]
+
+    def commit(self, num_bytes: int) -> None:
+        """Marks num_bytes written in the last writable_view() as received."""
+        self._end += num_bytes
+
+    def recv_into(self, sock) -> int:
+        """
+        Receives into the buffer from a blocking socket.
+        :return: number of received bytes, 0 if the peer closed the connection.
+        """
+        num_bytes = sock.recv_into(self.writable_view())
+        self.commit(num_bytes)
+        return num_bytes
+
+    def _missing_bytes(self) -> int:
+        """Bytes still needed to complete the frame at the front of the buffer (or just its header, if incomplete)."""
+        pending = self._end - self._start
+        if pending < self.header.size:
+            return self.header.size - pending
+        if self.length_index is None:
+            return 0
+        payload_length = self.header.unpack_from(self._buffer, self._start)[self.length_index]
+        return max(0, self.header.size + payload_length - pending)
+
+    def next_frame(self):
+        """
+        Parses the next complete frame.
+        :return: (header_fields, payload) with payload a memoryview into the buffer, or None if no complete frame has
+            been received yet.
+        """
+        if self._end - self._start < self.header.size:
+            return None
+        header_fields = self.header.unpack_from(self._buffer, self._start)
+        payload_length = 0 if self.length_index is None else header_fields[self.length_index]
+        if payload_length > self.max_frame_size:
+            raise ValueError(f'Frame of {payload_length} bytes exceeds the maximum of {self.max_frame_size} bytes, '
+                             f'the stream is probably corrupted.')
+        payload_start = self._start + self.header.size
+        payload_end = payload_start + payload_length
+        if payload_end > self._end:
+            return None
+        self._start = payload_end
+        return header_fields, self._view[payload_start:payload_end]
+
+    def frames(self):
+        """Yields (header_fields, payload) for every complete frame currently in the buffer."""
+        frame = self.next_frame()
+        while frame is not None:
+            yield frame
+            frame = self.next_frame()
@@ -1,20 +1,6 @@
-import time
-import socket
-
 import args
-import utils
 import global_constants as gc
-
-
-def _recv_exactly(sock, num_bytes: int):
-    """Receive exactly num_bytes, or None if the peer closed the connection before all bytes arrived."""
-    buffer = b''
-    while len(buffer) < num_bytes:
-        chunk = sock.recv(num_bytes - len(buffer))
-        if not chunk:
-            return None
-        buffer += chunk
-    return buffer
+from ethernet_connection.transport import FramedLink
 
 
 class MicStreamClient:
@@ -26,8 +12,12 @@ class MicStreamClient:
 
     Frame layout: [1 byte VAD flag][4-byte big-endian PCM length][mono int16 PCM bytes].
 
-    read_frame() is self-healing: it connects lazily and reconnects automatically if the link drops, blocking
-    until a frame is available, so callers get a simple "always works" audio source.
+    The frames are received with recv_into into the reusable buffer of the link, and the PCM is handed out as
+    memoryviews into it, so the always-on microphone path does not allocate per frame.
+
+    read_frame() is a self-healing coroutine (it runs on the main event loop, see FramedLink): it connects lazily
+    and reconnects automatically if the link drops, waiting until a frame is available, so callers get a simple
+    "always works" audio source.
     """
 
     def __init__(self, **kwargs):
@@ -36,54 +26,38 @@ class MicStreamClient:
         self.port = parameters['port']
         self.retry_interval = parameters['retry_interval']
         self.verbose = parameters['verbose']
-        self.socket = None
-
-    def _connect(self) -> None:
-        while self.socket is None:
-            try:
-                new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                new_socket.connect((self.host, self.port))
-                self.socket = new_socket
-                if self.verbose >= 1:
-                    print(f'Mic stream client connected to {self.host}:{self.port}')
-            except socket.error as e:
-                utils.print_exception(exception=e, message='Mic stream client connection error')
-                if self.verbose >= 1:
-                    print(f'\tRetrying in {self.retry_interval}s...')
-                time.sleep(self.retry_interval)
+        self.link = FramedLink(
+            name='Mic stream client',
+            host=self.host,
+            port=self.port,
+            receive_header_format='>BI',
+            receive_length_index=1,
+            min_retry_interval=parameters['min_retry_interval'],
+            max_retry_interval=self.retry_interval,
+            verbose=self.verbose,
+        )
+
+    async def read_frame(self):
+        """
+        Returns (is_voice: bool, pcm_view: memoryview). Waits until a frame is available, reconnecting if needed.
+        The PCM is a view into the link receive buffer (no copy), valid until the next read: copy it to keep it.
+        """
+        return (await self.read_frames(max_frames=1))[0]
 
-    def read_frame(self):
+    async def read_frames(self, max_frames: int) -> list:
         """
-        Returns (is_voice: bool, pcm_bytes: bytes). Blocks until a frame is available, reconnecting if needed.
+        Waits until a frame is available (reconnecting if needed), then returns it together with all the frames
+        already received after it, at most max_frames, so a backlog is drained in one call.
+        :return: list of (is_voice: bool, pcm_view: memoryview), the views are valid until the next read.
         """
         while True:
-            if self.socket is None:
-                self._connect()
+            await self.link.connect()
             try:
-                header = _recv_exactly(self.socket, 5)
-                if header is None:
-                    self.close()
-                    continue
-                is_voice = bool(header[0])
-                pcm_length = int.from_bytes(header[1:5], byteorder='big')
-                if pcm_length == 0:
-                    return is_voice, b''
-                pcm_bytes = _recv_exactly(self.socket, pcm_length)
-                if pcm_bytes is None:
-                    self.close()
-                    continue
-                return is_voice, pcm_bytes
-            except socket.error as e:
-                utils.print_exception(exception=e, message='Mic stream client read error')
-                self.close()
-                time.sleep(self.retry_interval)
+                frames = await self.link.receive_frames(max_frames=max_frames)
+            except ConnectionError:
+                # the link closed itself, reconnect
+                continue
+            return [(bool(is_voice), pcm_view) for (is_voice, _), pcm_view in frames]
 
     def close(self) -> None:
-        if self.socket is not None:
-            try:
-                self.socket.close()
-            except Exception:
-                pass
-            self.socket = None
-            if self.verbose >= 1:
-                print(f'Mic stream client connection to {self.host}:{self.port} closed.')
+        self.link.close()
@@ -1,9 +1,6 @@
-import time
-import socket
-
 import args
-import utils
 import global_constants as gc
+from ethernet_connection.transport import FramedLink
 
 
 class SpeakerClient:
@@ -15,9 +12,10 @@ class SpeakerClient:
     Message layout: [4-byte big-endian PCM length][PCM bytes]. The PCM format must match the RDK X3 playback
     config (audio_bridge_server.yaml: speaker_sample_rate / speaker_format), i.e. 24 kHz mono int16.
 
-    Self-healing but non-blocking for the caller: send_audio() connects lazily and reconnects if the link
-    dropped, and simply drops the chunk (with a log line) if the RDK X3 is unreachable, so the main loop is
-    never stuck waiting on playback.
+    Self-healing but non-blocking for the caller: send_audio() is a coroutine running on the main event loop (see
+    FramedLink). It connects lazily and reconnects if the link dropped, and simply drops the chunk (with a log line)
+    if the RDK X3 is unreachable, without retrying more often than the link backoff allows. While the PCM is being
+    written the loop keeps serving everything else.
     """
 
     def __init__(self, **kwargs):
@@ -26,50 +24,30 @@ class SpeakerClient:
         self.port = parameters['port']
         self.retry_interval = parameters['retry_interval']
         self.verbose = parameters['verbose']
-        self.socket = None
-        self._last_failed_connect = 0.0
-
-    def _connect(self) -> bool:
-        # Avoid hammering the network with a blocking connect on every chunk while the RDK X3 is down.
-        if time.time() - self._last_failed_connect < self.retry_interval:
-            return False
-        try:
-            new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            new_socket.settimeout(self.retry_interval)
-            new_socket.connect((self.host, self.port))
-            new_socket.settimeout(None)
-            self.socket = new_socket
-            if self.verbose >= 1:
-                print(f'Speaker client connected to {self.host}:{self.port}')
-            return True
-        except socket.error as e:
-            self._last_failed_connect = time.time()
-            utils.print_exception(exception=e, message='Speaker client connection error')
-            return False
-
-    def send_audio(self, pcm_bytes: bytes) -> None:
+        # send-only link: the RDK X3 never replies on this port
+        self.link = FramedLink(
+            name='Speaker client',
+            host=self.host,
+            port=self.port,
+            min_retry_interval=parameters['min_retry_interval'],
+            max_retry_interval=self.retry_interval,
+            verbose=self.verbose,
+        )
+
+    async def send_audio(self, pcm_bytes: bytes) -> None:
         if not pcm_bytes:
             return
-        if self.socket is None:
-            if not self._connect():
-                if self.verbose >= 2:
-                    print('Speaker client not connected, dropping audio chunk.')
-                return
+        if not await self.link.try_connect():
+            if self.verbose >= 2:
+                print('Speaker client not connected, dropping audio chunk.')
+            return
         try:
             length_prefix = len(pcm_bytes).to_bytes(length=4, byteorder='big')
-            self.socket.sendall(length_prefix + pcm_bytes)
+            await self.link.send(length_prefix, pcm_bytes)
             if self.verbose >= 3:
                 print(f'Speaker client sent {len(pcm_bytes)} bytes')
-        except socket.error as e:
-            utils.print_exception(exception=e, message='Speaker client send error')
-            self.close()
+        except ConnectionError as e:
+            print(f'Speaker client send error: {e}')
 
     def close(self) -> None:
-        if self.socket is not None:
-            try:
-                self.socket.close()
-            except Exception:
-                pass
-            self.socket = None
-            if self.verbose >= 1:
-                print(f'Speaker client connection to {self.host}:{self.port} closed.')
+        self.link.close()
@@ -0,0 +1,278 @@
+import time
+import socket
+import random
+import traceback
+import asyncio
+
+import utils
+from ethernet_connection.framing import FrameBuffer
+
+# maximum time (seconds) a single connection attempt can take before it is considered failed
+CONNECT_TIMEOUT = 5
+
+
+async def run_together(*coroutines) -> None:
+    """
+    Runs the coroutines concurrently (es. the receive and send sides of a link session) until the first one fails,
+    then cancels the others and re-raises its exception.
+    """
+    tasks = [asyncio.create_task(coroutine) for coroutine in coroutines]
+    try:
+        done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+        for task in done:
+            task.result()
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class LinkHealth:
+    """
+    Connection health counters of a FramedLink, all updated from the event loop thread.
+    """
+
+    def __init__(self):
+        self.connection_attempts = 0
+        self.connections = 0
+        self.disconnections = 0
+        self.consecutive_failures = 0
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.frames_sent = 0
+        self.frames_received = 0
+        self.connected_since = None
+        self.last_receive_time = None
+        self.last_send_time = None
+
+    def as_dict(self) -> dict:
+        return dict(vars(self))
+
+
+class FramedLink:
+    """
+    One TCP link to the RDK X3 (the RDK X3 is always the server), meant to run on the main asyncio event loop
+    together with all the other links, instead of each link owning blocking sockets and OS threads.
+
+    - connect() retries forever with jittered exponential backoff (min_retry_interval doubling up to
+      max_retry_interval), try_connect() makes a single attempt only if the backoff allows it.
+    - receive_frame() parses the incoming stream with a FrameBuffer (the header layout is per link), filled with
+      loop.sock_recv_into, so payloads are memoryviews valid until the next receive. receive_frames() also returns
+      the frames already buffered, so a burst of small frames costs a single call.
+    - send() writes one or more buffers (es. length prefix + payload) with a single scatter-gather sendmsg, without
+      concatenating or copying them.
+    - run(session) keeps a session coroutine alive: connect, run the session until the link drops (or the session
+      fails with any other error, logged), reconnect.
+    - health collects the counters used to monitor every link in the same way.
+
+    Any socket error closes the link and is raised as ConnectionError.
+    """
+
+    def __init__(self,
+                 name: str,
+                 host: str,
+                 port: int,
+                 receive_header_format: str = '>I',
+                 receive_length_index: int = 0,
+                 min_retry_interval: float = 0.5,
+                 max_retry_interval: float = 20,
+                 verbose: int = 0,
+                 ):
+        self.name = name
+        self.host = host
+        self.port = port
+        self.min_retry_interval = min_retry_interval
+        self.max_retry_interval = max_retry_interval
+        self.verbose = verbose
+        self.socket = None
+        self.receive_buffer = FrameBuffer(header_format=receive_header_format, length_index=receive_length_index)
+        self.health = LinkHealth()
+        self._next_attempt_time = 0.0
+
+    @property
+    def connected(self) -> bool:
+        return self.socket is not None
+
+    def _backoff_delay(self) -> float:
+        # exponential backoff with "equal jitter": half fixed, half random, so that links that dropped together do
+        # not all retry at the same instant
+        delay = min(self.max_retry_interval, self.min_retry_interval * 2 ** self.health.consecutive_failures)
+        return delay / 2 + random.uniform(0, delay / 2)
+
+    async def try_connect(self) -> bool:
+        """
+        Makes a single connection attempt, unless the backoff delay since the last failure has not elapsed yet.
+        :return: True if the link is connected.
+        """
+        if self.socket is not None:
+            return True
+        if time.monotonic() < self._next_attempt_time:
+            return False
+        loop = asyncio.get_running_loop()
+        new_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        new_socket.setblocking(False)
+        # small frames (commands, requests, VAD headers) must not wait for Nagle's algorithm
+        new_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.health.connection_attempts += 1
+        try:
+            await asyncio.wait_for(loop.sock_connect(new_socket, (self.host, self.port)), timeout=CONNECT_TIMEOUT)
+        except (OSError, asyncio.TimeoutError) as e:
+            new_socket.close()
+            delay = self._backoff_delay()
+            self.health.consecutive_failures += 1
+            self._next_attempt_time = time.monotonic() + delay
+            if self.verbose >= 2:
+                utils.print_exception(exception=e, message=f'Error connecting {self.name} to {self.host}:{self.port}')
+            if self.verbose >= 1:
+                print(f'\t{self.name}: connection failed. Retrying in {delay:.1f} seconds...')
+            return False
+        self.socket = new_socket
+        self.receive_buffer.reset()
+        self.health.connections += 1
+        self.health.consecutive_failures = 0
+        self.health.connected_since = time.time()
+        if self.verbose >= 1:
+            print(f'{self.name} connected to {self.host}:{self.port}')
+        return True
+
+    async def connect(self) -> None:
+        """Waits until the link is connected, retrying with backoff."""
+        while not await self.try_connect():
+            await asyncio.sleep(max(0.0, self._next_attempt_time - time.monotonic()))
+
+    async def receive_frame(self):
+        """
+        :return: (header_fields, payload) of the next complete frame, payload is a memoryview valid until the next
+            receive.
+        """
+        if self.socket is None:
+            raise ConnectionError(f'{self.name} is not connected')
+        loop = asyncio.get_running_loop()
+        try:
+            frame = self.receive_buffer.next_frame()
+            while frame is None:
+                num_bytes = await loop.sock_recv_into(self.socket, self.receive_buffer.writable_view())
+                if num_bytes == 0:
+                    raise ConnectionError(f'{self.name} closed by the server')
+                self.receive_buffer.commit(num_bytes)
+                self.health.bytes_received += num_bytes
+                self.health.last_receive_time = time.time()
+                frame = self.receive_buffer.next_frame()
+        except (OSError, ValueError) as e:
+            # ConnectionError is an OSError too; ValueError means a corrupted stream
+            self.close()
+            raise ConnectionError(f'{self.name} receive failed: {e}') from e
+        self.health.frames_received += 1
+        return frame
+
+    async def receive_frames(self, max_frames: int) -> list:
+        """
+        Waits for the next complete frame, then also returns the ones already received after it, without any other
+        socket read.
+        :param max_frames: maximum number of frames returned.
+        :return: list of (header_fields, payload), payloads are memoryviews valid until the next receive.
+        """
+        frames = [await self.receive_frame()]
+        while len(frames) < max_frames:
+            try:
+                frame = self.receive_buffer.next_frame()
+            except ValueError as e:
+                self.close()
+                raise ConnectionError(f'{self.name} receive failed: {e}') from e
+            if frame is None:
+                break
+            frames.append(frame)
+        self.health.frames_received += len(frames) - 1
+        return frames
+
+    async def send(self, *buffers) -> None:
+        """
+        Sends the buffers in order, as a single frame, with scatter-gather sendmsg calls.
+        The buffers are sent straight from the caller's memory. If the socket cannot take everything at once, the
+        remainder is copied before waiting for the socket to become writable, so callers can reuse their buffers
+        (es. camera ring buffer slots) as soon as this coroutine yields.
+        """
+        if self.socket is None:
+            raise ConnectionError(f'{self.name} is not connected')
+        loop = asyncio.get_running_loop()
+        pending = [memoryview(buffer).cast('B') for buffer in buffers if len(buffer) > 0]
+        copied = False
+        try:
+            while pending:
+                try:
+                    num_bytes = self.socket.sendmsg(pending)
+                except (BlockingIOError, InterruptedError):
+                    num_bytes = 0
+                self.health.bytes_sent += num_bytes
+                # drop what has been sent
+                while pending and num_bytes >= pending[0].nbytes:
+                    num_bytes -= pending[0].nbytes
+                    pending.pop(0)
+                if pending and num_bytes > 0:
+                    pending[0] = pending[0][num_bytes:]
+                if pending:
+                    if not copied:
+                        pending = [memoryview(bytes(buffer)) for buffer in pending]
+                        copied = True
+                    await self._wait_writable(loop)
+        except OSError as e:
+            self.close()
+            raise ConnectionError(f'{self.name} send failed: {e}') from e
+        self.health.frames_sent += 1
+        self.health.last_send_time = time.time()
+
+    async def _wait_writable(self, loop) -> None:
+        writable = loop.create_future()
+        file_descriptor = self.socket.fileno()
+        loop.add_writer(file_descriptor, lambda: writable.done() or writable.set_result(None))
+        try:
+            await writable
+        finally:
+            loop.remove_writer(file_descriptor)
+
+    async def run(self, session, on_connect=None, on_disconnect=None) -> None:
+        """
+        Keeps the link alive forever: connects, awaits session() until the link drops, then reconnects.
+        :param session: coroutine function (no arguments) using the link, it returns or raises when the link drops.
+        :param on_connect: optional callable invoked after every successful connection.
+        :param on_disconnect: optional callable invoked every time the link drops.
+        """
+        while True:
+            await self.connect()
+            if on_connect is not None:
+                on_connect()
+            try:
+                await session()
+            except ConnectionError as e:
+                if self.verbose >= 1:
+                    print(f'{self.name}: {e}')
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # a bug in the session (es. in a message handler) must not stop the link for good: reconnect, after
+                # the backoff delay, so a session that keeps failing does not spin
+                utils.print_exception(exception=e, message=f'{self.name}: unexpected error in the session')
+                traceback.print_exc()
+                delay = self._backoff_delay()
+                self.health.consecutive_failures += 1
+                self._next_attempt_time = time.monotonic() + delay
+                if self.verbose >= 1:
+                    print(f'\t{self.name}: reconnecting in {delay:.1f} seconds...')
+            finally:
+                self.close()
+                if on_disconnect is not None:
+                    on_disconnect()
+
+    def close(self) -> None:
+        if self.socket is not None:
+            try:
+                self.socket.close()
+            except Exception:
+                pass
+            self.socket = None
+            self.health.disconnections += 1
+            self.health.connected_since = None
+            # short pause before reconnecting, so a server that accepts and immediately drops is not hammered
+            self._next_attempt_time = time.monotonic() + self.min_retry_interval
+            if self.verbose >= 1:
+                print(f'{self.name} connection to {self.host}:{self.port} closed.')
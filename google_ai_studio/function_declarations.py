@@ -8,7 +8,7 @@ function_list = [
                 "seconds": {
                     "type": "number",
                     "description": "The duration of the beep in seconds.",
-                    "minimum": 0,
+                    "minimum": 0.1,
                     "maximum": 5
                 }
             },
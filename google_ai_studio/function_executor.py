@@ -0,0 +1,101 @@
+import utils
+
+# JSON schema types of function_declarations -> accepted Python types (bool is excluded from the numbers, it is an int)
+_SCHEMA_TYPES = {
+    'NUMBER': (int, float),
+    'INTEGER': (int,),
+    'BOOLEAN': (bool,),
+    'STRING': (str,),
+}
+
+
+class FunctionExecutor:
+    """
+    Dispatches the function calls of the reasoning model: the functions registered as local run right away on the
+    Jetson (es. beep, which only drives the buzzer of the expansion board), all the others are forwarded to the robot
+    (RDK X3) over the command link. The registry is keyed by the names of the function declarations, and every call
+    is validated against its declaration (required arguments, types, minimum/maximum, enum) before being run or sent.
+    """
+
+    def __init__(self, function_list: list, forward, local_functions: dict = None, verbose: int = 0):
+        """
+        :param function_list: function declarations given to the model (see function_declarations.py).
+        :param forward: called with the function call object to send it to the robot.
+        :param local_functions: function name -> callable run locally, with the call arguments as keyword arguments.
+        :param verbose: verbosity level.
+        """
+        self.declarations = {declaration['name']: declaration for declaration in function_list}
+        self.forward = forward
+        self.local_functions = {}
+        self.verbose = verbose
+        for name, function in (local_functions or {}).items():
+            self.register(name=name, function=function)
+
+    def register(self, name: str, function) -> None:
+        """Runs the declared function "name" locally from now on."""
+        assert name in self.declarations, f'Function "{name}" is not declared, it cannot be run locally'
+        self.local_functions[name] = function
+
+    def validate(self, name: str, arguments: dict) -> None:
+        """
+        Checks the arguments of a call against the function declaration.
+        :raise ValueError: if the function is not declared or the arguments do not match the declaration.
+        """
+        declaration = self.declarations.get(name)
+        if declaration is None:
+            raise ValueError(f'Function "{name}" is not declared.')
+        parameters = declaration.get('parameters', {})
+        properties = parameters.get('properties', {})
+        missing = [argument for argument in parameters.get('required', []) if argument not in arguments]
+        if len(missing) > 0:
+            raise ValueError(f'Function "{name}": missing required arguments {missing}.')
+        for argument, value in arguments.items():
+            schema = properties.get(argument)
+            if schema is None:
+                raise ValueError(f'Function "{name}": unknown argument "{argument}".')
+            accepted_types = _SCHEMA_TYPES.get(schema.get('type', '').upper())
+            if accepted_types is not None:
+                if isinstance(value, bool) and bool not in accepted_types:
+                    raise ValueError(f'Function "{name}": argument "{argument}" must be {schema["type"]}, '
+                                     f'given {value}.')
+                if not isinstance(value, accepted_types):
+                    # the model often returns integers as floats (es. 90.0)
+                    if not (int in accepted_types and isinstance(value, float) and value.is_integer()):
+                        raise ValueError(f'Function "{name}": argument "{argument}" must be {schema["type"]}, '
+                                         f'given {value}.')
+            if 'minimum' in schema and value < schema['minimum']:
+                raise ValueError(f'Function "{name}": argument "{argument}" must be >= {schema["minimum"]}, '
+                                 f'given {value}.')
+            if 'maximum' in schema and value > schema['maximum']:
+                raise ValueError(f'Function "{name}": argument "{argument}" must be <= {schema["maximum"]}, '
+                                 f'given {value}.')
+            if 'enum' in schema and value not in schema['enum']:
+                raise ValueError(f'Function "{name}": argument "{argument}" must be one of {schema["enum"]}, '
+                                 f'given {value}.')
+
+    def execute(self, function_call) -> dict:
+        """
+        Validates the function call, then runs it locally or forwards it to the robot.
+        :param function_call: object with a "name" string and an "args" dictionary.
+        :return: the outcome, as a function response for the model: {'result': ...} if the call has been run or
+            forwarded, {'error': ...} if it has been rejected or failed.
+        """
+        arguments = dict(function_call.args or {})
+        try:
+            self.validate(name=function_call.name, arguments=arguments)
+        except ValueError as e:
+            utils.print_exception(exception=e, message='Invalid function call, discarded')
+            return {'error': f'Invalid function call, not executed: {e}'}
+
+        local_function = self.local_functions.get(function_call.name)
+        if local_function is None:
+            self.forward(function_call)
+            return {'result': 'Function call forwarded to the robot.'}
+        if self.verbose >= 3:
+            print(f'Running function call locally: {function_call.name}({arguments})')
+        try:
+            local_function(**arguments)
+        except Exception as e:
+            utils.print_exception(exception=e, message=f'Error running function "{function_call.name}" locally')
+            return {'error': f'Function call failed: {e}'}
+        return {'result': 'Function call executed.'}
@@ -0,0 +1,112 @@
+from google.genai import types
+
+# text replacing the audio and image parts of the old turns, by MIME type prefix
+_MEDIA_PLACEHOLDERS = {
+    'audio': '[audio message from the user, no longer available]',
+    'image': '[camera image, no longer available]',
+}
+
+
+def part_size(part: types.Part) -> int:
+    """Approximate size of a part in the request, in bytes."""
+    size = 0
+    if part.text:
+        size += len(part.text.encode('utf-8'))
+    if part.inline_data is not None and part.inline_data.data is not None:
+        size += len(part.inline_data.data)
+    if part.function_call is not None:
+        size += len(str(part.function_call.name)) + len(str(part.function_call.args))
+    if part.function_response is not None:
+        size += len(str(part.function_response.name)) + len(str(part.function_response.response))
+    return size
+
+
+class HistoryManager:
+    """
+    Keeps the conversation history of ReasoningService bounded, so the requests do not grow (and slow down) over a
+    long session:
+        - only the last max_turns turns are kept (a turn starts with a user message and includes the model replies,
+          with their function calls and the function responses, so a call is never kept without its response).
+        - the audio and image parts of all but the last media_turns turns are replaced by a short text placeholder:
+          the model replies of those turns, which are kept, say what they were about. The prompt template, repeated
+          in every user message, is also dropped from those turns.
+        - the oldest turns are dropped until the history is smaller than max_bytes (a request size budget, roughly
+          4 bytes per token for text). The last turn is always kept.
+    """
+
+    def __init__(self, max_turns: int = 20, media_turns: int = 1, max_bytes: int = 500000,
+                 prompt_template: str = None):
+        """
+        :param max_turns: maximum number of turns kept.
+        :param media_turns: number of most recent turns keeping their audio and image parts.
+        :param max_bytes: maximum approximate size of the history, in bytes.
+        :param prompt_template: text part sent with every user message, dropped from the compacted turns.
+        """
+        self.max_turns = max_turns
+        self.media_turns = media_turns
+        self.max_bytes = max_bytes
+        self.prompt_template = prompt_template
+
+    @staticmethod
+    def split_turns(history: list) -> list:
+        """
+        :param history: list of types.Content, oldest first.
+        :return: list of turns, each one a list of types.Content starting with a user message (not a function
+            response).
+        """
+        turns = []
+        for content in history:
+            # the function responses are sent as user contents, but they belong to the turn of their call
+            is_function_response = any(part.function_response is not None for part in content.parts or [])
+            if (content.role == 'user' and not is_function_response) or len(turns) == 0:
+                turns.append([])
+            turns[-1].append(content)
+        return turns
+
+    def compact_content(self, content: types.Content) -> types.Content:
+        """Replaces the audio/image parts with placeholders and drops the prompt template."""
+        parts = []
+        for part in content.parts or []:
+            if part.inline_data is not None:
+                mime_type = part.inline_data.mime_type or ''
+                placeholder = _MEDIA_PLACEHOLDERS.get(mime_type.split('/')[0], f'[{mime_type} data, no longer available]')
+                parts.append(types.Part(text=placeholder))
+            elif self.prompt_template is not None and part.text == self.prompt_template:
+                continue
+            else:
+                parts.append(part)
+        return types.Content(role=content.role, parts=parts)
+
+    @staticmethod
+    def turn_size(turn: list) -> int:
+        return sum(part_size(part) for content in turn for part in content.parts or [])
+
+    def is_compact(self, history: list) -> bool:
+        """True if compact() would not change the history."""
+        turns = self.split_turns(history)
+        if len(turns) > self.max_turns or sum(self.turn_size(turn) for turn in turns) > self.max_bytes:
+            return False
+        old_turns = turns[:-self.media_turns] if self.media_turns > 0 else turns
+        return not any(
+            part.inline_data is not None or (self.prompt_template is not None and part.text == self.prompt_template)
+            for turn in old_turns for content in turn for part in content.parts or []
+        )
+
+    def compact(self, history: list) -> list:
+        """
+        :param history: list of types.Content, oldest first (es. chat.get_history()).
+        :return: the compacted history, a new list of types.Content.
+        """
+        turns = self.split_turns(history)[-self.max_turns:]
+        num_media_turns = min(self.media_turns, len(turns))
+        turns = [
+            [self.compact_content(content) for content in turn] for turn in turns[:len(turns) - num_media_turns]
+        ] + turns[len(turns) - num_media_turns:]
+
+        sizes = [self.turn_size(turn) for turn in turns]
+        total_size = sum(sizes)
+        first_turn = 0
+        while total_size > self.max_bytes and first_turn < len(turns) - 1:
+            total_size -= sizes[first_turn]
+            first_turn += 1
+        return [content for turn in turns[first_turn:] for content in turn]
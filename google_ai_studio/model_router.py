@@ -0,0 +1,243 @@
+import json
+import time
+import datetime
+import threading
+import collections
+from pathlib import Path
+from zoneinfo import ZoneInfo
+
+import utils
+
+
+class ModelsUnavailableError(Exception):
+    """Raised when every model of a fallback chain is out of quota, cooling down or failing."""
+
+    def __init__(self, message: str, retry_time: float = None):
+        """
+        :param retry_time: time (time.time()) when the first model is expected to be available again.
+        """
+        super().__init__(message)
+        self.retry_time = retry_time
+
+
+class ModelRouter:
+    """
+    Chooses the model of each request in an ordered fallback chain (es. gemini-2.5-flash, then gemini-2.0-flash), so
+    the service degrades gradually instead of going silent when the daily quota of a model runs out.
+
+    For every model it counts the requests and the tokens of the current quota day (persisted to a JSON file, so
+    restarts do not forget them) and the requests of the last minute. A model is skipped:
+        - predictively: when one more request (with the average tokens per request so far) would exceed its known
+          limits (model_limits: requests_per_day, requests_per_minute, tokens_per_day).
+        - when the API refused it: a 429 on the daily quota excludes it until the next quota day, any other 429 or
+          server error (5xx) for cooldown seconds.
+    Among the remaining models the first one in the chain is used, unless its smoothed latency is above max_latency:
+    then the first one under max_latency is preferred (the fastest one if none is).
+    """
+
+    def __init__(self,
+                 name: str,
+                 model_names: list,
+                 model_limits: dict = None,
+                 state_folder_path: str = None,
+                 quota_reset_timezone: str = 'America/Los_Angeles',
+                 max_latency: float = None,
+                 latency_smoothing: float = 0.2,
+                 cooldown: float = 60,
+                 verbose: int = 0,
+                 ):
+        """
+        :param name: name of the router (es. 'reasoning'), used for the state file and the messages.
+        :param model_names: fallback chain, in order of preference.
+        :param model_limits: model name -> dictionary with the known limits (requests_per_day, requests_per_minute,
+            tokens_per_day), missing or None if unknown.
+        :param state_folder_path: folder of the persisted counters, None to keep them in memory only.
+        :param quota_reset_timezone: the daily quotas reset at midnight in this time zone.
+        :param max_latency: models slower than this (seconds, smoothed) are used only if no other is available.
+        :param latency_smoothing: weight of the last request in the smoothed latency.
+        :param cooldown: seconds a model is excluded after a rate limit (not daily) or server error.
+        :param verbose: verbosity level.
+        """
+        assert len(model_names) > 0, 'At least one model is needed'
+        self.name = name
+        self.model_names = list(model_names)
+        self.model_limits = {model_name: (model_limits or {}).get(model_name) or {} for model_name in model_names}
+        self.state_file_path = None
+        if state_folder_path is not None:
+            self.state_file_path = Path(state_folder_path) / f'model_usage_{name}.json'
+        self.timezone = ZoneInfo(quota_reset_timezone)
+        self.max_latency = max_latency
+        self.latency_smoothing = latency_smoothing
+        self.cooldown = cooldown
+        self.verbose = verbose
+
+        self._lock = threading.Lock()
+        # persisted: model name -> {'day', 'requests', 'tokens', 'exhausted'}
+        self.usage = {}
+        # in memory only
+        self._recent_requests = {model_name: collections.deque() for model_name in self.model_names}
+        self._cooldown_until = {model_name: 0.0 for model_name in self.model_names}
+        self.latency = {model_name: None for model_name in self.model_names}
+        self._load_state()
+
+    def _quota_day(self) -> str:
+        return datetime.datetime.now(tz=self.timezone).date().isoformat()
+
+    def _load_state(self) -> None:
+        if self.state_file_path is None or not self.state_file_path.exists():
+            return
+        try:
+            self.usage = json.loads(self.state_file_path.read_text())
+        except (OSError, ValueError) as e:
+            utils.print_exception(exception=e, message=f'Error reading "{self.state_file_path}", counters reset')
+
+    def _save_state(self) -> None:
+        if self.state_file_path is None:
+            return
+        try:
+            self.state_file_path.parent.mkdir(parents=True, exist_ok=True)
+            temporary_path = self.state_file_path.with_suffix('.tmp')
+            temporary_path.write_text(json.dumps(self.usage, indent=2))
+            temporary_path.replace(self.state_file_path)
+        except OSError as e:
+            utils.print_exception(exception=e, message=f'Error writing "{self.state_file_path}"')
+
+    def _model_usage(self, model_name: str) -> dict:
+        """Counters of the current quota day (reset on a new day)."""
+        day = self._quota_day()
+        usage = self.usage.get(model_name)
+        if usage is None or usage['day'] != day:
+            usage = {'day': day, 'requests': 0, 'tokens': 0, 'exhausted': False}
+            self.usage[model_name] = usage
+        return usage
+
+    def is_available(self, model_name: str) -> bool:
+        """True if one more request to the model is expected to succeed (see the class description)."""
+        with self._lock:
+            return self._is_available(model_name)
+
+    def _is_available(self, model_name: str) -> bool:
+        usage = self._model_usage(model_name)
+        if usage['exhausted'] or time.monotonic() < self._cooldown_until[model_name]:
+            return False
+        limits = self.model_limits[model_name]
+        if limits.get('requests_per_day') is not None and usage['requests'] >= limits['requests_per_day']:
+            return False
+        if limits.get('tokens_per_day') is not None and usage['requests'] > 0:
+            average_tokens = usage['tokens'] / usage['requests']
+            if usage['tokens'] + average_tokens > limits['tokens_per_day']:
+                return False
+        if limits.get('requests_per_minute') is not None:
+            recent_requests = self._recent_requests[model_name]
+            while len(recent_requests) > 0 and time.monotonic() - recent_requests[0] > 60:
+                recent_requests.popleft()
+            if len(recent_requests) >= limits['requests_per_minute']:
+                return False
+        return True
+
+    def candidates(self) -> list:
+        """The available models, in the order they would be tried."""
+        with self._lock:
+            available = [model_name for model_name in self.model_names if self._is_available(model_name)]
+            if self.max_latency is None:
+                return available
+
+            def is_slow(model_name: str) -> bool:
+                return self.latency[model_name] is not None and self.latency[model_name] > self.max_latency
+
+            fast = [model_name for model_name in available if not is_slow(model_name)]
+            slow = sorted((model_name for model_name in available if is_slow(model_name)),
+                          key=lambda model_name: self.latency[model_name])
+            return fast + slow
+
+    def call(self, request):
+        """
+        Runs the request on the best available model, falling back to the next ones on quota and server errors.
+        :param request: called with the model name, returns the API response.
+        :return: (model_name, response)
+        :raise ModelsUnavailableError: if no model is available or all of them failed. Other errors are raised
+            as they are.
+        """
+        last_error = None
+        for model_name in self.candidates():
+            start_time = time.monotonic()
+            with self._lock:
+                self._recent_requests[model_name].append(start_time)
+                self._model_usage(model_name)['requests'] += 1
+            try:
+                response = request(model_name)
+            except Exception as e:
+                code = getattr(e, 'code', None)
+                if code != 429 and not (isinstance(code, int) and code >= 500):
+                    self._save()
+                    raise
+                self._record_failure(model_name=model_name, exception=e)
+                last_error = e
+                continue
+            self._record_success(model_name=model_name, response=response, latency=time.monotonic() - start_time)
+            return model_name, response
+        retry_time = self.next_available_time()
+        raise ModelsUnavailableError(
+            f'No {self.name} model available ({", ".join(self.model_names)}), next retry at '
+            f'{datetime.datetime.fromtimestamp(retry_time).strftime("%Y-%m-%d %H:%M:%S")}'
+            + (f', last error: {last_error}' if last_error is not None else '.'),
+            retry_time=retry_time,
+        )
+
+    def next_available_time(self) -> float:
+        """
+        :return: the time (time.time()) when the first model is expected to be available again, now if one already
+            is.
+        """
+        now = time.time()
+        # the monotonic deadlines, as wall clock times
+        monotonic_offset = now - time.monotonic()
+        tomorrow = datetime.datetime.now(tz=self.timezone).date() + datetime.timedelta(days=1)
+        next_quota_day = datetime.datetime.combine(tomorrow, datetime.time(), tzinfo=self.timezone).timestamp()
+        available_times = []
+        with self._lock:
+            for model_name in self.model_names:
+                if self._is_available(model_name):
+                    return now
+                usage = self._model_usage(model_name)
+                limits = self.model_limits[model_name]
+                available_time = max(now, self._cooldown_until[model_name] + monotonic_offset)
+                daily_limit_reached = usage['exhausted'] or (
+                    limits.get('requests_per_day') is not None and usage['requests'] >= limits['requests_per_day'])
+                if daily_limit_reached or limits.get('tokens_per_day') is not None and usage['requests'] > 0 and (
+                        usage['tokens'] * (1 + 1 / usage['requests']) > limits['tokens_per_day']):
+                    available_time = max(available_time, next_quota_day)
+                recent_requests = self._recent_requests[model_name]
+                if limits.get('requests_per_minute') is not None and len(recent_requests) >= limits[
+                        'requests_per_minute']:
+                    available_time = max(available_time, recent_requests[0] + 60 + monotonic_offset)
+                available_times.append(available_time)
+        return min(available_times)
+
+    def _save(self) -> None:
+        with self._lock:
+            self._save_state()
+
+    def _record_success(self, model_name: str, response, latency: float) -> None:
+        usage_metadata = getattr(response, 'usage_metadata', None)
+        tokens = getattr(usage_metadata, 'total_token_count', None) or 0
+        with self._lock:
+            self._model_usage(model_name)['tokens'] += tokens
+            if self.latency[model_name] is None:
+                self.latency[model_name] = latency
+            else:
+                self.latency[model_name] += self.latency_smoothing * (latency - self.latency[model_name])
+            self._save_state()
+
+    def _record_failure(self, model_name: str, exception: Exception) -> None:
+        # the quota errors name the exceeded quota, es. "GenerateRequestsPerDayPerProjectPerModel-FreeTier"
+        daily_quota = getattr(exception, 'code', None) == 429 and 'perday' in str(exception).lower()
+        with self._lock:
+            if daily_quota:
+                self._model_usage(model_name)['exhausted'] = True
+            else:
+                self._cooldown_until[model_name] = time.monotonic() + self.cooldown
+            self._save_state()
+        if self.verbose >= 1:
+            print(f'Model {model_name} unavailable {"until tomorrow" if daily_quota else f"for {self.cooldown} s"}'
+                  f' ({exception}), falling back to the next {self.name} model.')
@@ -1,8 +1,14 @@
+import datetime
 import warnings
 
+import utils
+
 from google import genai
 from google.genai import types
 
+from google_ai_studio.history_manager import HistoryManager
+from google_ai_studio.model_router import ModelRouter, ModelsUnavailableError
+
 
 class ReasoningService:
     """
@@ -16,6 +22,14 @@ class ReasoningService:
                  remember_history: bool = False,
                  audio_mime_type: str = 'audio/wav',
                  image_mime_type: str = 'image/jpeg',
+                 history_parameters: dict = None,
+                 fallback_model_names: list = None,
+                 router_parameters: dict = None,
+                 get_camera_image=None,
+                 speculative_image: bool = False,
+                 max_tool_rounds: int = 1,
+                 on_models_unavailable=None,
+                 verbose: int = 0,
                  ):
         """
         Initializes the ReasoningService with the Google AI Studio client, model name, and optional configuration.
@@ -26,6 +40,19 @@ class ReasoningService:
         :param remember_history: bool: Whether to remember the history of interactions, default is False.
         :param audio_mime_type: str: The MIME type of the audio data, default is 'audio/wav'.
         :param image_mime_type: str: The MIME type of the image data, default is 'image/jpeg'.
+        :param history_parameters: dict: Optional HistoryManager parameters, to keep the history bounded when
+            remember_history is True. Default is None (unbounded history).
+        :param fallback_model_names: list: Models used, in order, when model_name is out of quota or failing.
+        :param router_parameters: dict: Optional ModelRouter parameters (quota limits, state folder, latency).
+        :param get_camera_image: Optional callable returning the latest camera image (bytes, image_mime_type) or
+            None, called with wait=False to get it only if already fresh. If given, the get_camera_image function
+            calls are answered within the same turn, with the image. Default is None (returned to the caller).
+        :param speculative_image: bool: Whether to attach the latest camera image (if fresh) to every audio message,
+            so visual questions are answered without a get_camera_image call. Default is False.
+        :param max_tool_rounds: int: Maximum number of get_camera_image calls answered within one turn.
+        :param on_models_unavailable: Optional callable(ModelsUnavailableError), invoked when every model of the
+            fallback chain is out of quota or failing, to tell the user (instead of just going silent).
+        :param verbose: int: Verbosity level.
         """
 
         self.client = client
@@ -36,9 +63,102 @@ class ReasoningService:
         self.remember_history = remember_history
         self.audio_mime_type = audio_mime_type
         self.image_mime_type = image_mime_type
+        self.get_camera_image = get_camera_image
+        self.speculative_image = speculative_image
+        self.max_tool_rounds = max_tool_rounds
+        self.on_models_unavailable = on_models_unavailable
+        self.verbose = verbose
+        # chooses the model of each request, see ModelRouter
+        self.model_router = ModelRouter(
+            name='reasoning',
+            model_names=[self.model_name] + (fallback_model_names or []),
+            verbose=self.verbose,
+            **(router_parameters or {}),
+        )
 
+        self.history_manager = None
         if self.remember_history:
-            self.chat = client.chats.create(model=self.model_name, config=self.config)
+            # the model the chat is bound to, the chat is moved (with its history) when the router changes model
+            self.chat_model_name = self.model_name
+            self.chat = client.chats.create(model=self.chat_model_name, config=self.config)
+            # number of history contents added by the last reasoning call, see discard_last_turn
+            self.last_turn_length = 0
+            if history_parameters is not None:
+                self.history_manager = HistoryManager(prompt_template=self.prompt_template, **history_parameters)
+
+    def compact_history(self) -> None:
+        """
+        Rebuilds the chat from its compacted history (see HistoryManager), if it grew beyond the limits. Only the
+        local chat object changes, no request is sent.
+        """
+        history = self.chat.get_history()
+        if not self.history_manager.is_compact(history):
+            self.chat = self.client.chats.create(
+                model=self.chat_model_name,
+                config=self.config,
+                history=self.history_manager.compact(history),
+            )
+
+    def discard_last_turn(self) -> None:
+        """
+        Removes the turn of the last reasoning call from the chat history (es. its answer has been discarded, see
+        ReasoningWorkerPool), so the model does not remember a reply the user never heard. No request is sent.
+        """
+        if not self.remember_history or self.last_turn_length == 0:
+            return
+        history = self.chat.get_history()
+        self.chat = self.client.chats.create(
+            model=self.chat_model_name,
+            config=self.config,
+            history=history[:len(history) - self.last_turn_length],
+        )
+        self.last_turn_length = 0
+
+    def _send(self, model_name: str, chosen_input: list):
+        """Sends the input to the given model, in the chat if the history is remembered."""
+        if not self.remember_history:
+            return self.client.models.generate_content(model=model_name, contents=chosen_input, config=self.config)
+        if model_name != self.chat_model_name:
+            if self.verbose >= 2:
+                print(f'Moving the chat from {self.chat_model_name} to {model_name}.')
+            self.chat = self.client.chats.create(model=model_name, config=self.config, history=self.chat.get_history())
+            self.chat_model_name = model_name
+        return self.chat.send_message(chosen_input)
+
+    @staticmethod
+    def _user_content(chosen_input: list) -> types.Content:
+        return types.Content(
+            role='user',
+            parts=[types.Part(text=item) if isinstance(item, str) else item for item in chosen_input],
+        )
+
+    @staticmethod
+    def _parse_response(response) -> tuple:
+        """:return: (text, function_call) of the response, None if missing. The text parts are joined."""
+        text_parts = []
+        function_call = None
+        for part in response.candidates[0].content.parts:
+            if part.text:
+                text_parts.append(part.text)
+            elif part.function_call:
+                function_call = part.function_call
+            else:
+                warnings.warn(f'Unexpected part type in response:\n\t{part}')
+        text = ''.join(text_parts) if len(text_parts) > 0 else None
+        return text, function_call
+
+    def _camera_image_response(self) -> list:
+        """:return: the parts answering a get_camera_image function call: the function response and the image."""
+        image_bytes = self.get_camera_image()
+        if image_bytes is None:
+            return [types.Part.from_function_response(
+                name='get_camera_image',
+                response={'error': 'No recent camera image available.'},
+            )]
+        return [
+            types.Part.from_function_response(name='get_camera_image', response={'result': 'Image attached.'}),
+            types.Part.from_bytes(data=image_bytes, mime_type=self.image_mime_type),
+        ]
 
     def reasoning(self, audio_bytes: bytes = None, image_bytes: bytes = None, **kwargs) -> tuple:
         """
@@ -50,9 +170,9 @@ class ReasoningService:
 
         Returns:
             tuple: A tuple containing:
-                - is_function_call (bool): Indicates if the response is a function call.
-                - response: The response from the LLM, which can be either text or a function call with parameters, or
-                 an error message if an exception occurs.
+                - text (str): The textual response of the LLM, or None.
+                - function_call: The function call (with parameters) requested by the LLM, or None.
+            Both are None if an error occurs (es. all the models are out of quota, see ModelRouter).
         """
         assert audio_bytes is not None or image_bytes is not None, 'Either audio_bytes or image_bytes must be supplied'
         assert audio_bytes is None or image_bytes is None, 'Only one of audio_bytes or image_bytes can be supplied'
@@ -75,34 +195,61 @@ class ReasoningService:
                         mime_type=self.image_mime_type,
                     )]
 
+            if audio_bytes is not None and self.speculative_image and self.get_camera_image is not None:
+                # only if already available: waiting for the camera would delay every request
+                speculative_image_bytes = self.get_camera_image(wait=False)
+                if speculative_image_bytes is not None:
+                    chosen_input += [
+                        'Latest image of the arm camera, in case the request needs it:',
+                        types.Part.from_bytes(data=speculative_image_bytes, mime_type=self.image_mime_type),
+                    ]
+
+            if self.remember_history and self.chat is None:
+                raise ValueError("Chat history is enabled but chat object is not initialized.")
+            # without history the whole turn is sent again with every function response
+            contents = chosen_input if self.remember_history else [self._user_content(chosen_input)]
             if self.remember_history:
-                if self.chat is None:
-                    raise ValueError("Chat history is enabled but chat object is not initialized.")
-                response = self.chat.send_message(chosen_input)
-            else:  # without history
-                if self.config is None:  # without config
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=chosen_input,
-                    )
-                else:  # with config
-                    response = self.client.models.generate_content(
-                        model=self.model_name,
-                        contents=chosen_input,
-                        config=self.config,
-                    )
-
-            text = None
-            function_call = None
-            for part in response.candidates[0].content.parts:
-                if part.text:
-                    text = part.text
-                elif part.function_call:
-                    function_call = part.function_call
+                self.last_turn_length = 0
+                history_length = len(self.chat.get_history())
+            tool_round = 0
+            # the text of every round (es. "Let me look." with the get_camera_image call), in order
+            round_texts = []
+            while True:
+                _, response = self.model_router.call(lambda model_name: self._send(model_name, contents))
+                text, function_call = self._parse_response(response)
+                if text is not None:
+                    round_texts.append(text)
+                if (function_call is None or function_call.name != 'get_camera_image' or
+                        self.get_camera_image is None or tool_round >= self.max_tool_rounds):
+                    break
+                # answered within the same turn, with the image, instead of with a new request
+                tool_round += 1
+                function_response_parts = self._camera_image_response()
+                if self.remember_history:
+                    contents = function_response_parts
                 else:
-                    warnings.warn(f'Unexpected part type in response:\n\t{part}')
+                    contents = contents + [
+                        response.candidates[0].content,
+                        types.Content(role='user', parts=function_response_parts),
+                    ]
+            if self.remember_history:
+                # measured before the compaction, which never changes the last turn
+                self.last_turn_length = len(self.chat.get_history()) - history_length
+            if self.history_manager is not None:
+                self.compact_history()
 
+            text = ' '.join(round_texts) if len(round_texts) > 0 else None
             return text, function_call
 
+        except ModelsUnavailableError as e:
+            utils.print_exception(exception=e, message='Reasoning service unavailable')
+            if e.retry_time is not None:
+                retry_time = datetime.datetime.fromtimestamp(e.retry_time).strftime('%Y-%m-%d %H:%M:%S')
+                print(f'No reasoning model available, next retry at {retry_time}.')
+            if self.on_models_unavailable is not None:
+                self.on_models_unavailable(e)
+            return None, None
         except Exception as e:
-            return False, f'An error occurred:\n{e}'
+            # the callers expect (text, function_call): an error tuple would be taken as a response
+            utils.print_exception(exception=e, message='Error in reasoning service')
+            return None, None
@@ -0,0 +1,172 @@
+import time
+import threading
+import collections
+
+import utils
+
+
+class _Job:
+    def __init__(self, sequence: int, request: dict, kind: str, deadline: float):
+        self.sequence = sequence
+        self.request = request
+        self.kind = kind
+        self.deadline = deadline
+        self.started = False
+        self.cancelled = False
+        # decided once, when the job is skipped or completed
+        self.discarded = False
+        self.done = False
+        self.result = None
+
+
+class ReasoningWorkerPool:
+    """
+    Runs the reasoning requests on a bounded pool of worker threads, so a new request does not wait for the whole
+    round trip of the previous one.
+        - ordering: the results are delivered in submission order, whatever order they complete in. If serialize is
+          True (the requests share a conversation history, which must see them in order) only one request runs at a
+          time.
+        - deadlines: a request not completed within request_deadline seconds from its submission is discarded, its
+          answer would come too late to be useful (es. a movement command).
+        - superseding: a new request of one of the superseding_kinds cancels the older requests of the same kind:
+          they are not started, or their result is discarded if still running. Es. with ['audio'] only the latest
+          utterance is answered when several pile up (also with serialize, the waiting ones are skipped). The camera
+          images are fetched within the reasoning turn (see ReasoningService), so 'image' requests are only the ones
+          queued directly in reasoning_requests.
+    The deadline and the superseding are checked before a request starts, and once more when it completes. A request
+    discarded after running is handed to "discard" right away, before the next serialized request starts, so its
+    turn can be removed from the conversation history (the model must not remember a reply the user never heard).
+    """
+
+    def __init__(self,
+                 process,
+                 deliver,
+                 num_workers: int = 2,
+                 serialize: bool = False,
+                 request_deadline: float = None,
+                 superseding_kinds: list = None,
+                 discard=None,
+                 verbose: int = 0,
+                 name: str = 'reasoning_worker',
+                 ):
+        """
+        :param process: called with the request dictionary on a worker thread, returns the result.
+        :param deliver: called with (request, result) for every completed request, in submission order.
+        :param num_workers: number of worker threads.
+        :param serialize: if True, the requests run one at a time, in submission order.
+        :param request_deadline: seconds after the submission after which a request is discarded, None = never.
+        :param superseding_kinds: request kinds (see request_kind) for which a new request cancels the older ones.
+        :param discard: optional, called with (request, result) on the worker thread for every request discarded
+            after running.
+        :param verbose: verbosity level.
+        :param name: prefix of the worker thread names.
+        """
+        assert num_workers > 0, 'num_workers must be a positive integer'
+        self.process = process
+        self.deliver = deliver
+        self.serialize = serialize
+        self.request_deadline = request_deadline
+        self.superseding_kinds = set(superseding_kinds) if superseding_kinds is not None else set()
+        self.discard = discard
+        self.verbose = verbose
+        self.discarded_count = 0
+
+        self._sequence = 0
+        self._running = 0
+        # jobs waiting for a worker
+        self._pending = collections.deque()
+        # all the jobs not delivered yet, in submission order
+        self._undelivered = collections.deque()
+        self._condition = threading.Condition()
+        # held while delivering, so that results are delivered one at a time and in order
+        self._delivery_lock = threading.Lock()
+        self._workers = []
+        for index in range(num_workers):
+            worker = threading.Thread(target=self._run, name=f'{name}_{index}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    @staticmethod
+    def request_kind(request: dict) -> str:
+        return 'image' if request.get('image_bytes') is not None else 'audio'
+
+    def submit(self, request: dict) -> None:
+        """Queues a reasoning request (dictionary of ReasoningService.reasoning arguments)."""
+        kind = self.request_kind(request)
+        deadline = time.monotonic() + self.request_deadline if self.request_deadline is not None else None
+        with self._condition:
+            if kind in self.superseding_kinds:
+                for job in self._undelivered:
+                    if job.kind == kind and not job.cancelled:
+                        job.cancelled = True
+                        if self.verbose >= 2:
+                            print(f'Reasoning request {job.sequence} ({kind}) superseded by a newer one.')
+            job = _Job(sequence=self._sequence, request=request, kind=kind, deadline=deadline)
+            self._sequence += 1
+            self._pending.append(job)
+            self._undelivered.append(job)
+            self._condition.notify_all()
+
+    def _can_start(self) -> bool:
+        return len(self._pending) > 0 and (not self.serialize or self._running == 0)
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(self._can_start)
+                job = self._pending.popleft()
+                if self._is_stale(job):
+                    job.discarded = True
+                else:
+                    job.started = True
+                    self._running += 1
+
+            if job.started:
+                try:
+                    job.result = self.process(job.request)
+                except Exception as e:
+                    utils.print_exception(exception=e, message=f'Error processing reasoning request {job.sequence}')
+                with self._condition:
+                    # checked again: a job can be superseded or expire while running
+                    job.discarded = self._is_stale(job)
+                if job.discarded and job.result is not None and self.discard is not None:
+                    # still counted as running: with serialize, the next request starts after this
+                    try:
+                        self.discard(job.request, job.result)
+                    except Exception as e:
+                        utils.print_exception(exception=e, message=f'Error discarding reasoning request '
+                                                                   f'{job.sequence}')
+                with self._condition:
+                    self._running -= 1
+                    self._condition.notify_all()
+            self._complete(job)
+
+    @staticmethod
+    def _is_stale(job: _Job) -> bool:
+        """True if the job has been superseded or is past its deadline."""
+        return job.cancelled or (job.deadline is not None and time.monotonic() > job.deadline)
+
+    def _complete(self, job: _Job) -> None:
+        with self._condition:
+            job.done = True
+        # whoever completes the oldest undelivered job delivers it, and all the following ones already done
+        with self._delivery_lock:
+            while True:
+                with self._condition:
+                    if len(self._undelivered) == 0 or not self._undelivered[0].done:
+                        return
+                    next_job = self._undelivered.popleft()
+                if next_job.started and next_job.result is None:
+                    # failed, the error has already been printed
+                    continue
+                if next_job.discarded:
+                    self.discarded_count += 1
+                    if self.verbose >= 2:
+                        print(f'Reasoning request {next_job.sequence} ({next_job.kind}) discarded (superseded or '
+                              f'past its deadline).')
+                    continue
+                try:
+                    self.deliver(next_job.request, next_job.result)
+                except Exception as e:
+                    utils.print_exception(exception=e, message=f'Error handling reasoning response '
+                                                               f'{next_job.sequence}')
@@ -1,6 +1,8 @@
 import time
+import datetime
 import warnings
 import threading
+import concurrent.futures
 
 from google import genai
 from google.genai import types
@@ -10,7 +12,12 @@ import utils
 import global_constants as gc
 from google_ai_studio import tts_service
 from google_ai_studio import function_declarations
+from google_ai_studio.tts_cache import TtsCache
+from google_ai_studio.function_executor import FunctionExecutor
+from google_ai_studio.model_router import ModelRouter, ModelsUnavailableError
 from google_ai_studio.reasoning_service import ReasoningService
+from google_ai_studio.reasoning_worker_pool import ReasoningWorkerPool
+from google_ai_studio.streaming_reasoning_service import StreamingReasoningService
 
 
 class GoogleAIStudioService:
@@ -19,117 +26,322 @@ class GoogleAIStudioService:
     It manages the communication with the Google AI Studio API and handles requests and responses.
     """
 
-    def __init__(self, shared_variable_manager, **kwargs):
+    def __init__(self, shared_variable_manager, hardware_interaction, audio_asset_bank, **kwargs):
+        """
+        :param shared_variable_manager: instance of SharedVariableManager to manage shared variables.
+        :param hardware_interaction: used to run the local function calls (es. beep).
+        :param audio_asset_bank: AudioAssetBank with the pre-recorded messages (es. the TTS request limit one).
+        """
         parameters = args.import_args(yaml_path=gc.CONFIG_FOLDER_PATH + 'service_interface.yaml', **kwargs)
         self.shared_variable_manager = shared_variable_manager
+        self.hardware_interaction = hardware_interaction
+        self.audio_asset_bank = audio_asset_bank
+        self.verbose = parameters['verbose']
         self.client = genai.Client(api_key=utils.get_api_key(file_path=parameters['api_key_file_path']))
         self.tools = types.Tool(function_declarations=function_declarations.function_list)
         self.reasoning_parameters = parameters['reasoning_parameters']
         self.use_tts_service = parameters['use_tts_service']
-        self.tts_parameters = parameters['tts_parameters']
+        # the TTS models are tried in order (model_name, then fallback_model_names), see ModelRouter
+        self.tts_parameters = dict(parameters['tts_parameters'])
+        self.tts_router = ModelRouter(
+            name='tts',
+            model_names=[self.tts_parameters['model_name']] + (self.tts_parameters.pop('fallback_model_names') or []),
+            verbose=self.verbose,
+            **parameters['model_router_parameters'],
+        )
+        self.tts_pipeline_parameters = parameters['tts_pipeline_parameters']
+        # end of the current TTS outage (all the models out of quota), see notify_tts_unavailable
+        self.tts_unavailable_until = 0.0
+        # the audio of the already synthesized sentences is stored on disk and reused, without API requests
+        tts_cache_parameters = parameters['tts_cache_parameters']
+        self.tts_cache = None
+        if tts_cache_parameters['enabled']:
+            self.tts_cache = TtsCache(
+                folder_path=tts_cache_parameters['folder_path'],
+                max_size=int(tts_cache_parameters['max_size_mb'] * 1e6),
+                verbose=self.verbose,
+            )
+        # synthesized (and cached) at startup, if not already in the cache
+        self.prewarm_phrases = tts_cache_parameters['prewarm_phrases'] or []
         self.image_spoilage_time = parameters['image_spoilage_time']
-        self.verbose = parameters['verbose']
+        self.models_unavailable_asset = parameters['models_unavailable_asset']
+        self.models_unavailable_message = parameters['models_unavailable_message']
+        self.streaming_mode = parameters['streaming_mode']
+
+        # functions that can be run on the Jetson, without sending them to the robot
+        available_local_functions = {
+            'beep': lambda seconds: self.hardware_interaction.set_beep(duration=seconds),
+            'control_gripper': self.hardware_interaction.control_gripper,
+        }
+        self.function_executor = FunctionExecutor(
+            function_list=function_declarations.function_list,
+            forward=self.forward_function_call,
+            local_functions={name: available_local_functions[name] for name in parameters['local_functions']},
+            verbose=self.verbose,
+        )
+
+        self.reasoning_service = None
+        self.reasoning_pool_parameters = parameters['reasoning_pool_parameters']
+        self.reasoning_pool = None
+        self.streaming_reasoning_service = None
+        if self.streaming_mode:
+            self.streaming_reasoning_service = StreamingReasoningService(
+                client=self.client,
+                shared_variable_manager=self.shared_variable_manager,
+                handle_text=self.handle_textual_response,
+                handle_function_call=self.handle_function_call,
+                get_camera_image=self.get_camera_image,
+                tools=self.tools,
+                verbose=self.verbose,
+                **parameters['streaming_parameters'],
+            )
+        else:
+            self.reasoning_service = ReasoningService(
+                client=self.client,
+                tools=self.tools,
+                router_parameters=parameters['model_router_parameters'],
+                get_camera_image=self.get_camera_image,
+                on_models_unavailable=self.notify_models_unavailable,
+                verbose=self.verbose,
+                **self.reasoning_parameters,
+            )
+
+    def handle_textual_response(self, textual_response: str) -> None:
+        """
+        Sends the textual response to the TTS service, or prints it if TTS is disabled.
+        """
+        if self.use_tts_service:
+            self.shared_variable_manager.add_to(queue_name='tts_requests', value=textual_response)
+        elif self.verbose >= 1:
+            print(textual_response)
+
+    def notify_models_unavailable(self, exception: ModelsUnavailableError) -> None:
+        """
+        Tells the user that no reasoning model is available (instead of not answering at all), with the
+        pre-recorded clip if there is one, otherwise with the fixed message.
+        """
+        if self.audio_asset_bank.clips.get(self.models_unavailable_asset) is not None:
+            self.audio_asset_bank.play(
+                shared_variable_manager=self.shared_variable_manager,
+                key=self.models_unavailable_asset,
+            )
+        else:
+            self.handle_textual_response(self.models_unavailable_message)
 
-        self.reasoning_service = ReasoningService(client=self.client, tools=self.tools, **self.reasoning_parameters)
+    def handle_function_call(self, function_call) -> dict:
+        """
+        Runs the function call locally, or forwards it to the robot (see FunctionExecutor).
+        :return: the outcome, {'result': ...} or {'error': ...} if the call has been rejected.
+        """
+        return self.function_executor.execute(function_call)
+
+    def forward_function_call(self, function_call) -> None:
+        """
+        Forwards the function call to the robot (see EthernetClient).
+        """
+        self.shared_variable_manager.add_to(queue_name='functions_to_call', value=function_call)
 
     def run_reasoning_service(self) -> None:
         """
         Continuously processes reasoning requests from the shared variable manager.
-        It sends audio prompts to the Google AI Studio LLM and handles the responses.
+        It hands them to the reasoning worker pool, which sends the audio prompts to the Google AI Studio LLM and
+        handles the responses (see handle_reasoning_response).
         """
+        # with a conversation history the requests must reach the chat one at a time, in order, and a discarded
+        # answer is removed from it
+        self.reasoning_pool = ReasoningWorkerPool(
+            process=lambda request: self.reasoning_service.reasoning(**request),
+            deliver=self.handle_reasoning_response,
+            serialize=self.reasoning_parameters['remember_history'],
+            discard=lambda request, response: self.reasoning_service.discard_last_turn(),
+            verbose=self.verbose,
+            **self.reasoning_pool_parameters,
+        )
         while True:
-            request = self.shared_variable_manager.pop_from(queue_name='reasoning_requests')
+            # blocks until a request is available, no polling
+            request = self.shared_variable_manager.pop_from(queue_name='reasoning_requests', timeout=None)
             if request is not None:
-                textual_response, function_call_response = self.reasoning_service.reasoning(**request)
-                if function_call_response is not None:
-                    if function_call_response.name == "get_camera_image":
-                        current_camera_image = self.get_camera_image()
-                        if current_camera_image is not None:
-                            # send a new reasoning request with the latest image (hoping that the model will remember
-                            # the latest user request)
-                            self.shared_variable_manager.add_to(
-                                queue_name='reasoning_requests',
-                                value={'image_bytes': current_camera_image},
-                            )
-                    else:
-                        self.shared_variable_manager.add_to(
-                            queue_name='functions_to_call',
-                            value=function_call_response,
-                        )
-                if textual_response is not None:
-                    if self.use_tts_service:
-                        self.shared_variable_manager.add_to(queue_name='tts_requests', value=textual_response)
-                    elif self.verbose >= 1:
-                        print(textual_response)
+                self.reasoning_pool.submit(request)
+
+    def handle_reasoning_response(self, request: dict, response: tuple) -> None:
+        """
+        Handles the response of the reasoning model to a request, called by the reasoning worker pool in request order.
+        :param request: the reasoning request.
+        :param response: (textual_response, function_call_response) returned by ReasoningService.reasoning.
+        """
+        textual_response, function_call_response = response
+        if function_call_response is not None:
+            if function_call_response.name == "get_camera_image":
+                # answered within the turn by the reasoning service, this one is past max_tool_rounds
+                warnings.warn('Camera image requested too many times in the same turn, request ignored.')
             else:
-                time.sleep(0.2)
-            time.sleep(0.02)
+                self.handle_function_call(function_call_response)
+        if textual_response is not None:
+            self.handle_textual_response(textual_response)
 
     def run_tts_service(self) -> None:
         """
         Continuously processes TTS requests from the shared variable manager.
-        It converts text prompts to audio using the Google AI Studio TTS service and handles the responses.
+        Each textual response is split into sentences, synthesized concurrently (at most max_parallel_requests at a
+        time) by the Google AI Studio TTS service, and the audio of each sentence is queued for playback as soon as
+        it and the previous ones are ready. So the playback starts after the first sentence, not the whole response.
         """
-        while True:
-            request = self.shared_variable_manager.pop_from(queue_name='tts_requests')
-            if request is not None:
-                try:
-                    audio_response = tts_service.text_to_speech(
-                        text_input=request,
-                        client=self.client,
-                        **self.tts_parameters,
-                        verbose=self.verbose,
-                    )
-                except Exception as e:
-                    print('DEBUG: in TTS general exception')
-                    utils.print_exception(exception=e, message='Error in TTS service')
-                    audio_response = None
-                    # check if the problem is due to reaching the request limit
-                    if hasattr(e, 'code') and e.code == 429:
-                        print("TTS rate limit reached, responses will be printed in the console from now on.")
-                        self.use_tts_service = False
-                        # use also the speaker to deliver error message
-                        try:
-                            error_audio_file_path = gc.ASSETS_FOLDER_PATH + 'TTS_request_limit.wav'
-                            with open(error_audio_file_path, 'rb') as error_audio_file:
-                                error_audio_message = error_audio_file.read()
-                                self.shared_variable_manager.add_to(
-                                    queue_name='audio_to_play',
-                                    value=error_audio_message,
-                                )
-                        except Exception as e:
-                            utils.print_exception(exception=e, message='Error opening/reading error audio file')
-
-                    if self.verbose >= 1:
-                        print(request)
-                if audio_response is not None:
-                    self.shared_variable_manager.add_to(queue_name='audio_to_play', value=audio_response)
+        with concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.tts_pipeline_parameters['max_parallel_requests'],
+            thread_name_prefix='tts_synthesis',
+        ) as executor:
+            self.prewarm_tts_cache(executor=executor)
+            while True:
+                # blocks until a request is available, no polling
+                request = self.shared_variable_manager.pop_from(queue_name='tts_requests', timeout=None)
+                if request is not None:
+                    self.synthesize_in_order(text=request, executor=executor)
+
+    def synthesize_in_order(self, text: str, executor: concurrent.futures.Executor) -> None:
+        """
+        Synthesizes the sentences of a text on the executor, and queues their audio in order as it completes.
+        """
+        sentences = tts_service.split_sentences(
+            text=text,
+            min_length=self.tts_pipeline_parameters['min_sentence_length'],
+        )
+        futures = []
+        for sentence in sentences:
+            cached_audio = self.get_cached_speech(text=sentence)
+            if cached_audio is not None:
+                # played right away (in order), no API request
+                future = concurrent.futures.Future()
+                future.set_result(cached_audio)
             else:
-                time.sleep(0.2)
-            time.sleep(0.02)
+                future = executor.submit(self.synthesize, text=sentence)
+            futures.append(future)
+        for index, future in enumerate(futures):
+            try:
+                audio_response = future.result()
+            except Exception as e:
+                # check if the problem is due to reaching the request limit of all the TTS models
+                if isinstance(e, ModelsUnavailableError):
+                    self.notify_tts_unavailable(exception=e)
+                else:
+                    utils.print_exception(exception=e, message='Error in TTS service')
+                # only this sentence is lost: the cached ones (and all of them after the retry time) are still spoken
+                if self.verbose >= 1:
+                    print(sentences[index])
+                continue
+            if audio_response is not None:
+                self.shared_variable_manager.add_to(queue_name='audio_to_play', value=audio_response)
 
-    def start_services(self) -> None:
+    def notify_tts_unavailable(self, exception: ModelsUnavailableError) -> None:
         """
-        Starts the reasoning and TTS services in separate threads.
+        Plays the pre-recorded request limit message once per outage. TTS stays enabled: until the retry time the
+        router fails fast without API requests, and the sentences are printed instead.
         """
-        try:
-            if self.verbose >= 2:
-                print('Starting reasoning service thread...')
-            # if there are no threads remaining with daemon=False, the main thread will exit
-            reasoning_thread = threading.Thread(
-                target=self.run_reasoning_service,
-                name='reasoning_service',
-                daemon=True,
+        if time.time() < self.tts_unavailable_until:
+            return
+        self.tts_unavailable_until = exception.retry_time or time.time()
+        retry_time = datetime.datetime.fromtimestamp(self.tts_unavailable_until).strftime('%Y-%m-%d %H:%M:%S')
+        print(f'TTS rate limit reached, responses will be printed in the console until {retry_time}.')
+        # use also the speaker to deliver error message (pre-recorded, already in memory)
+        self.audio_asset_bank.play(
+            shared_variable_manager=self.shared_variable_manager,
+            key='TTS_request_limit',
+        )
+
+    def get_cached_speech(self, text: str):
+        """
+        :return: the cached audio of the text, or None if it is not cached (or the cache is disabled).
+        """
+        if self.tts_cache is None:
+            return None
+        # the audio of any model of the chain, the preferred one first
+        for model_name in self.tts_router.model_names:
+            cached_audio = self.tts_cache.get(
+                text=text,
+                voice_name=self.tts_parameters['voice_name'],
+                model_name=model_name,
             )
-            reasoning_thread.start()
-            self.shared_variable_manager.add_to(queue_name='running_components', value='reasoning_service')
-            if self.verbose >= 1:
-                print('Reasoning service thread started.')
+            if cached_audio is not None:
+                return cached_audio
+        return None
+
+    def synthesize(self, text: str):
+        """
+        Converts the text to audio with the Google AI Studio TTS service, and stores the audio in the cache.
+        :raise ModelsUnavailableError: if no TTS model is available.
+        """
+        model_name, audio_response = self.tts_router.call(lambda model_name: tts_service.text_to_speech(
+            text_input=text,
+            client=self.client,
+            **{**self.tts_parameters, 'model_name': model_name},
+            verbose=self.verbose,
+        ))
+        if self.tts_cache is not None and audio_response is not None:
+            self.tts_cache.put(
+                text=text,
+                voice_name=self.tts_parameters['voice_name'],
+                model_name=model_name,
+                pcm_bytes=audio_response,
+            )
+        return audio_response
+
+    def prewarm_tts_cache(self, executor: concurrent.futures.Executor) -> None:
+        """
+        Synthesizes in the background the pre-warm phrases missing from the cache, so they are free when needed.
+        The phrases are split into sentences like the responses (see synthesize_in_order), so the cached entries are
+        the ones the responses look up.
+        """
+        if self.tts_cache is None:
+            return
+        for phrase in self.prewarm_phrases:
+            for sentence in tts_service.split_sentences(
+                text=phrase,
+                min_length=self.tts_pipeline_parameters['min_sentence_length'],
+            ):
+                if not any(self.tts_cache.contains(
+                    text=sentence,
+                    voice_name=self.tts_parameters['voice_name'],
+                    model_name=model_name,
+                ) for model_name in self.tts_router.model_names):
+                    if self.verbose >= 2:
+                        print(f'Pre-warming the TTS cache: "{sentence}"')
+                    executor.submit(self.synthesize, text=sentence).add_done_callback(self._report_prewarm_error)
+
+    @staticmethod
+    def _report_prewarm_error(future: concurrent.futures.Future) -> None:
+        if future.exception() is not None:
+            utils.print_exception(exception=future.exception(), message='Error pre-warming the TTS cache')
+
+    async def run_streaming_reasoning_service(self) -> None:
+        """
+        Streaming mode only: coroutine to run on the main event loop, it streams the microphone audio to the
+        reasoning model while the user is speaking (see StreamingReasoningService).
+        """
+        await self.streaming_reasoning_service.run()
 
-        except Exception as e:
-            utils.print_exception(exception=e, message='Error starting reasoning service thread')
-            self.shared_variable_manager.remove_from(queue_name='running_components', value='reasoning_service')
-            raise
+    def start_services(self) -> None:
+        """
+        Starts the reasoning and TTS services in separate threads. In streaming mode the reasoning service is a
+        coroutine instead (see run_streaming_reasoning_service), started with the main event loop.
+        """
+        if not self.streaming_mode:
+            try:
+                if self.verbose >= 2:
+                    print('Starting reasoning service thread...')
+                # if there are no threads remaining with daemon=False, the main thread will exit
+                reasoning_thread = threading.Thread(
+                    target=self.run_reasoning_service,
+                    name='reasoning_service',
+                    daemon=True,
+                )
+                reasoning_thread.start()
+                self.shared_variable_manager.add_to(queue_name='running_components', value='reasoning_service')
+                if self.verbose >= 1:
+                    print('Reasoning service thread started.')
+
+            except Exception as e:
+                utils.print_exception(exception=e, message='Error starting reasoning service thread')
+                self.shared_variable_manager.remove_from(queue_name='running_components', value='reasoning_service')
+                raise
 
         if self.use_tts_service:
             try:
@@ -148,11 +360,28 @@ class GoogleAIStudioService:
                 if self.verbose >= 1:
                     print('TTS service disabled due to an error. From now on, the responses will be printed.')
 
-    def get_camera_image(self):
-        image_dict = self.shared_variable_manager.get_variable(variable_name='latest_camera_image')
-        if time.time() - image_dict['timestamp'] < self.image_spoilage_time:
-            return image_dict['image']
-        else:
-            warnings.warn(f'Image is too old ({time.time() - image_dict["timestamp"]} s). Please wait for a new image'
+    def get_camera_image(self, wait: bool = True):
+        """
+        :param wait: if the latest image is older than image_spoilage_time, wait for a fresh one (at most
+            image_spoilage_time seconds). If False, return None right away instead.
+        :return: the latest camera image (encoded, es. JPEG), or None if there is no fresh one.
+        """
+        frame_buffer = self.shared_variable_manager.get_variable(variable_name='camera_frame_buffer')
+        if frame_buffer is None:
+            warnings.warn('Camera not available.')
+            return None
+        frame = frame_buffer.read_latest()
+        if (frame is None or time.time() - frame.timestamp >= self.image_spoilage_time) and not wait:
+            return None
+        if frame is None or time.time() - frame.timestamp >= self.image_spoilage_time:
+            # the camera may be in low-power mode: the read above woke it up, wait for a fresh frame
+            frame = frame_buffer.wait_for_frame(
+                newer_than=time.time() - self.image_spoilage_time,
+                timeout=self.image_spoilage_time,
+            )
+        if frame is None:
+            warnings.warn(f'No camera image newer than {self.image_spoilage_time} s. Please wait for a new image'
                           f' to be captured')
             return None
+        # copied, because the camera reuses the slot while the request is still waiting for the API
+        return bytes(frame.image)
@@ -0,0 +1,162 @@
+import asyncio
+
+from google import genai
+from google.genai import types
+
+import utils
+from ethernet_connection.transport import run_together
+from sensors.microphone.microphone_listener import STREAM_START, STREAM_AUDIO, STREAM_END
+
+
+class StreamingReasoningService:
+    """
+    Streaming counterpart of ReasoningService, based on the Google AI Studio Live API. The microphone listener
+    queues the audio in 'audio_stream' while the user is still speaking (see MicrophoneListener streaming_mode), and
+    every chunk is forwarded to the Live session as soon as it arrives. The end of the utterance is signaled
+    explicitly (activity end) by the listener, the server-side voice detection is disabled. So when the user stops
+    talking the model already has the whole utterance, and the time to the first response does not depend on how
+    long the utterance was.
+
+    The session is opened when the first utterance starts (not at startup, so an idle robot does not keep a Live
+    session open) and reopened whenever it drops. With remember_history it is kept open across utterances,
+    otherwise a new session is used for each utterance.
+    """
+    def __init__(self,
+                 client: genai.Client,
+                 shared_variable_manager,
+                 model_name: str,
+                 handle_text,
+                 handle_function_call,
+                 get_camera_image,
+                 tools: types.Tool = None,
+                 prompt_template: str = None,
+                 remember_history: bool = False,
+                 input_sample_rate: int = 16000,
+                 image_mime_type: str = 'image/jpeg',
+                 verbose: int = 0,
+                 ):
+        """
+        :param client: genai.Client: The Google AI Studio client.
+        :param shared_variable_manager: instance of SharedVariableManager, the audio is read from 'audio_stream'.
+        :param model_name: str: A model supporting the Live API.
+        :param handle_text: callable(text), invoked with the whole textual response of every turn.
+        :param handle_function_call: callable(function_call) -> dict, invoked for every function call except
+            get_camera_image. It returns the function response sent back to the model ({'result': ...} or
+            {'error': ...}).
+        :param get_camera_image: callable() -> JPEG bytes or None (blocking), used to answer get_camera_image.
+        :param tools: types.Tool: Optional tools the model can call.
+        :param prompt_template: str: Used as system instruction of the session.
+        :param remember_history: bool: Whether to keep the same session (and its history) across utterances.
+        :param input_sample_rate: int: Sample rate of the streamed 16-bit mono PCM, must match the microphone stream.
+        :param image_mime_type: str: The MIME type of the camera images.
+        :param verbose: Verbosity level for logging.
+        """
+        self.client = client
+        self.shared_variable_manager = shared_variable_manager
+        self.model_name = model_name
+        self.handle_text = handle_text
+        self.handle_function_call = handle_function_call
+        self.get_camera_image = get_camera_image
+        self.tools = tools if tools is not None else types.Tool(function_declarations=[])
+        self.remember_history = remember_history
+        self.audio_mime_type = f'audio/pcm;rate={input_sample_rate}'
+        self.image_mime_type = image_mime_type
+        self.verbose = verbose
+        self.config = types.LiveConnectConfig(
+            response_modalities=[types.Modality.TEXT],
+            tools=[self.tools],
+            system_instruction=prompt_template,
+            # the end of the utterance is signaled by the microphone listener, not detected by the server
+            realtime_input_config=types.RealtimeInputConfig(
+                automatic_activity_detection=types.AutomaticActivityDetection(disabled=True),
+            ),
+        )
+
+    async def _send_audio(self, session) -> None:
+        """
+        Forwards the queued utterances to the session, starting from one already started. Without remember_history
+        it returns at the end of the first utterance.
+        """
+        await session.send_realtime_input(activity_start=types.ActivityStart())
+        while True:
+            event, pcm_bytes = await self.shared_variable_manager.pop_from_async(queue_name='audio_stream')
+            if event == STREAM_AUDIO:
+                await session.send_realtime_input(audio=types.Blob(data=pcm_bytes, mime_type=self.audio_mime_type))
+            elif event == STREAM_START:
+                await session.send_realtime_input(activity_start=types.ActivityStart())
+            elif event == STREAM_END:
+                await session.send_realtime_input(activity_end=types.ActivityEnd())
+                if self.verbose >= 3:
+                    print('End of the utterance sent to the streaming session.')
+                if not self.remember_history:
+                    return
+
+    async def _answer_function_calls(self, session, function_calls) -> None:
+        function_responses = []
+        for function_call in function_calls:
+            if function_call.name == 'get_camera_image':
+                # it can wait for the camera to wake up, do not block the event loop
+                image_bytes = await asyncio.to_thread(self.get_camera_image)
+                if image_bytes is not None:
+                    await session.send_realtime_input(
+                        video=types.Blob(data=image_bytes, mime_type=self.image_mime_type),
+                    )
+                    result = {'result': 'The current camera image has been sent.'}
+                else:
+                    result = {'error': 'No recent camera image available.'}
+            else:
+                # es. the validation error of a rejected call, so the model does not assume it has been executed
+                result = self.handle_function_call(function_call)
+            function_responses.append(types.FunctionResponse(
+                id=function_call.id,
+                name=function_call.name,
+                response=result,
+            ))
+        # the model waits for the responses before going on with the turn
+        await session.send_tool_response(function_responses=function_responses)
+
+    async def _receive_responses(self, session) -> None:
+        """
+        Handles the responses of every turn. Without remember_history it returns after the first complete turn.
+        """
+        while True:
+            text_parts = []
+            num_messages = 0
+            # receive() stops at the end of each turn
+            async for message in session.receive():
+                num_messages += 1
+                if message.text:
+                    text_parts.append(message.text)
+                if message.tool_call is not None and message.tool_call.function_calls:
+                    await self._answer_function_calls(session, message.tool_call.function_calls)
+            if num_messages == 0:
+                raise ConnectionError('Streaming reasoning session closed by the server')
+            if len(text_parts) > 0:
+                self.handle_text(''.join(text_parts))
+            if not self.remember_history:
+                return
+
+    async def run(self) -> None:
+        """
+        Opens a Live session at the start of an utterance and streams the audio to it until the session drops (or,
+        without remember_history, until the utterance has been answered). Self-healing.
+        """
+        self.shared_variable_manager.add_to(queue_name='running_components', value='streaming_reasoning_service')
+        try:
+            while True:
+                event, _ = await self.shared_variable_manager.pop_from_async(queue_name='audio_stream')
+                if event != STREAM_START:
+                    # the rest of an utterance whose session dropped
+                    continue
+                try:
+                    async with self.client.aio.live.connect(model=self.model_name, config=self.config) as session:
+                        if self.verbose >= 2:
+                            print('Streaming reasoning session opened.')
+                        await run_together(self._send_audio(session), self._receive_responses(session))
+                except Exception as e:
+                    utils.print_exception(exception=e, message='Streaming reasoning session closed')
+        finally:
+            self.shared_variable_manager.remove_from(
+                queue_name='running_components',
+                value='streaming_reasoning_service',
+            )
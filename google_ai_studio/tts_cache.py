@@ -0,0 +1,123 @@
+import os
+import hashlib
+import threading
+import collections
+from pathlib import Path
+
+import utils
+
+_FILE_EXTENSION = '.pcm'
+
+
+def normalize_text(text: str) -> str:
+    """Case and whitespace do not change the speech, es. "Ok." and " ok. " share the same audio."""
+    return ' '.join(text.split()).casefold()
+
+
+class TtsCache:
+    """
+    Persistent cache of the TTS audio, so the phrases the robot says all the time (es. "Ok.", error messages) cost no
+    API request after the first time.
+
+    Content addressed: each entry is a PCM file named after the SHA-256 of the normalized text, the voice and the TTS
+    model, so changing voice or model never plays stale audio. An in-memory index, in least recently used order,
+    keeps the total size under max_size bytes: the least recently used files are deleted first. The index is rebuilt
+    from the folder at startup, ordered by file modification time (updated on every hit).
+    """
+
+    def __init__(self, folder_path: str, max_size: int, verbose: int = 0):
+        """
+        :param folder_path: folder of the PCM files, created if missing.
+        :param max_size: maximum total size of the files, in bytes.
+        :param verbose: verbosity level.
+        """
+        self.folder_path = Path(folder_path)
+        self.max_size = max_size
+        self.verbose = verbose
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # key -> file size, least recently used first
+        self._index = collections.OrderedDict()
+        self._size = 0
+
+        self.folder_path.mkdir(parents=True, exist_ok=True)
+        files = sorted(self.folder_path.glob('*' + _FILE_EXTENSION), key=lambda path: path.stat().st_mtime)
+        for file_path in files:
+            self._index[file_path.stem] = file_path.stat().st_size
+            self._size += self._index[file_path.stem]
+        with self._lock:
+            self._evict()
+        if self.verbose >= 2:
+            print(f'TTS cache: {len(self._index)} entries, {self._size / 1e6:.1f} MB.')
+
+    @staticmethod
+    def key(text: str, voice_name: str, model_name: str) -> str:
+        content = '\0'.join((normalize_text(text), voice_name, model_name))
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def _file_path(self, key: str) -> Path:
+        return self.folder_path / (key + _FILE_EXTENSION)
+
+    def contains(self, text: str, voice_name: str, model_name: str) -> bool:
+        with self._lock:
+            return self.key(text=text, voice_name=voice_name, model_name=model_name) in self._index
+
+    def get(self, text: str, voice_name: str, model_name: str):
+        """
+        :return: the cached PCM bytes, or None if the text has never been synthesized with this voice and model.
+        """
+        key = self.key(text=text, voice_name=voice_name, model_name=model_name)
+        with self._lock:
+            if key not in self._index:
+                self.misses += 1
+                return None
+            self._index.move_to_end(key)
+            self.hits += 1
+        file_path = self._file_path(key)
+        try:
+            pcm_bytes = file_path.read_bytes()
+            # the recency survives restarts
+            os.utime(file_path)
+        except OSError as e:
+            utils.print_exception(exception=e, message=f'Error reading the TTS cache file "{file_path}"')
+            with self._lock:
+                if key in self._index:
+                    self._size -= self._index.pop(key)
+            return None
+        if self.verbose >= 3:
+            print(f'TTS cache hit: "{text}"')
+        return pcm_bytes
+
+    def put(self, text: str, voice_name: str, model_name: str, pcm_bytes: bytes) -> None:
+        """Stores the PCM of a text, evicting the least recently used entries if the cache is full."""
+        if not pcm_bytes or len(pcm_bytes) > self.max_size:
+            return
+        key = self.key(text=text, voice_name=voice_name, model_name=model_name)
+        file_path = self._file_path(key)
+        # written to a temporary file first, so a crash never leaves a truncated entry
+        temporary_path = file_path.with_suffix(f'.{threading.get_ident()}.tmp')
+        try:
+            temporary_path.write_bytes(pcm_bytes)
+            os.replace(temporary_path, file_path)
+        except OSError as e:
+            utils.print_exception(exception=e, message=f'Error writing the TTS cache file "{file_path}"')
+            return
+        with self._lock:
+            if key in self._index:
+                self._size -= self._index[key]
+            self._index[key] = len(pcm_bytes)
+            self._index.move_to_end(key)
+            self._size += len(pcm_bytes)
+            self._evict()
+
+    def _evict(self) -> None:
+        while self._size > self.max_size and len(self._index) > 0:
+            key, size = self._index.popitem(last=False)
+            self._size -= size
+            try:
+                self._file_path(key).unlink()
+            except OSError as e:
+                utils.print_exception(exception=e, message='Error deleting a TTS cache file')
+            if self.verbose >= 3:
+                print(f'TTS cache entry {key} evicted.')
@@ -1,3 +1,4 @@
+import re
 import time
 from pathlib import Path
 
@@ -7,6 +8,29 @@ from google.genai import types
 import utils
 import global_constants as gc
 
+# end of a sentence: punctuation followed by whitespace
+_SENTENCE_END = re.compile(r'(?<=[.!?;:])\s+')
+
+
+def split_sentences(text: str, min_length: int = 0) -> list:
+    """
+    Splits a text into sentences, to be synthesized separately. Sentences shorter than min_length characters are
+    merged with the following one (each one is a separate request, too many short ones only add latency).
+    """
+    sentences = []
+    current = ''
+    for sentence in _SENTENCE_END.split(text.strip()):
+        current = f'{current} {sentence}' if current else sentence
+        if len(current) >= min_length:
+            sentences.append(current)
+            current = ''
+    if current:
+        if len(sentences) > 0 and len(current) < min_length:
+            sentences[-1] = f'{sentences[-1]} {current}'
+        else:
+            sentences.append(current)
+    return sentences
+
 
 def text_to_speech(text_input: str,
                    client: genai.Client,
@@ -1,11 +1,124 @@
 #!/usr/bin/env python3
 # coding: utf-8
+import time
+import heapq
 import smbus
+import threading
+import itertools
+import numpy as np
+from concurrent.futures import Future
 
 import args
 import utils
 import global_constants as gc
 
+# priorities of the I2C commands, lower values are written first
+SERVO_PRIORITY = 0
+BUZZER_PRIORITY = 1
+LED_PRIORITY = 2
+
+NUM_SERVOS = 6
+# register of servo 1, servo N is at 0x50 + N
+_SERVO_REGISTER = 0x50
+
+
+class I2CCommandQueue:
+    """
+    Owns the I2C bus of the expansion board: a single worker thread writes all the commands, in priority order
+    (servos and reset first, then the buzzer, then the LED) and in submission order within the same priority.
+    Callers never wait for the bus, they get a concurrent.futures.Future completed when the command has been written.
+
+    Commands submitted with a coalescing key replace the pending command with the same key (es. the LED color, the
+    angle of a servo): only the latest value is written, and all the callers get the same future. The replacing
+    command is queued as new, so it is still written after any command submitted before it.
+    """
+
+    def __init__(self, name: str = 'i2c_writer'):
+        self._heap = []
+        # coalescing key -> pending heap entry
+        self._pending = {}
+        self._counter = itertools.count()
+        self._busy = False
+        self._condition = threading.Condition()
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, priority: int, function, arguments: tuple = (), key=None, error_message: str = None) -> Future:
+        """
+        Queues function(*arguments) to be run on the bus thread.
+        :param priority: one of the *_PRIORITY constants.
+        :param key: coalescing key, None if the command must always be written.
+        :param error_message: printed (with the exception) if the command fails.
+        :return: Future with the result of the command.
+        """
+        with self._condition:
+            future = Future()
+            old_entry = self._pending.get(key) if key is not None else None
+            if old_entry is not None:
+                # superseded: it is skipped when popped, its callers get the result of this command
+                old_entry[-1] = False
+                future = old_entry[5]
+            # [priority, sequence, key, function, arguments, future, error_message, valid]
+            entry = [priority, next(self._counter), key, function, arguments, future, error_message, True]
+            heapq.heappush(self._heap, entry)
+            if key is not None:
+                self._pending[key] = entry
+            self._condition.notify_all()
+        return future
+
+    def _run(self) -> None:
+        while True:
+            with self._condition:
+                self._condition.wait_for(lambda: len(self._heap) > 0)
+                priority, _, key, function, arguments, future, error_message, valid = heapq.heappop(self._heap)
+                if not valid:
+                    continue
+                if key is not None:
+                    del self._pending[key]
+                self._busy = True
+            try:
+                future.set_result(function(*arguments))
+            except Exception as e:
+                utils.print_exception(exception=e, message=error_message)
+                future.set_exception(e)
+            with self._condition:
+                self._busy = False
+                self._condition.notify_all()
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """
+        Waits until all the queued commands have been written (es. before exiting, the worker is a daemon thread).
+        :return: True if nothing is left to write.
+        """
+        with self._condition:
+            return self._condition.wait_for(lambda: len(self._heap) == 0 and not self._busy, timeout=timeout)
+
+
+def _all_done(futures: list) -> Future:
+    """
+    :return: Future completed when all the futures are, with the first exception if any of them failed.
+    """
+    combined = Future()
+    remaining = [len(futures)]
+    lock = threading.Lock()
+
+    def on_done(_):
+        with lock:
+            remaining[0] -= 1
+            if remaining[0] > 0:
+                return
+        exceptions = [future.exception() for future in futures if future.exception() is not None]
+        if len(exceptions) > 0:
+            combined.set_exception(exceptions[0])
+        else:
+            combined.set_result(None)
+
+    if len(futures) == 0:
+        combined.set_result(None)
+    for future in futures:
+        future.add_done_callback(on_done)
+    return combined
+
 
 class HardwareInteraction:
     def __init__(self, **kwargs):
@@ -13,49 +126,226 @@ class HardwareInteraction:
         self.bus_address = parameters['bus_address']
         self.bus = smbus.SMBus(parameters['smbus_id'])
         self.verbose = parameters['verbose']
+        # used when the commands are written synchronously, by whatever thread calls them
+        self.bus_lock = threading.Lock()
+
+        # last color written (or queued) to the RGB LED, writes of the same color are skipped
+        self.led_color = None
+        # if True, every I2C command is written by a single bus-owner thread (see I2CCommandQueue), and the methods
+        # below return immediately with a Future
+        self.async_bus_writes = parameters['async_bus_writes']
+        self.command_queue = I2CCommandQueue() if self.async_bus_writes else None
+
+        # last angle commanded to each servo (index 0 = servo 1), None until the first command
+        self.servo_angles = [None] * NUM_SERVOS
+        # gripper servos (see control_gripper)
+        self.gripper_parameters = parameters['gripper_parameters']
+        # trajectories (see move_to_pose) stream set-points at this rate (Hz) from the 'servo_trajectory' thread
+        self.control_rate = parameters['control_rate']
+        self._trajectory = None
+        self._trajectory_condition = threading.Condition()
+        self._trajectory_thread = None
 
         self.shared_variable_manager = parameters['shared_variable_manager']
         self.shared_variable_manager.add_to(queue_name='running_components', value='hardware_interaction')
 
-    # Set the specified color of the RGB light. Red, green, and blue: 0-255
-    def rgb_led(self, red: int, green: int, blue: int) -> None:
+    def _submit(self, priority: int, function, arguments: tuple, key=None, error_message: str = None) -> Future:
+        """
+        Queues the command on the bus thread, or writes it right away (holding the bus lock) if async_bus_writes is
+        False. Either way errors are printed, and set on the returned Future.
+        """
+        if self.command_queue is not None:
+            return self.command_queue.submit(
+                priority=priority,
+                function=function,
+                arguments=arguments,
+                key=key,
+                error_message=error_message,
+            )
+        future = Future()
         try:
-            self.bus.write_i2c_block_data(self.bus_address, 0x02, [red & 0xff, green & 0xff, blue & 0xff])
+            with self.bus_lock:
+                future.set_result(function(*arguments))
         except Exception as e:
-            utils.print_exception(exception=e, message='arm_rgb_set I2C error')
+            utils.print_exception(exception=e, message=error_message)
+            future.set_exception(e)
+        return future
 
-    # Restart the driver board
-    def arm_reset(self) -> None:
+    # Set the specified color of the RGB light. Red, green, and blue: 0-255
+    def rgb_led(self, red: int, green: int, blue: int) -> Future:
+        color = (red & 0xff, green & 0xff, blue & 0xff)
+        # callers (es. the microphone listener) set the color for every audio frame, the bus is only used on changes
+        if color == self.led_color:
+            future = Future()
+            future.set_result(None)
+            return future
+        self.led_color = color
+        return self._submit(
+            priority=LED_PRIORITY,
+            function=self._write_led,
+            arguments=(color,),
+            key='led',
+            error_message='arm_rgb_set I2C error',
+        )
+
+    def _write_led(self, color: tuple) -> None:
         try:
-            self.bus.write_byte_data(self.bus_address, 0x05, 0x01)
-        except Exception as e:
-            utils.print_exception(exception=e, message='arm_reset I2C error')
+            self.bus.write_i2c_block_data(self.bus_address, 0x02, list(color))
+        except Exception:
+            # unknown LED state: the next rgb_led() call writes again
+            self.led_color = None
+            raise
+
+    # Restart the driver board
+    def arm_reset(self) -> Future:
+        return self._submit(
+            priority=SERVO_PRIORITY,
+            function=self.bus.write_byte_data,
+            arguments=(self.bus_address, 0x05, 0x01),
+            error_message='arm_reset I2C error',
+        )
 
     # PWD servo control servo_id: 1-6 (0 controls all servos). Angle: 0-180 degrees.
-    def pwm_servo_write(self, servo_id: int, angle: int) -> None:
-        try:
-            if servo_id == 0:
-                self.bus.write_byte_data(self.bus_address, 0x57, angle & 0xff)
+    def pwm_servo_write(self, servo_id: int, angle: int) -> Future:
+        if servo_id == 0:
+            self.servo_angles = [angle & 0xff] * NUM_SERVOS
+        else:
+            self.servo_angles[servo_id - 1] = angle & 0xff
+        # only the latest angle of each servo matters
+        return self._submit(
+            priority=SERVO_PRIORITY,
+            function=self.bus.write_byte_data,
+            arguments=(self.bus_address, 0x57 if servo_id == 0 else _SERVO_REGISTER + servo_id, angle & 0xff),
+            key=('servo', servo_id),
+            error_message='arm_pwm_servo_write I2C error',
+        )
+
+    def set_pose(self, angles) -> Future:
+        """
+        Moves all the given servos at once: their writes are queued together, so the bus thread writes them back to
+        back. They are coalesced with the other writes of the same servos (pwm_servo_write, older poses still queued),
+        so only the latest angle of each servo is written, and servo_angles always matches the last write. The
+        servo registers are written one by one: the board firmware does not document a block write for them.
+        :param angles: NUM_SERVOS angles (0-180 degrees) for servos 1-6, None leaves a servo unchanged.
+        :return: Future completed when the pose has been written.
+        """
+        assert len(angles) == NUM_SERVOS, f'A pose needs {NUM_SERVOS} angles, {len(angles)} given'
+        futures = [
+            self.pwm_servo_write(servo_id=index + 1, angle=int(angle))
+            for index, angle in enumerate(angles) if angle is not None
+        ]
+        return _all_done(futures)
+
+    def move_to_pose(self, angles, duration: float) -> Future:
+        """
+        Moves smoothly to the pose in "duration" seconds: the set-points (minimum-jerk interpolation from the last
+        commanded angles) are computed at once, then streamed at control_rate by the 'servo_trajectory' thread. A new
+        trajectory replaces the one in progress, starting from the last set-point sent. Servos never commanded before
+        go straight to their target.
+        :param angles: NUM_SERVOS angles (0-180 degrees) for servos 1-6, None leaves a servo unchanged.
+        :param duration: duration of the movement, in seconds.
+        :return: Future completed with True at the end of the movement, or False if it has been replaced.
+        """
+        assert len(angles) == NUM_SERVOS, f'A pose needs {NUM_SERVOS} angles, {len(angles)} given'
+        target = np.array([np.nan if angle is None else angle for angle in angles], dtype=np.float64)
+        start = np.array([np.nan if angle is None else angle for angle in self.servo_angles], dtype=np.float64)
+        start = np.where(np.isnan(start), target, start)
+        num_steps = max(1, int(round(duration * self.control_rate)))
+        progress = np.arange(1, num_steps + 1) / num_steps
+        # minimum-jerk profile: zero speed and acceleration at both ends
+        progress = progress ** 3 * (10 - 15 * progress + 6 * progress ** 2)
+        # (num_steps, NUM_SERVOS), NaN for the servos left unchanged
+        set_points = np.rint(start + np.outer(progress, target - start))
+
+        future = Future()
+        with self._trajectory_condition:
+            if self._trajectory is not None:
+                self._trajectory[1].set_result(False)
+            self._trajectory = (set_points, future)
+            if self._trajectory_thread is None:
+                self._trajectory_thread = threading.Thread(
+                    target=self._run_trajectories,
+                    name='servo_trajectory',
+                    daemon=True,
+                )
+                self._trajectory_thread.start()
+            self._trajectory_condition.notify_all()
+        return future
+
+    def _run_trajectories(self) -> None:
+        period = 1 / self.control_rate
+        while True:
+            with self._trajectory_condition:
+                self._trajectory_condition.wait_for(lambda: self._trajectory is not None)
+                trajectory = self._trajectory
+            set_points, future = trajectory
+            next_time = time.monotonic()
+            last_set_point = None
+            for set_point in set_points:
+                # identical consecutive set-points (slow movements, ends of the profile) are not written again
+                if last_set_point is None or not np.array_equal(set_point, last_set_point, equal_nan=True):
+                    self.set_pose([None if np.isnan(angle) else int(angle) for angle in set_point])
+                    last_set_point = set_point
+                # fixed rate, without drift: the next tick is scheduled from the previous one, not from now
+                next_time += period
+                with self._trajectory_condition:
+                    # woken up early by a new trajectory
+                    self._trajectory_condition.wait_for(
+                        lambda: self._trajectory is not trajectory,
+                        timeout=max(0.0, next_time - time.monotonic()),
+                    )
+                    if self._trajectory is not trajectory:
+                        break
             else:
-                self.bus.write_byte_data(self.bus_address, 0x50 + servo_id, angle & 0xff)
-        except Exception as e:
-            utils.print_exception(exception=e, message='arm_pwm_servo_write I2C error')
+                with self._trajectory_condition:
+                    if self._trajectory is trajectory:
+                        self._trajectory = None
+                        future.set_result(True)
+
+    def control_gripper(self, rotation: int = None, opening: bool = None) -> Future:
+        """
+        Rotates and opens/closes the gripper smoothly (see move_to_pose). Same arguments as the control_gripper
+        function call, so it can be run locally (see FunctionExecutor).
+        :param rotation: rotation angle of the gripper (0-180 degrees), None leaves it unchanged.
+        :param opening: True to open the gripper, False to close it, None leaves it unchanged.
+        :return: Future completed at the end of the movement.
+        """
+        angles = [None] * NUM_SERVOS
+        if rotation is not None:
+            angles[self.gripper_parameters['rotation_servo'] - 1] = rotation
+        if opening is not None:
+            angles[self.gripper_parameters['opening_servo'] - 1] = (
+                self.gripper_parameters['open_angle'] if opening else self.gripper_parameters['closed_angle'])
+        return self.move_to_pose(angles=angles, duration=self.gripper_parameters['movement_duration'])
 
     # Turn on the buzzer for a specified duration. If duration is 0, turn off the buzzer. Duration: 0.1-5 seconds.
     # 0.1 and 5 seconds.
-    def set_beep(self, duration: float) -> None:
+    def set_beep(self, duration: float) -> Future:
         """
         Set the buzzer to beep for a specified duration.
         :param duration: Duration in seconds for which the buzzer should beep.
         """
-        try:
-            if duration == 0:
-                self.bus.write_byte_data(self.bus_address, 0x06, 0x00)
-            else:
-                if duration < 0.1 or duration > 5:
-                    raise ValueError(f'Duration must be between 0.1 and 5 seconds. Given: {duration} seconds.')
-                # convert seconds to deciseconds (= 0.1 seconds), and convert to INT
-                duration = int(duration * 10)
-                self.bus.write_byte_data(self.bus_address, 0x06, duration & 0xff)
-        except Exception as e:
+        if duration != 0 and (duration < 0.1 or duration > 5):
+            e = ValueError(f'Duration must be between 0.1 and 5 seconds. Given: {duration} seconds.')
             utils.print_exception(exception=e, message='set_beep I2C error')
+            future = Future()
+            future.set_exception(e)
+            return future
+        # convert seconds to deciseconds (= 0.1 seconds), and convert to INT
+        deciseconds = int(duration * 10)
+        # every beep is written, they are not coalesced
+        return self._submit(
+            priority=BUZZER_PRIORITY,
+            function=self.bus.write_byte_data,
+            arguments=(self.bus_address, 0x06, deciseconds & 0xff),
+            error_message='set_beep I2C error',
+        )
+
+    def flush(self, timeout: float = 1.0) -> bool:
+        """
+        Waits until the queued I2C commands have been written (es. before exiting).
+        :return: True if nothing is left to write.
+        """
+        if self.command_queue is None:
+            return True
+        return self.command_queue.flush(timeout=timeout)
@@ -1,8 +1,8 @@
-import time
+import signal
+import asyncio
 import threading
 
 import args
-import utils
 import global_constants as gc
 from sensors.camera.usb_camera import UsbCamera
 from hardware_interaction import HardwareInteraction
@@ -17,14 +17,15 @@ from ethernet_connection.frame_streamer import FrameStreamerClient
 def main_thread(**kwargs):
     """
     Main thread function that initializes the Google AI Studio service interface and the microphone listener.
-    It continuously checks for function calls and audio responses, processing them as they come in.
+    It then hands the process lifecycle to an asyncio event loop (see run_event_loop), which only wakes up when
+    there is something to do (audio to play, a socket ready, a timer) and shuts everything down on SIGINT/SIGTERM.
     """
     parameters = args.import_args(yaml_path=gc.CONFIG_FOLDER_PATH + 'main_thread.yaml', **kwargs)
     verbose = parameters['verbose']
     enable_voice_interaction = parameters['enable_voice_interaction']
 
     # Initialize the shared variable manager
-    shared_variable_manager = SharedVariableManager(verbose=verbose)
+    shared_variable_manager = SharedVariableManager(verbose=verbose, queue_limits=parameters['queue_limits'])
 
     # Initialize the hardware interaction interface
     hardware_interaction = HardwareInteraction(shared_variable_manager=shared_variable_manager, verbose=verbose)
@@ -33,43 +34,51 @@ def main_thread(**kwargs):
     # a single switch. The microphone and speakers now live on the RDK X3 main board, reached over the wired
     # link (mic stream in, TTS playback out). The Google API this feature uses has changed and needs reworking,
     # so it is disabled for now (see main_thread.yaml).
+    # Coroutines run on the main event loop: all the RDK X3 links (see ethernet_connection/transport.py) and the
+    # microphone listener share it, instead of each having its own OS threads.
+    services = []
+    links = []
     speaker_client = None
     if enable_voice_interaction:
         from google_ai_studio import service_interface
         from sensors.microphone.microphone_listener import MicrophoneListener
         from ethernet_connection.speaker_client import SpeakerClient
+        from audio_asset_bank import AudioAssetBank
+
+        # pre-recorded messages, loaded and converted to the speaker format once
+        audio_asset_bank = AudioAssetBank(verbose=verbose)
 
         # Initialize the Google AI Studio service interface
         google_ai_studio_service = service_interface.GoogleAIStudioService(
             shared_variable_manager=shared_variable_manager,
+            hardware_interaction=hardware_interaction,
+            audio_asset_bank=audio_asset_bank,
             verbose=verbose,
         )
         google_ai_studio_service.start_services()
+        if google_ai_studio_service.streaming_mode:
+            services.append(google_ai_studio_service.run_streaming_reasoning_service())
 
         # Initialize the microphone listener (receives the RDK X3 microphone stream over the wired link)
         microphone_listener = MicrophoneListener(
             shared_variable_manager=shared_variable_manager,
             hardware_interaction=hardware_interaction,
+            streaming_mode=google_ai_studio_service.streaming_mode,
             verbose=verbose,
         )
-        microphone_listener.start_listening()
+        services.append(microphone_listener.listen())
+        links.append(microphone_listener.mic_client.link)
 
         # TTS audio is played on the RDK X3 speakers (via the ReSpeaker), sent over the wired link.
         speaker_client = SpeakerClient(verbose=verbose)
+        links.append(speaker_client.link)
     elif verbose >= 1:
         print('Google voice interaction disabled (enable_voice_interaction=False).')
 
-    ethernet_client_kwargs = {
-        'shared_variable_manager': shared_variable_manager,
-        'verbose': verbose,
-    }
-    # Initialize and start Ethernet client
-    ethernet_client_thread = threading.Thread(
-        target=keep_restarting_ethernet_client,
-        name='ethernet_client',
-        kwargs=ethernet_client_kwargs,
-    )
-    ethernet_client_thread.start()
+    # JSON command channel to the RDK X3
+    ethernet_client = EthernetClient(shared_variable_manager=shared_variable_manager, verbose=verbose)
+    services.append(ethernet_client.run())
+    links.append(ethernet_client.link)
 
     usb_camera = UsbCamera(shared_variable_manager=shared_variable_manager, verbose=verbose)
     usb_camera_thread = threading.Thread(
@@ -80,24 +89,114 @@ def main_thread(**kwargs):
     usb_camera_thread.start()
 
     # Streams the arm camera frames to the RDK X3 on demand, so they can be shown in the VR/mobile apps.
-    # It reuses the frames already captured above (latest_camera_image), it does not open the camera again.
+    # It reuses the frames already captured above (camera_frame_buffer), it does not open the camera again.
     frame_streamer = FrameStreamerClient(shared_variable_manager=shared_variable_manager, verbose=verbose)
-    frame_streamer_thread = threading.Thread(
-        target=frame_streamer.run_forever,
-        name='frame_streamer',
-        daemon=True,
-    )
-    frame_streamer_thread.start()
+    services.append(frame_streamer.run())
+    links.append(frame_streamer.link)
+
+    asyncio.run(run_event_loop(
+        shared_variable_manager=shared_variable_manager,
+        hardware_interaction=hardware_interaction,
+        services=services,
+        links=links,
+        speaker_client=speaker_client,
+        setup_timeout=parameters['setup_timeout'],
+        health_report_interval=parameters['health_report_interval'],
+        verbose=verbose,
+    ))
+
+    # the event loop returned because of SIGINT/SIGTERM: release the links and the hardware. All the other threads
+    # are daemons, so the process exits as soon as this function returns.
+    for link in links:
+        link.close()
+    hardware_interaction.rgb_led(red=0, green=0, blue=0)
+    hardware_interaction.flush()
+    if verbose >= 1:
+        print('System stopped.')
+
+
+async def run_event_loop(shared_variable_manager: SharedVariableManager,
+                         hardware_interaction: HardwareInteraction,
+                         services: list = None,
+                         links: list = None,
+                         speaker_client=None,
+                         setup_timeout: float = 10,
+                         health_report_interval: float = 0,
+                         verbose: int = 0,
+                         ) -> None:
+    """
+    Owns the process lifecycle. Every task below awaits an event (a queue getting data, a socket becoming
+    readable or writable, a timer), so the main thread sleeps in the selector when there is nothing to do.
+    Returns when SIGINT or SIGTERM is received.
+    :param services: coroutines to run until shutdown (es. the RDK X3 links).
+    :param links: FramedLink objects whose health is reported every health_report_interval seconds (0 = never).
+    """
+    services = services if services is not None else []
+    links = links if links is not None else []
+    loop = asyncio.get_running_loop()
+    stop_event = asyncio.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(signal_number, stop_event.set)
+
+    tasks = [asyncio.create_task(check_setup(
+        shared_variable_manager=shared_variable_manager,
+        hardware_interaction=hardware_interaction,
+        timeout=setup_timeout,
+        verbose=verbose,
+    ))]
+    tasks += [asyncio.create_task(service) for service in services]
+    if health_report_interval > 0 and len(links) > 0:
+        tasks.append(asyncio.create_task(report_link_health(links=links, interval=health_report_interval)))
+    if speaker_client is not None:
+        tasks.append(asyncio.create_task(play_audio_responses(
+            shared_variable_manager=shared_variable_manager,
+            speaker_client=speaker_client,
+            verbose=verbose,
+        )))
+
+    await stop_event.wait()
+    if verbose >= 1:
+        print('Stop signal received, shutting down...')
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+async def check_setup(shared_variable_manager: SharedVariableManager,
+                      hardware_interaction: HardwareInteraction,
+                      timeout: float = 10,
+                      verbose: int = 0,
+                      ) -> None:
+    """
+    Waits (at most "timeout" seconds) until all the expected components are running, then signals the outcome with
+    the buzzer. It is woken up every time a component registers itself, instead of polling.
+    """
+    loop = asyncio.get_running_loop()
+    component_added = asyncio.Event()
+
+    def listener():
+        loop.call_soon_threadsafe(component_added.set)
 
-    counter = 0
+    def all_components_running() -> bool:
+        return (shared_variable_manager.length(queue_name='running_components') ==
+                shared_variable_manager.get_variable(variable_name='expected_component_number'))
+
+    shared_variable_manager.add_listener(name='running_components', listener=listener)
     setup_complete = False
-    while counter < 5:
-        if (shared_variable_manager.length(queue_name='running_components') ==
-                shared_variable_manager.get_variable(variable_name='expected_component_number')):
-            setup_complete = True
-            break
-        time.sleep(2)
-        counter += 1
+    deadline = loop.time() + timeout
+    try:
+        while not all_components_running():
+            component_added.clear()
+            remaining_time = deadline - loop.time()
+            if remaining_time <= 0:
+                break
+            try:
+                await asyncio.wait_for(component_added.wait(), timeout=remaining_time)
+            except asyncio.TimeoutError:
+                pass
+        setup_complete = all_components_running()
+    finally:
+        shared_variable_manager.remove_listener(name='running_components', listener=listener)
 
     if setup_complete:
         print('System ready, all components running.')
@@ -106,9 +205,9 @@ def main_thread(**kwargs):
     else:
         print('System setup failed.')
         hardware_interaction.set_beep(duration=0.2)
-        time.sleep(0.05)
+        await asyncio.sleep(0.05)
         hardware_interaction.set_beep(duration=0.2)
-        time.sleep(0.05)
+        await asyncio.sleep(0.05)
         hardware_interaction.set_beep(duration=0.2)
         print(f'Expected {shared_variable_manager.get_variable(variable_name="expected_component_number")} components,'
               f' but only found {shared_variable_manager.length(queue_name="running_components")}.')
@@ -117,41 +216,32 @@ def main_thread(**kwargs):
         for component in temp_already_counted_components:
             if component not in temp_running_components:
                 print(f'\tComponent {component} missing from running_components.')
-        # exit()
 
-    while True:
-        if enable_voice_interaction:
-            audio_to_play = shared_variable_manager.pop_from(queue_name='audio_to_play')
-            if audio_to_play is not None:
-                if verbose >= 2:
-                    print(f'Audio response received.')
-                # The speakers are on the RDK X3 (via the ReSpeaker); send the PCM there to be played.
-                speaker_client.send_audio(audio_to_play)
-            else:
-                time.sleep(0.2)
-        else:
-            time.sleep(0.2)
-        time.sleep(0.05)
-
-
-def keep_restarting_ethernet_client(shared_variable_manager: SharedVariableManager, verbose: int = 0):
+
+async def play_audio_responses(shared_variable_manager: SharedVariableManager, speaker_client, verbose: int = 0) -> None:
     """
-    Continuously attempts to restart the Ethernet client if it is not running.
+    Sends every audio response to the RDK X3 speakers as soon as the TTS service queues it.
     """
-    while not shared_variable_manager.has_value(queue_name='running_components', value='ethernet_client'):
+    while True:
+        audio_to_play = await shared_variable_manager.pop_from_async(queue_name='audio_to_play')
         if verbose >= 2:
-            print('Ethernet client not running. Attempting to restart in 10 seconds...')
-        try:
-            ethernet_client = EthernetClient(
-                shared_variable_manager=shared_variable_manager,
-                verbose=verbose,
-            )
-            ethernet_client.start()
-            shared_variable_manager.add_to(queue_name='running_components', value='ethernet_client')
-        except Exception as e:
-            utils.print_exception(exception=e, message='Ethernet client failed. Retrying in 5 seconds...')
-            shared_variable_manager.remove_from(queue_name='running_components', value='ethernet_client')
-        time.sleep(5)
+            print(f'Audio response received.')
+        # The speakers are on the RDK X3 (via the ReSpeaker); send the PCM there to be played.
+        await speaker_client.send_audio(audio_to_play)
+
+
+async def report_link_health(links: list, interval: float) -> None:
+    """
+    Prints the health counters of the RDK X3 links every "interval" seconds.
+    """
+    while True:
+        await asyncio.sleep(interval)
+        for link in links:
+            health = link.health
+            print(f'{link.name}: connected={link.connected}, connections={health.connections}, '
+                  f'failed_attempts={health.connection_attempts - health.connections}, '
+                  f'frames in/out={health.frames_received}/{health.frames_sent}, '
+                  f'bytes in/out={health.bytes_received}/{health.bytes_sent}')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,173 @@
+# This python script benchmarks the software endpointing of the microphone listener (see
+# sensors/microphone/endpointing.py) offline, on WAV files (by default the voice samples in info/voice_samples).
+# Each file is resampled to the microphone stream rate, padded with background noise before and after the speech,
+# and a short noise burst is added in the leading pad. Then it is fed to the Endpointer in chunks like the RDK X3
+# stream, together with a simulated hardware VAD flag (the true speech region, late by --hardware_lag seconds).
+# It uses the endpointing parameters of microphone_listener.yaml, so it measures what runs on the robot.
+#
+# For every file it prints the detected speech segments, the onset and end-of-speech delays (detection time minus
+# true time) and whether the noise burst triggered a false start. At the end it prints the averages and the
+# processing time per chunk.
+#
+# Usage: python scripts/benchmark_endpointing.py [wav files] [--noise_level -50] [--chunk_duration 0.032] ...
+
+import sys
+import glob
+import time
+import wave
+import argparse
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import args
+import global_constants as gc
+from sensors.microphone.endpointing import Endpointer
+
+
+def load_wav(file_path: str, sample_rate: int) -> np.ndarray:
+    """Loads a 16-bit WAV as mono int16 at sample_rate (linear interpolation)."""
+    with wave.open(file_path, mode='rb') as wf:
+        assert wf.getsampwidth() == 2, f'"{file_path}" is not a 16-bit WAV'
+        samples = np.frombuffer(wf.readframes(wf.getnframes()), dtype=np.int16)
+        channels = wf.getnchannels()
+        file_rate = wf.getframerate()
+    samples = samples.reshape(-1, channels).mean(axis=1)
+    if file_rate != sample_rate:
+        num_samples = int(len(samples) * sample_rate / file_rate)
+        samples = np.interp(np.arange(num_samples) * file_rate / sample_rate, np.arange(len(samples)), samples)
+    return samples.astype(np.int16)
+
+
+def speech_bounds(samples: np.ndarray, sample_rate: int) -> tuple:
+    """True speech start and end (seconds): first and last 10 ms window above -40 dBFS."""
+    window = sample_rate // 100
+    num_windows = len(samples) // window
+    windows = samples[:num_windows * window].reshape(num_windows, window).astype(np.float32) / 32768
+    active = np.flatnonzero(10 * np.log10(np.mean(windows ** 2, axis=1) + 1e-10) > -40)
+    if len(active) == 0:
+        return 0.0, 0.0
+    return active[0] * window / sample_rate, (active[-1] + 1) * window / sample_rate
+
+
+def build_test_signal(speech: np.ndarray, sample_rate: int, padding: float, noise_level: float,
+                      burst_duration: float, rng) -> tuple:
+    """
+    :return: (signal, speech_start, speech_end, burst_start): speech between noise pads, with a noise burst in the
+        leading pad. Times in seconds.
+    """
+    pad_samples = int(padding * sample_rate)
+    signal = np.concatenate((np.zeros(pad_samples), speech.astype(np.float64), np.zeros(pad_samples)))
+    signal += rng.normal(scale=32768 * 10 ** (noise_level / 20), size=len(signal))
+    burst_start = padding / 3
+    burst = slice(int(burst_start * sample_rate), int((burst_start + burst_duration) * sample_rate))
+    signal[burst] += rng.normal(scale=32768 * 0.1, size=burst.stop - burst.start)
+    speech_start, speech_end = speech_bounds(speech, sample_rate)
+    signal = np.clip(signal, -32768, 32767).astype(np.int16)
+    return signal, padding + speech_start, padding + speech_end, burst_start
+
+
+def run_endpointer(endpointer: Endpointer, signal: np.ndarray, sample_rate: int, chunk_duration: float,
+                   hardware_regions: list) -> tuple:
+    """
+    Feeds the signal chunk by chunk.
+    :return: (list of detected (start, end) segments in seconds, total processing time in seconds, number of chunks)
+    """
+    chunk_length = int(chunk_duration * sample_rate)
+    segments = []
+    segment_start = None
+    processing_time = 0.0
+    num_chunks = 0
+    for chunk_start in range(0, len(signal), chunk_length):
+        chunk = signal[chunk_start:chunk_start + chunk_length]
+        chunk_time = chunk_start / sample_rate
+        hardware_vad = any(start <= chunk_time < end for start, end in hardware_regions)
+        start_time = time.perf_counter()
+        in_speech = endpointer.process(pcm=chunk.tobytes(), hardware_vad=hardware_vad)
+        processing_time += time.perf_counter() - start_time
+        num_chunks += 1
+        chunk_end_time = chunk_time + len(chunk) / sample_rate
+        if in_speech and segment_start is None:
+            segment_start = chunk_end_time
+        elif not in_speech and segment_start is not None:
+            segments.append((segment_start, chunk_end_time))
+            segment_start = None
+    if segment_start is not None:
+        segments.append((segment_start, len(signal) / sample_rate))
+    return segments, processing_time, num_chunks
+
+
+def benchmark(file_paths: list, options) -> None:
+    parameters = args.import_args(yaml_path=gc.CONFIG_FOLDER_PATH + 'microphone_listener.yaml')
+    sample_rate = parameters['stream_params']['sample_rate']
+    rng = np.random.default_rng(seed=0)
+    onset_delays = []
+    end_delays = []
+    false_starts = 0
+    total_time = 0.0
+    total_chunks = 0
+    for file_path in file_paths:
+        speech = load_wav(file_path=file_path, sample_rate=sample_rate)
+        signal, speech_start, speech_end, burst_start = build_test_signal(
+            speech=speech,
+            sample_rate=sample_rate,
+            padding=options.padding,
+            noise_level=options.noise_level,
+            burst_duration=options.burst_duration,
+            rng=rng,
+        )
+        # the hardware flags the speech (late) and the noise burst (the case to reject)
+        hardware_regions = [
+            (speech_start + options.hardware_lag, speech_end + options.hardware_lag),
+            (burst_start, burst_start + options.burst_duration + options.hardware_lag),
+        ]
+        endpointer = Endpointer(
+            sample_rate=sample_rate,
+            hardware_silence_duration=parameters['max_silence_duration'],
+            **parameters['endpointing_parameters'],
+        )
+        segments, processing_time, num_chunks = run_endpointer(
+            endpointer=endpointer,
+            signal=signal,
+            sample_rate=sample_rate,
+            chunk_duration=options.chunk_duration,
+            hardware_regions=hardware_regions,
+        )
+        total_time += processing_time
+        total_chunks += num_chunks
+
+        speech_segments = [segment for segment in segments if segment[1] > speech_start]
+        burst_triggered = any(segment[0] < speech_start for segment in segments)
+        false_starts += burst_triggered
+        print(f'{Path(file_path).name}: speech {speech_start:.2f}-{speech_end:.2f} s, detected '
+              f'{", ".join(f"{start:.2f}-{end:.2f}" for start, end in segments) or "nothing"}'
+              f'{" (noise burst triggered)" if burst_triggered else ""}')
+        if len(speech_segments) > 0:
+            onset_delays.append(speech_segments[0][0] - speech_start)
+            end_delays.append(speech_segments[-1][1] - speech_end)
+
+    print()
+    print(f'Files: {len(file_paths)}, detected: {len(onset_delays)}, false starts on noise bursts: {false_starts}')
+    if len(onset_delays) > 0:
+        print(f'Onset delay: mean {np.mean(onset_delays) * 1000:.0f} ms, max {np.max(onset_delays) * 1000:.0f} ms')
+        print(f'End of speech delay: mean {np.mean(end_delays) * 1000:.0f} ms, '
+              f'max {np.max(end_delays) * 1000:.0f} ms')
+    if total_chunks > 0:
+        print(f'Processing time: {total_time / total_chunks * 1e6:.0f} us per {options.chunk_duration * 1000:.0f} ms '
+              f'chunk')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('files', nargs='*', help='WAV files, default: info/voice_samples/*.wav')
+    parser.add_argument('--noise_level', type=float, default=-50, help='background noise level (dBFS)')
+    parser.add_argument('--padding', type=float, default=2.0, help='noise before and after the speech (seconds)')
+    parser.add_argument('--burst_duration', type=float, default=0.08, help='noise burst duration (seconds)')
+    parser.add_argument('--hardware_lag', type=float, default=0.1, help='simulated hardware VAD lag (seconds)')
+    parser.add_argument('--chunk_duration', type=float, default=0.032, help='received chunk duration (seconds)')
+    command_line_options = parser.parse_args()
+    wav_files = command_line_options.files
+    if len(wav_files) == 0:
+        wav_files = sorted(glob.glob(gc.PROJECT_FOLDER_PATH + 'info/voice_samples/*.wav'))
+    benchmark(file_paths=wav_files, options=command_line_options)
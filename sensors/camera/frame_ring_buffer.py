@@ -0,0 +1,291 @@
+import time
+import asyncio
+import threading
+import collections
+
+# A frame read from the ring buffer. "image" is a memoryview into the slot holding the frame, not a copy.
+Frame = collections.namedtuple('Frame', ['image', 'sequence', 'timestamp', 'format'])
+
+
+class FrameRingBuffer:
+    """
+    Hands the camera frames to the consumers without allocating or copying them for every capture.
+
+    The buffer owns "num_slots" slots. The camera writes each new frame into the slot after the latest one, and
+    readers get the latest frame as a memoryview into its slot, together with its sequence number and capture time.
+    A slot is only overwritten after num_slots - 1 newer frames have been written, so a reader that uses a frame
+    right away (es. sends it on a socket) never needs to copy it. Readers that keep a frame longer must copy it
+    (bytes(frame.image)), or check is_valid() after using it.
+
+    Frames can be written already encoded (write) or as raw pixels (write_pixels). Raw frames are encoded with
+    "encoder" only when needed: by the camera thread right away while frames are being streamed (see is_streaming),
+    or by the first reader otherwise. The encoded bytes are cached in the slot, so each frame is encoded at most once.
+    The encoded storage of the slots is only written holding the encode lock, by the camera and the readers alike.
+    Readers on an event loop use read_latest_async, which encodes on an executor thread instead of blocking the loop.
+
+    The other way around, frames written already encoded (es. the MJPEG bitstream of the camera) are decoded with
+    "decoder" only if a reader asks for pixels (read_latest_pixels), at most once per frame.
+
+    Demand: a frame read in the last "idle_timeout" seconds, or a registered streaming consumer. Without demand
+    the camera can drop to a low-power mode (see UsbCamera) and wait_for_demand() until a reader shows up.
+
+    Listeners (callables without arguments) are invoked on the camera thread every time a new frame is published.
+    """
+
+    def __init__(self, num_slots: int = 4, slot_size: int = 640 * 480, encoder=None, decoder=None, image_format=None):
+        """
+        :param num_slots: number of slots, at least 2.
+        :param slot_size: initial size of the encoded storage of each slot, in bytes (a slot grows if needed).
+        :param encoder: callable(pixels) -> contiguous buffer with the encoded frame, used by write_pixels frames.
+            If None, raw frames are published as they are.
+        :param decoder: callable(encoded memoryview) -> pixels, used by read_latest_pixels for frames written
+            already encoded.
+        :param image_format: format of the frames produced by the encoder (es. '.jpg').
+        """
+        assert num_slots >= 2, 'num_slots must be at least 2, so the latest frame is not overwritten while written'
+        self.encoder = encoder
+        self.decoder = decoder
+        self.image_format = image_format
+        self._slots = [bytearray(slot_size) for _ in range(num_slots)]
+        self._views = [memoryview(slot) for slot in self._slots]
+        self._lengths = [0] * num_slots
+        self._pixels = [None] * num_slots
+        # sequence number of the frame whose pixels are in self._pixels
+        self._pixel_sequences = [0] * num_slots
+        self._sequences = [0] * num_slots
+        # sequence number of the frame whose encoded bytes are in the slot storage
+        self._encoded_sequences = [0] * num_slots
+        self._timestamps = [0.0] * num_slots
+        self._formats = [None] * num_slots
+        self._latest_index = None
+        self.sequence = 0
+        # the condition also wakes up wait_for_frame() callers
+        self._lock = threading.Condition()
+        self._encode_lock = threading.Lock()
+        self._listeners = []
+
+        self.last_read_time = 0.0
+        self._streaming_consumers = set()
+        self._demand_event = threading.Event()
+
+    # WRITER METHODS
+    def _next_index(self) -> int:
+        return 0 if self._latest_index is None else (self._latest_index + 1) % len(self._slots)
+
+    def _store_encoded(self, index: int, data) -> int:
+        source = memoryview(data).cast('B')
+        if source.nbytes > len(self._slots[index]):
+            # rare (a frame bigger than any before): replace the slot, views already handed out keep the old one alive
+            self._slots[index] = bytearray(source.nbytes)
+            self._views[index] = memoryview(self._slots[index])
+        self._views[index][:source.nbytes] = source
+        self._lengths[index] = source.nbytes
+        return source.nbytes
+
+    def _publish(self, index: int, timestamp: float, image_format, encoded: bool, decoded: bool) -> int:
+        with self._lock:
+            self.sequence += 1
+            self._sequences[index] = self.sequence
+            self._encoded_sequences[index] = self.sequence if encoded else 0
+            self._pixel_sequences[index] = self.sequence if decoded else 0
+            self._timestamps[index] = timestamp
+            self._formats[index] = image_format
+            self._latest_index = index
+            sequence = self.sequence
+            listeners = self._listeners.copy()
+            self._lock.notify_all()
+        for listener in listeners:
+            listener()
+        return sequence
+
+    def write(self, data, timestamp: float, image_format) -> int:
+        """
+        Copies an already encoded frame into the next slot and publishes it as the latest one.
+        :param data: any contiguous buffer (bytes, memoryview, numpy array from cv2.imencode...).
+        :param timestamp: capture time of the frame.
+        :param image_format: encoding of the frame (es. '.jpg').
+        :return: the sequence number of the frame.
+        """
+        index = self._next_index()
+        # a reader lagging by a full lap may be encoding into the same slot
+        with self._encode_lock:
+            self._store_encoded(index, data)
+        return self._publish(index, timestamp, image_format, encoded=True, decoded=False)
+
+    def pixels_buffer(self):
+        """
+        :return: the pixel array of the next slot (None until it has been used once). The camera can decode the next
+            frame straight into it (es. VideoCapture.read(image)) instead of allocating a new array.
+        """
+        return self._pixels[self._next_index()]
+
+    def write_pixels(self, pixels, timestamp: float, encode: bool = False) -> int:
+        """
+        Publishes a raw frame as the latest one, keeping a reference to the array (no copy).
+        :param pixels: the raw frame (numpy array), it must not be modified until the slot is reused.
+        :param timestamp: capture time of the frame.
+        :param encode: encode it right away (on the caller thread), otherwise it is encoded by its first reader.
+        :return: the sequence number of the frame.
+        """
+        index = self._next_index()
+        self._pixels[index] = pixels
+        encoded = False
+        if encode and self.encoder is not None:
+            encoded_pixels = self.encoder(pixels)
+            # a reader lagging by a full lap may be encoding into the same slot
+            with self._encode_lock:
+                self._store_encoded(index, encoded_pixels)
+            encoded = True
+        return self._publish(index, timestamp, self.image_format, encoded=encoded, decoded=True)
+
+    # READER METHODS
+    def _encoded_view(self, index: int, sequence: int):
+        if self.encoder is None and self._encoded_sequences[index] != sequence:
+            # raw frames without encoder are published as they are
+            return memoryview(self._pixels[index]).cast('B')
+        if self._encoded_sequences[index] != sequence:
+            with self._encode_lock:
+                # another reader may have encoded it while we were waiting for the lock
+                if self._encoded_sequences[index] != sequence:
+                    self._store_encoded(index, self.encoder(self._pixels[index]))
+                    with self._lock:
+                        # not if the slot has been reused meanwhile (see is_valid)
+                        if self._sequences[index] == sequence:
+                            self._encoded_sequences[index] = sequence
+        return self._views[index][:self._lengths[index]]
+
+    def read_latest(self):
+        """
+        Returns the latest frame, encoding it first if nobody did yet. Counts as demand.
+        :return: the latest Frame, or None if no frame has been written yet.
+        """
+        self.last_read_time = time.time()
+        self._demand_event.set()
+        with self._lock:
+            index = self._latest_index
+            if index is None:
+                return None
+            sequence = self._sequences[index]
+            timestamp = self._timestamps[index]
+            image_format = self._formats[index]
+        return Frame(
+            image=self._encoded_view(index, sequence),
+            sequence=sequence,
+            timestamp=timestamp,
+            format=image_format,
+        )
+
+    async def read_latest_async(self):
+        """
+        Like read_latest, for readers on an event loop: if the latest frame still has to be encoded, it is encoded on
+        the default executor, so the loop is not blocked.
+        :return: the latest Frame, or None if no frame has been written yet.
+        """
+        with self._lock:
+            index = self._latest_index
+            needs_encoding = (index is not None and self.encoder is not None and
+                              self._encoded_sequences[index] != self._sequences[index])
+        if not needs_encoding:
+            return self.read_latest()
+        return await asyncio.get_running_loop().run_in_executor(None, self.read_latest)
+
+    def read_latest_pixels(self):
+        """
+        Returns the latest frame as pixels, decoding it first if it was written already encoded and nobody did yet.
+        Counts as demand.
+        :return: the latest Frame with the pixel array as "image" (format None), or None if no frame has been written
+            yet or it cannot be decoded.
+        """
+        self.last_read_time = time.time()
+        self._demand_event.set()
+        with self._lock:
+            index = self._latest_index
+            if index is None:
+                return None
+            sequence = self._sequences[index]
+            timestamp = self._timestamps[index]
+        if self._pixel_sequences[index] != sequence:
+            if self.decoder is None:
+                return None
+            with self._encode_lock:
+                # another reader may have decoded it while we were waiting for the lock
+                if self._pixel_sequences[index] != sequence:
+                    pixels = self.decoder(self._views[index][:self._lengths[index]])
+                    with self._lock:
+                        if self._sequences[index] != sequence:
+                            # the slot has been overwritten while decoding: the pixels are still good for this reader
+                            return Frame(image=pixels, sequence=sequence, timestamp=timestamp, format=None)
+                        self._pixels[index] = pixels
+                        self._pixel_sequences[index] = sequence
+        return Frame(image=self._pixels[index], sequence=sequence, timestamp=timestamp, format=None)
+
+    def wait_for_frame(self, newer_than: float, timeout: float = None):
+        """
+        Waits until a frame captured after "newer_than" (a time.time() timestamp) is available. Counts as demand, so
+        a camera in low-power mode resumes capturing.
+        :return: the latest Frame, or None if no new frame arrived within the timeout.
+        """
+        self.last_read_time = time.time()
+        self._demand_event.set()
+        with self._lock:
+            is_new = self._lock.wait_for(
+                lambda: self._latest_index is not None and self._timestamps[self._latest_index] > newer_than,
+                timeout=timeout,
+            )
+        if not is_new:
+            return None
+        return self.read_latest()
+
+    def is_valid(self, frame) -> bool:
+        """True if the slot of the frame has not been overwritten by a newer frame (yet)."""
+        with self._lock:
+            return frame.sequence in self._sequences
+
+    # DEMAND METHODS
+    def add_streaming_consumer(self, name: str) -> None:
+        """Registers a consumer that wants every frame (es. a subscribed streamer), until removed."""
+        with self._lock:
+            self._streaming_consumers.add(name)
+        self._demand_event.set()
+
+    def remove_streaming_consumer(self, name: str) -> None:
+        with self._lock:
+            self._streaming_consumers.discard(name)
+
+    def has_demand(self, idle_timeout: float) -> bool:
+        """True if there is a streaming consumer or a frame was read in the last idle_timeout seconds."""
+        with self._lock:
+            if len(self._streaming_consumers) > 0:
+                return True
+        return time.time() - self.last_read_time < idle_timeout
+
+    def is_streaming(self, max_read_interval: float) -> bool:
+        """
+        True if there is a streaming consumer, or frames are being read continuously (the last read is more recent
+        than max_read_interval, es. a couple of frame periods).
+        """
+        with self._lock:
+            if len(self._streaming_consumers) > 0:
+                return True
+        return time.time() - self.last_read_time < max_read_interval
+
+    def wait_for_demand(self, idle_timeout: float, timeout: float) -> bool:
+        """
+        Blocks until there is demand (see has_demand) or the timeout expires.
+        :return: True if there is demand.
+        """
+        self._demand_event.clear()
+        # readers update last_read_time before setting the event, so a read just before clear() is not lost
+        if self.has_demand(idle_timeout=idle_timeout):
+            return True
+        return self._demand_event.wait(timeout=timeout)
+
+    # LISTENER METHODS
+    def add_listener(self, listener) -> None:
+        with self._lock:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        with self._lock:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
@@ -1,8 +1,17 @@
 import cv2
 import time
+import numpy as np
 
 import args
 import utils
+from sensors.camera.frame_ring_buffer import FrameRingBuffer
+
+DECODE_MODE = 'decode'
+# frames dequeued faster than this fraction of the frame period were already waiting in the driver queue (stale)
+_STALE_GRAB_FRACTION = 0.25
+# CAP_PROP_POS_MSEC timestamps further than this (seconds) from the grab time are not trusted
+_MAX_TIMESTAMP_OFFSET = 1.0
+MJPEG_PASSTHROUGH_MODE = 'mjpeg_passthrough'
 
 
 class UsbCamera:
@@ -20,10 +29,40 @@ class UsbCamera:
         self.verbose = parameters['verbose']
         self.max_reading_errors = parameters['max_reading_errors']
         self.image_format = parameters['image_format']
+        self.capture_mode = parameters['capture_mode']
+        assert self.capture_mode in (DECODE_MODE, MJPEG_PASSTHROUGH_MODE), \
+            f'Unknown camera capture mode "{self.capture_mode}"'
+        if self.capture_mode == MJPEG_PASSTHROUGH_MODE and self.image_format not in ('.jpg', '.jpeg'):
+            if self.verbose >= 1:
+                print(f'MJPEG passthrough publishes JPEG frames, image_format "{self.image_format}" ignored.')
+            self.image_format = '.jpg'
         self.shared_variable_manager = shared_variable_manager
+        # without consumers for this long (seconds), the camera switches to a low-power grab-only mode
+        self.idle_timeout = parameters['idle_timeout']
+        # in low-power mode, one frame is grabbed (to keep the driver queue and auto exposure going) every this many
+        # seconds, unless a consumer shows up earlier
+        self.idle_grab_interval = parameters['idle_grab_interval']
+        # Decode mode: captured frames are decoded into the ring buffer slots and kept raw, they are encoded
+        # (image_format) only when somebody reads them, at most once per frame.
+        # MJPEG passthrough mode: the compressed frames of the camera are copied into the slots as they are, and
+        # decoded only if somebody needs the pixels (read_latest_pixels).
+        # Encoded frames are much smaller than the raw ones (a slot grows if a frame does not fit).
+        self.frame_buffer = FrameRingBuffer(
+            num_slots=parameters['frame_buffer_slots'],
+            slot_size=self.width * self.height,
+            encoder=self.encode_image if self.image_format is not None else None,
+            decoder=self.decode_image,
+            image_format=self.image_format,
+        )
+        if self.shared_variable_manager is not None:
+            self.shared_variable_manager.set_variable(variable_name='camera_frame_buffer', value=self.frame_buffer)
 
-        # this should be "1 / self.frame_rate", but it is better if the sampling frequency is higher than the signal
-        self.sleep_time = 0.5 / self.frame_rate
+        # frame rate actually delivered by the camera (exponential moving average), it starts from the requested one
+        self.measured_fps = float(self.frame_rate)
+        self.fps_smoothing = parameters['fps_smoothing']
+        # maximum number of queued (stale) frames dropped to reach the newest one
+        self.max_drained_frames = parameters['max_drained_frames']
+        self.last_capture_time = None
 
     def open_camera(self) -> None:
         self.video = cv2.VideoCapture(self.video_id)
@@ -34,6 +73,11 @@ class UsbCamera:
         self.video.set(3, self.width)
         self.video.set(4, self.height)
         self.video.set(5, self.frame_rate)
+        # keep the driver queue as short as possible (not every backend supports it, the scheduler drains it anyway)
+        self.video.set(cv2.CAP_PROP_BUFFERSIZE, 1)
+        if self.capture_mode == MJPEG_PASSTHROUGH_MODE:
+            # read() returns the MJPEG bitstream of the camera (a 1-D or (1, N) uint8 array) instead of decoding it
+            self.video.set(cv2.CAP_PROP_CONVERT_RGB, 0)
         if self.verbose >= 1:
             if self.video.isOpened():
                 print('Opened camera successfully')
@@ -67,6 +111,93 @@ class UsbCamera:
         ret, jpeg = cv2.imencode('.jpg', image)
         return jpeg.tobytes()
 
+    def encode_image(self, image):
+        success, encoded_image = cv2.imencode(self.image_format, image)
+        if not success:
+            raise ValueError(f'Could not encode the frame as "{self.image_format}"')
+        return encoded_image
+
+    def decode_image(self, encoded_image):
+        image = cv2.imdecode(np.frombuffer(encoded_image, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            raise ValueError('Could not decode the frame')
+        return image
+
+    def _capture_timestamp(self, grab_time: float) -> float:
+        """
+        :param grab_time: time.time() when grab() returned.
+        :return: capture time of the grabbed frame, as time.time(). The driver timestamp (CAP_PROP_POS_MSEC, on V4L2
+            the monotonic time the sensor filled the buffer) is used when available, otherwise the grab time.
+        """
+        driver_time = self.video.get(cv2.CAP_PROP_POS_MSEC) / 1000
+        # convert from the monotonic clock to the wall clock
+        capture_time = driver_time + grab_time - time.monotonic()
+        if 0 <= grab_time - capture_time < _MAX_TIMESTAMP_OFFSET:
+            return capture_time
+        return grab_time
+
+    def _grab_latest(self):
+        """
+        Grabs frames until the newest one: a grab that returns almost immediately dequeued a frame that was already
+        waiting in the driver queue, so another one is grabbed, until a grab has to wait for the sensor.
+        Updates measured_fps with the interval between the newest frames.
+        :return: the capture timestamp of the grabbed frame, None if grab failed.
+        """
+        stale_threshold = _STALE_GRAB_FRACTION / self.measured_fps
+        for _ in range(self.max_drained_frames + 1):
+            start_time = time.monotonic()
+            if not self.video.grab():
+                return None
+            if time.monotonic() - start_time >= stale_threshold:
+                break
+        capture_time = self._capture_timestamp(grab_time=time.time())
+
+        if self.last_capture_time is not None and capture_time > self.last_capture_time:
+            # a camera never delivers much faster than requested, shorter intervals are timestamp noise
+            instant_fps = min(1 / (capture_time - self.last_capture_time), 2 * self.frame_rate)
+            self.measured_fps += self.fps_smoothing * (instant_fps - self.measured_fps)
+        self.last_capture_time = capture_time
+        return capture_time
+
+    def _read_frame(self) -> bool:
+        """
+        Grabs the newest frame from the camera, then decodes (or copies) and publishes it in the frame buffer.
+        :return: True if a frame has been read.
+        """
+        capture_time = self._grab_latest()
+        if capture_time is None:
+            return False
+        if self.capture_mode == MJPEG_PASSTHROUGH_MODE:
+            success, image = self.video.retrieve()
+            if not success:
+                return False
+            # the MJPEG bitstream is a 1-D array, or a (1, N) one with the V4L2 backend
+            if image.ndim == 1 or (image.ndim == 2 and image.shape[0] == 1):
+                self.frame_buffer.write(data=image.reshape(-1), timestamp=capture_time, image_format=self.image_format)
+                return True
+            # the backend ignored CAP_PROP_CONVERT_RGB (es. not V4L2, or the camera is not sending MJPEG)
+            if self.verbose >= 1:
+                print('MJPEG passthrough not supported by the camera backend, falling back to decode mode.')
+            self.capture_mode = DECODE_MODE
+            # the next frames are decoded by the backend
+            self.video.set(cv2.CAP_PROP_CONVERT_RGB, 1)
+            if image.ndim != 3:
+                # not decoded pixels either, dropped
+                return False
+        else:
+            # decode straight into the array of the slot that is about to be reused
+            success, image = self.video.retrieve(self.frame_buffer.pixels_buffer())
+            if not success:
+                return False
+        # while the frames are being streamed, encode on this thread right away, so the streamer (on the event loop)
+        # never has to. Otherwise the frame is encoded only if somebody reads it.
+        self.frame_buffer.write_pixels(
+            pixels=image,
+            timestamp=capture_time,
+            encode=self.frame_buffer.is_streaming(max_read_interval=2 / self.measured_fps),
+        )
+        return True
+
     def ready_latest_image(self) -> None:
         assert self.shared_variable_manager is not None, ('shared_variable_manager must be provided to use '
                                                           '"ready_latest_image".')
@@ -74,31 +205,42 @@ class UsbCamera:
             self.open_camera()
             streak_error_count = 0
             self.shared_variable_manager.add_to(queue_name='running_components', value='usb_camera')
+            low_power = False
             while streak_error_count < self.max_reading_errors:
                 try:
-                    success, image = self.video.read()
-                    if not success:
+                    if not self.frame_buffer.has_demand(idle_timeout=self.idle_timeout):
+                        if not low_power and self.verbose >= 2:
+                            print('No camera consumers, switching to low-power mode.')
+                        low_power = True
+                        # grab only: no decoding, no encoding, nothing published
+                        self.video.grab()
+                        self.frame_buffer.wait_for_demand(
+                            idle_timeout=self.idle_timeout,
+                            timeout=self.idle_grab_interval,
+                        )
+                        continue
+                    if low_power:
+                        if self.verbose >= 2:
+                            print('Camera consumer detected, leaving low-power mode.')
+                        # the interval since the last frame says nothing about the camera frame rate
+                        self.last_capture_time = None
+                    low_power = False
+
+                    if not self._read_frame():
                         streak_error_count += 1
                         if self.verbose >= 2:
                             print('Error: could not read current frame.')
+                        # do not spin on a failing camera
+                        time.sleep(1 / self.measured_fps)
                     else:
                         streak_error_count = 0
-                        if self.image_format is not None:
-                            ret, image = cv2.imencode(self.image_format, image)
-
-                        # The .tobytes() method converts the numpy array to a bytes object
-                        image_bytes = image.tobytes()
-                        image_dict = {
-                            'image': image_bytes,
-                            'timestamp': time.time(),
-                            'format': self.image_format,
-                        }
-                        self.shared_variable_manager.set_variable(variable_name='latest_camera_image', value=image_dict)
+                        if self.verbose >= 3:
+                            print(f'Camera frame captured, measured frame rate: {self.measured_fps:.1f} fps')
                 except Exception as e:
                     streak_error_count += 1
                     if self.verbose >= 2:
                         utils.print_exception(exception=e, message='Error in USB camera')
-                time.sleep(self.sleep_time)
+                    time.sleep(1 / self.measured_fps)
 
             self.shared_variable_manager.remove_from(queue_name='running_components', value='usb_camera')
             print('Too many errors in reading usb camera frames, closing camera')
@@ -0,0 +1,164 @@
+import numpy as np
+
+# int16 full scale, energies are in dB relative to it (dBFS)
+_FULL_SCALE = 32768.0
+
+
+class Endpointer:
+    """
+    Software voice activity detection and endpointing on the received PCM (mono int16), fused with the hardware VAD
+    flag of the RDK X3.
+
+    The PCM is cut into analysis frames of frame_duration seconds (the chunks received from the RDK X3 can have any
+    size, a partial frame is kept for the next chunk). For all the frames of a chunk at once (NumPy) it computes:
+        - energy (dBFS) and zero-crossing rate.
+        - speech flag: energy at least snr_threshold dB above the noise floor, and either a low zero-crossing rate
+          (voiced speech) or an energy 2 * snr_threshold dB above the floor (loud fricatives). Hiss and hum stay out.
+    The noise floor starts from the energy of the first chunk (or initial_noise_floor) and adapts on the non-speech
+    frames: it rises slowly (floor_rise_rate per frame) and falls fast (floor_fall_rate per frame). While the hardware
+    flag is clearly off (for more than hardware_grace_duration), speech frames count as noise too, at the slow rate,
+    so a sudden increase of the background noise is not taken as speech forever.
+
+    Software speech starts after min_speech_duration seconds of speech frames (so short noise bursts are rejected)
+    and ends after hangover_duration seconds of non-speech frames (so short pauses do not end the utterance).
+
+    Fusion with the hardware flag (see process): speech starts when the software detects it and the hardware flagged
+    voice in the last hardware_grace_duration seconds. It ends when the software hangover expires, or the hardware
+    flag has been off for hardware_silence_duration seconds (in case the software is stuck on a noise change).
+
+    All times are measured in received audio, not wall time, so results are reproducible offline (see
+    scripts/benchmark_endpointing.py).
+    """
+
+    def __init__(self,
+                 sample_rate: int = 16000,
+                 frame_duration: float = 0.02,
+                 snr_threshold: float = 9.0,
+                 min_energy: float = -55.0,
+                 max_zero_crossing_rate: float = 0.25,
+                 initial_noise_floor: float = None,
+                 floor_rise_rate: float = 0.01,
+                 floor_fall_rate: float = 0.2,
+                 min_speech_duration: float = 0.15,
+                 hangover_duration: float = 0.4,
+                 hardware_grace_duration: float = 0.5,
+                 hardware_silence_duration: float = 2.0,
+                 ):
+        """
+        :param sample_rate: sample rate of the PCM, in Hz.
+        :param frame_duration: duration of the analysis frames, in seconds.
+        :param snr_threshold: minimum energy above the noise floor for a speech frame, in dB.
+        :param min_energy: frames below this energy (dBFS) are never speech.
+        :param max_zero_crossing_rate: zero crossings per sample above which a frame is considered noise, unless
+            it is very loud.
+        :param initial_noise_floor: noise floor (dBFS) before any frame is received, if None it is the median energy
+            of the first chunk.
+        :param floor_rise_rate: fraction of the distance to the non-speech energy covered per frame, when rising.
+        :param floor_fall_rate: same, when falling.
+        :param min_speech_duration: speech frames needed (seconds) to start speech.
+        :param hangover_duration: non-speech frames needed (seconds) to end speech.
+        :param hardware_grace_duration: the hardware flag must have been on in the last this many seconds to start
+            speech.
+        :param hardware_silence_duration: speech ends if the hardware flag is off for this long, whatever the
+            software says.
+        """
+        self.sample_rate = sample_rate
+        self.frame_length = int(round(sample_rate * frame_duration))
+        self.frame_duration = self.frame_length / sample_rate
+        self.snr_threshold = snr_threshold
+        self.min_energy = min_energy
+        self.max_zero_crossing_rate = max_zero_crossing_rate
+        self.floor_rise_rate = floor_rise_rate
+        self.floor_fall_rate = floor_fall_rate
+        self.onset_frames = max(1, int(round(min_speech_duration / self.frame_duration)))
+        self.hangover_frames = max(1, int(round(hangover_duration / self.frame_duration)))
+        self.hardware_grace_duration = hardware_grace_duration
+        self.hardware_silence_duration = hardware_silence_duration
+        # partial analysis frame left over from the last chunk
+        self._remainder = np.zeros(self.frame_length, dtype=np.int16)
+        # estimated background noise energy (dBFS)
+        self.noise_floor = initial_noise_floor
+        self.reset()
+
+    def reset(self) -> None:
+        """Forgets the audio received so far (es. after a reconnection), except the noise floor."""
+        self._remainder_length = 0
+        self.software_speech = False
+        self.in_speech = False
+        # consecutive speech (while not in speech) or non-speech (while in speech) frames
+        self._run_length = 0
+        # audio time (seconds) since the hardware flag was last on
+        self._hardware_silence = float('inf')
+
+    def _frames(self, pcm) -> np.ndarray:
+        """Splits the remainder + the new PCM into complete analysis frames, keeping the rest as remainder."""
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if self._remainder_length > 0:
+            samples = np.concatenate((self._remainder[:self._remainder_length], samples))
+        num_frames = len(samples) // self.frame_length
+        used = num_frames * self.frame_length
+        self._remainder_length = len(samples) - used
+        self._remainder[:self._remainder_length] = samples[used:]
+        return samples[:used].reshape(num_frames, self.frame_length)
+
+    def _update_noise_floor(self, energy: np.ndarray, rise_rate: float, fall_rate: float) -> None:
+        if len(energy) == 0:
+            return
+        target = float(np.mean(energy))
+        rate = rise_rate if target > self.noise_floor else fall_rate
+        # the same per-frame update, compounded over the frames of the chunk
+        self.noise_floor += (1 - (1 - rate) ** len(energy)) * (target - self.noise_floor)
+
+    def classify_frames(self, frames: np.ndarray, hardware_silent: bool = False) -> np.ndarray:
+        """
+        :param frames: (num_frames, frame_length) int16 array.
+        :param hardware_silent: True if the hardware flag has been off for a while, see the class description.
+        :return: boolean array, True for the speech frames. Updates the noise floor.
+        """
+        float_frames = frames.astype(np.float32) / _FULL_SCALE
+        energy = 10 * np.log10(np.mean(float_frames ** 2, axis=1) + 1e-10)
+        if self.noise_floor is None:
+            if len(energy) == 0:
+                return np.zeros(0, dtype=bool)
+            self.noise_floor = float(np.median(energy))
+        signs = np.signbit(frames)
+        zero_crossing_rate = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / (self.frame_length - 1)
+
+        snr = energy - self.noise_floor
+        is_speech = (energy > self.min_energy) & (snr > self.snr_threshold) & (
+            (zero_crossing_rate < self.max_zero_crossing_rate) | (snr > 2 * self.snr_threshold))
+
+        self._update_noise_floor(energy[~is_speech], rise_rate=self.floor_rise_rate, fall_rate=self.floor_fall_rate)
+        if hardware_silent and not self.in_speech:
+            self._update_noise_floor(energy[is_speech], rise_rate=self.floor_rise_rate, fall_rate=self.floor_fall_rate)
+        return is_speech
+
+    def _update_software_speech(self, is_speech: np.ndarray) -> None:
+        for frame_is_speech in is_speech:
+            if frame_is_speech != self.software_speech:
+                self._run_length += 1
+                if self._run_length >= (self.hangover_frames if self.software_speech else self.onset_frames):
+                    self.software_speech = not self.software_speech
+                    self._run_length = 0
+            else:
+                self._run_length = 0
+
+    def process(self, pcm, hardware_vad: bool) -> bool:
+        """
+        Processes a received chunk.
+        :param pcm: mono int16 PCM (any contiguous buffer).
+        :param hardware_vad: hardware VAD flag received with the chunk.
+        :return: True while the (fused) speech state is on, with the hangover already applied.
+        """
+        chunk_duration = len(memoryview(pcm).cast('B')) / (2 * self.sample_rate)
+        self._hardware_silence = 0.0 if hardware_vad else self._hardware_silence + chunk_duration
+
+        frames = self._frames(pcm)
+        is_speech = self.classify_frames(frames, hardware_silent=self._hardware_silence > self.hardware_grace_duration)
+        self._update_software_speech(is_speech)
+
+        if not self.in_speech:
+            self.in_speech = self.software_speech and self._hardware_silence <= self.hardware_grace_duration
+        elif not self.software_speech or self._hardware_silence >= self.hardware_silence_duration:
+            self.in_speech = False
+        return self.in_speech
@@ -1,12 +1,17 @@
-import io
-import wave
 import time
-import threading
 
 import args
 import utils
 import global_constants as gc
 from ethernet_connection.mic_stream_client import MicStreamClient
+from sensors.microphone.endpointing import Endpointer
+from sensors.microphone.pcm_accumulator import PcmAccumulator
+from sensors.microphone.pre_roll_buffer import PreRollBuffer
+
+# events of the 'audio_stream' queue (streaming mode), as (event, pcm_bytes) tuples
+STREAM_START = 'start'
+STREAM_AUDIO = 'audio'
+STREAM_END = 'end'
 
 
 class MicrophoneListener:
@@ -16,7 +21,8 @@ class MicrophoneListener:
         local audio device, it receives the already processed audio (AEC + beamforming + noise suppression)
         plus the hardware VAD flag from the RDK X3 over the wired link (see MicStreamClient and, on the RDK X3,
         audio_bridge_server.py). The recording state machine (start on voice, stop after a silence gap, discard
-        too-short clips) is unchanged; only the audio source changed.
+        too-short clips) is unchanged; only the audio source changed. listen() is a coroutine running on the main
+        event loop, together with the RDK X3 links.
 
         :param shared_variable_manager: instance of SharedVariableManager to manage shared variables.
         :param hardware_interaction: used to drive the status RGB LED.
@@ -29,7 +35,6 @@ class MicrophoneListener:
         # Audio source: the microphone stream served by the RDK X3 over the wired link.
         self.mic_client = MicStreamClient(verbose=self.verbose)
 
-        self.current_recording = None
         self.recording = False
         self.silence_timestamp = None
         self.start_recording_timestamp = None
@@ -38,38 +43,95 @@ class MicrophoneListener:
         self.min_sentence_duration = parameters['min_sentence_duration']
         # describes the received PCM (must match the RDK X3 mic stream), used to package the in-memory WAV
         self.stream_params = parameters['stream_params']
+        # Software VAD on the received PCM, fused with the hardware flag: it ends a recording a few hundred
+        # milliseconds after the end of speech (instead of max_silence_duration) and ignores short noise bursts.
+        self.endpointer = None
+        if parameters['software_vad']:
+            self.endpointer = Endpointer(
+                sample_rate=self.stream_params['sample_rate'],
+                hardware_silence_duration=self.max_silence_duration,
+                **parameters['endpointing_parameters'],
+            )
+        # the PCM of the current recording, preallocated for max_recording_duration seconds
+        self.current_recording = PcmAccumulator(
+            sample_rate=self.stream_params['sample_rate'],
+            channels=self.stream_params['channels'],
+            sample_width=self.stream_params['width'],
+            max_duration=parameters['max_recording_duration'],
+        )
+        # the audio received just before the voice detection, prepended to every recording
+        self.pre_roll = PreRollBuffer(
+            sample_rate=self.stream_params['sample_rate'],
+            channels=self.stream_params['channels'],
+            duration=parameters['pre_roll_duration'],
+        )
+        # duration of the pre-roll at the start of the current recording, not counted as speech
+        self.recorded_pre_roll_duration = 0.0
         self.save_file = parameters['save_file']
         self.led_intensity = parameters['led_intensity']
+        # maximum number of already received frames processed in one go
+        self.max_frames_per_read = parameters['max_frames_per_read']
+        # In streaming mode the audio is sent to the streaming reasoning session (queue 'audio_stream') while the user
+        # is still speaking, instead of as a whole WAV (queue 'reasoning_requests') after the end of the utterance.
+        self.streaming_mode = parameters['streaming_mode']
+        # streaming mode: True once the recording is long enough to be accepted and its audio is being streamed
+        self.streaming = False
 
-    def listen(self):
+    async def listen(self):
         """
         Reads frames (audio chunk + VAD flag) from the RDK X3 microphone stream.
         While voice is detected:
             - start/keep recording, accumulating the received audio.
         When no voice is detected for self.max_silence_duration seconds:
             - stop recording, package the audio, and hand it to the reasoning service.
+        In streaming mode the audio is handed over while recording, and the stop only marks the end of the utterance.
         """
         if self.verbose >= 2:
             print('Starting to listen to the microphone stream from the RDK X3...')
+        self.shared_variable_manager.add_to(queue_name='running_components', value='microphone_listener')
+        if self.verbose >= 1:
+            print('Microphone listener started.')
+        try:
+            await self._listen_loop()
+        finally:
+            self.shared_variable_manager.remove_from(queue_name='running_components', value='microphone_listener')
 
+    async def _listen_loop(self):
         while True:
-            is_voice, pcm_bytes = self.mic_client.read_frame()
-            if is_voice:
-                self.silence_timestamp = None
-                if not self.recording:
-                    self.start_recording()
-                # Set RGB LED to green
-                self.hardware_interaction.rgb_led(red=0, green=self.led_intensity, blue=0)
-                if pcm_bytes:
-                    self.current_recording.append(pcm_bytes)
-            else:  # no voice detected
-                if self.recording:
-                    # Set RGB LED to orange
-                    self.hardware_interaction.rgb_led(red=self.led_intensity, green=self.led_intensity, blue=0)
-                    if self.silence_timestamp is None:
-                        self.silence_timestamp = time.time()
-                    if (time.time() - self.silence_timestamp) >= self.max_silence_duration:
-                        self.stop_recording(save_file=self.save_file)
+            # all the frames already received, in one call (the PCM views are valid until the next read)
+            frames = await self.mic_client.read_frames(max_frames=self.max_frames_per_read)
+            for is_voice, pcm_view in frames:
+                self.process_frame(is_voice=is_voice, pcm_view=pcm_view)
+
+    def process_frame(self, is_voice: bool, pcm_view):
+        """
+        Runs the recording state machine on one received frame.
+        :param is_voice: hardware VAD flag of the frame.
+        :param pcm_view: PCM of the frame, only valid during this call (it is copied if kept).
+        """
+        if self.endpointer is not None:
+            # fused hardware + software decision, the end of speech hangover is already applied
+            is_voice = self.endpointer.process(pcm=pcm_view, hardware_vad=is_voice)
+        if is_voice:
+            self.silence_timestamp = None
+            if not self.recording:
+                self.start_recording()
+            # Set RGB LED to green
+            self.hardware_interaction.rgb_led(red=0, green=self.led_intensity, blue=0)
+            if pcm_view:
+                self.current_recording.append(pcm_view)
+                if self.streaming_mode:
+                    self.stream_audio(pcm_view)
+        else:  # no voice detected
+            if not self.recording:
+                self.pre_roll.write(pcm_view)
+            if self.recording:
+                # Set RGB LED to orange
+                self.hardware_interaction.rgb_led(red=self.led_intensity, green=self.led_intensity, blue=0)
+                if self.silence_timestamp is None:
+                    self.silence_timestamp = time.time()
+                if self.endpointer is not None or (time.time() - self.silence_timestamp) >= self.max_silence_duration:
+                    self.stop_recording(save_file=self.save_file)
 
     def start_recording(self):
         """
@@ -77,12 +139,41 @@ class MicrophoneListener:
         """
         # Set RGB LED to green
         self.hardware_interaction.rgb_led(red=0, green=self.led_intensity, blue=0)
-        self.current_recording = []
+        self.current_recording.reset()
+        for pre_roll_view in self.pre_roll.views():
+            self.current_recording.append(pre_roll_view)
+        self.recorded_pre_roll_duration = self.current_recording.duration
+        self.pre_roll.clear()
         self.recording = True
+        self.streaming = False
         self.start_recording_timestamp = time.time()
         if self.verbose >= 3:
             print('Voice detected, starting recording...')
 
+    def speech_duration(self) -> float:
+        """Duration (seconds) of the voice recorded so far: only voice frames are recorded, after the pre-roll."""
+        return self.current_recording.duration - self.recorded_pre_roll_duration
+
+    def stream_audio(self, pcm_view):
+        """
+        Streaming mode: sends the new audio chunk to the streaming reasoning session. The start of the recording is
+        held back until it lasts min_sentence_duration, so recordings too short to be accepted are never sent.
+        """
+        if self.streaming:
+            # copied, the view points into the receive buffer
+            self.shared_variable_manager.add_to(queue_name='audio_stream', value=(STREAM_AUDIO, bytes(pcm_view)))
+        elif self.speech_duration() >= self.min_sentence_duration:
+            self.streaming = True
+            self.shared_variable_manager.add_to(queue_name='audio_stream', value=(STREAM_START, None))
+            # everything recorded so far (pre-roll and this chunk included) as a single chunk, copied because the
+            # recording buffer is reused by the next recording
+            self.shared_variable_manager.add_to(
+                queue_name='audio_stream',
+                value=(STREAM_AUDIO, bytes(self.current_recording.pcm_view())),
+            )
+            if self.verbose >= 3:
+                print('Recording long enough, streaming it...')
+
     def stop_recording(self, save_file: bool = False):
         """
         Stops the current recording and, if it is long enough, hands the audio to the reasoning service.
@@ -93,29 +184,28 @@ class MicrophoneListener:
         if self.verbose >= 3:
             print('No voice detected for a while, stop recording...')
 
-        if (time.time() - self.start_recording_timestamp) >= self.min_sentence_duration + self.max_silence_duration:
+        if self.streaming_mode:
+            if self.streaming:
+                # the audio has already been sent, only the end of the utterance is missing
+                self.shared_variable_manager.add_to(queue_name='audio_stream', value=(STREAM_END, None))
+                self.streaming = False
+                if self.verbose >= 3:
+                    print('Recording accepted.')
+            elif self.verbose >= 3:
+                print('Recording too short, not accepted.')
+            if save_file and len(self.current_recording) > 0:
+                self.save_recording()
+            return
+
+        if self.speech_duration() >= self.min_sentence_duration:
             if save_file:
-                utils.save_wave_file(
-                    file_path=f'{gc.OUTPUT_FOLDER_PATH}recording_{int(time.time())}.wav',
-                    byte_data=b''.join(self.current_recording),
-                    channels=self.stream_params['channels'],
-                    rate=self.stream_params['sample_rate'],
-                    sample_width=self.stream_params['width'],
-                    verbose=self.verbose,
-                )
-
-            # format the audio data into a WAV file in memory
-            output_buffer = io.BytesIO()
-            with wave.open(f=output_buffer, mode='wb') as wf:
-                wf.setnchannels(self.stream_params['channels'])
-                wf.setsampwidth(self.stream_params['width'])  # 2 bytes for 16-bit audio
-                wf.setframerate(self.stream_params['sample_rate'])
-                wf.writeframes(b''.join(self.current_recording))
-            # Get the bytes from the buffer
-            wav_bytes_in_memory = output_buffer.getvalue()
+                self.save_recording()
+
+            # the WAV header is written in front of the recorded PCM, which is copied once for the reasoning service.
+            # The buffer is reused by the next recording.
             self.shared_variable_manager.add_to(
                 queue_name='reasoning_requests',
-                value={'audio_bytes': wav_bytes_in_memory},
+                value={'audio_bytes': self.current_recording.take_wav()},
             )
             if self.verbose >= 3:
                 print('Recording accepted.')
@@ -123,21 +213,15 @@ class MicrophoneListener:
             if self.verbose >= 3:
                 print('Recording too short, not accepted.')
 
-    # this method invokes the listen method in a separate thread
-    def start_listening(self):
-        """
-        Starts the microphone listener in a separate thread.
-        """
-        try:
-            listener_thread = threading.Thread(target=self.listen, name='microphone_listener')
-            listener_thread.start()
-            self.shared_variable_manager.add_to(queue_name='running_components', value='microphone_listener')
-            if self.verbose >= 1:
-                print('Microphone listener started.')
-        except Exception as e:
-            self.shared_variable_manager.remove_from(queue_name='running_components', value='microphone_listener')
-            utils.print_exception(exception=e, message='Error starting microphone listener thread')
-            raise
+    def save_recording(self):
+        utils.save_wave_file(
+            file_path=f'{gc.OUTPUT_FOLDER_PATH}recording_{int(time.time())}.wav',
+            byte_data=self.current_recording.pcm_view(),
+            channels=self.stream_params['channels'],
+            rate=self.stream_params['sample_rate'],
+            sample_width=self.stream_params['width'],
+            verbose=self.verbose,
+        )
 
     def __del__(self):
         """
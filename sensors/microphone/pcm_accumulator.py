@@ -0,0 +1,96 @@
+import struct
+
+# size of the canonical PCM WAV header (RIFF + fmt + data chunk headers)
+WAV_HEADER_SIZE = 44
+_WAV_HEADER = struct.Struct('<4sI4s4sIHHIIHH4sI')
+
+
+class PcmAccumulator:
+    """
+    Accumulates the PCM chunks of a recording in a single preallocated bytearray, instead of a list of small bytes
+    objects joined (and copied again into a WAV) at the end of the recording.
+
+    The buffer is sized for "max_duration" seconds of audio and starts with WAV_HEADER_SIZE reserved bytes, so the
+    recording is turned into a WAV by writing the header in place in front of the PCM, without moving it. Chunks are
+    appended in place; a recording longer than max_duration grows the buffer (rare, it is copied once).
+
+    The same buffer is reused by every recording. take_wav() returns the WAV as bytes: that is the only copy of a
+    recording, and the one its consumer needs anyway (the Google AI Studio SDK only takes bytes, and base64-encodes
+    them into the request).
+    """
+
+    def __init__(self, sample_rate: int, channels: int, sample_width: int, max_duration: float):
+        """
+        :param sample_rate: sample rate of the PCM, in Hz.
+        :param channels: number of channels.
+        :param sample_width: width of each sample, in bytes.
+        :param max_duration: expected maximum duration of a recording (seconds), used to size the buffer.
+        """
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.sample_width = sample_width
+        self.capacity = WAV_HEADER_SIZE + int(sample_rate * max_duration) * channels * sample_width
+        self._buffer = None
+        self._view = None
+        # end of the PCM data in the buffer (the PCM starts at WAV_HEADER_SIZE)
+        self._end = WAV_HEADER_SIZE
+
+    def __len__(self) -> int:
+        """Number of PCM bytes accumulated."""
+        return self._end - WAV_HEADER_SIZE
+
+    @property
+    def duration(self) -> float:
+        """Duration of the accumulated audio, in seconds."""
+        return len(self) / (self.sample_rate * self.channels * self.sample_width)
+
+    def reset(self) -> None:
+        """Starts a new recording, reusing the buffer (allocated by the first recording)."""
+        if self._buffer is None:
+            self._buffer = bytearray(self.capacity)
+            self._view = memoryview(self._buffer)
+        self._end = WAV_HEADER_SIZE
+
+    def append(self, pcm_bytes) -> None:
+        """Copies a PCM chunk (any contiguous buffer) at the end of the recording."""
+        source = memoryview(pcm_bytes).cast('B')
+        new_end = self._end + source.nbytes
+        if new_end > len(self._buffer):
+            # longer than max_duration: double the buffer
+            new_buffer = bytearray(max(2 * len(self._buffer), new_end))
+            new_buffer[:self._end] = self._view[:self._end]
+            self._buffer = new_buffer
+            self._view = memoryview(self._buffer)
+        self._view[self._end:new_end] = source
+        self._end = new_end
+
+    def pcm_view(self) -> memoryview:
+        """
+        :return: the PCM accumulated so far, as a memoryview valid until the next reset() (or buffer growth).
+        """
+        return self._view[WAV_HEADER_SIZE:self._end]
+
+    def wav_view(self) -> memoryview:
+        """
+        Writes the WAV header in the reserved space in front of the PCM.
+        :return: the whole WAV file, as a memoryview into the buffer (valid until the next reset).
+        """
+        data_size = len(self)
+        block_align = self.channels * self.sample_width
+        _WAV_HEADER.pack_into(
+            self._buffer, 0,
+            b'RIFF', WAV_HEADER_SIZE - 8 + data_size, b'WAVE',
+            b'fmt ', 16, 1, self.channels, self.sample_rate, self.sample_rate * block_align, block_align,
+            8 * self.sample_width,
+            b'data', data_size,
+        )
+        return self._view[:self._end]
+
+    def take_wav(self) -> bytes:
+        """
+        Like wav_view(), but returns a copy of the WAV, which stays valid after the next reset, and empties the
+        recording. The buffer is kept for the next recording.
+        """
+        wav = self.wav_view().tobytes()
+        self._end = WAV_HEADER_SIZE
+        return wav
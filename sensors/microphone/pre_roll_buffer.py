@@ -0,0 +1,56 @@
+import numpy as np
+
+
+class PreRollBuffer:
+    """
+    Circular buffer always holding the most recent "duration" seconds of int16 PCM, preallocated once.
+
+    The microphone listener writes every frame received while it is not recording, and prepends the buffer content to
+    each new recording: the voice detection lags the speech onset, so without it the first syllable would be lost.
+    """
+
+    def __init__(self, sample_rate: int, channels: int, duration: float):
+        """
+        :param sample_rate: sample rate of the PCM, in Hz.
+        :param channels: number of (interleaved) channels.
+        :param duration: amount of audio kept, in seconds.
+        """
+        self._samples = np.zeros(int(sample_rate * duration) * channels, dtype=np.int16)
+        # next write position, and number of valid samples (less than the capacity until it is filled once)
+        self._position = 0
+        self._length = 0
+
+    def __len__(self) -> int:
+        """Number of PCM bytes held."""
+        return self._length * self._samples.itemsize
+
+    def clear(self) -> None:
+        self._position = 0
+        self._length = 0
+
+    def write(self, pcm) -> None:
+        """Writes a PCM chunk (any contiguous buffer), overwriting the oldest audio."""
+        capacity = len(self._samples)
+        if capacity == 0:
+            return
+        samples = np.frombuffer(pcm, dtype=np.int16)
+        if len(samples) >= capacity:
+            # only the end of the chunk fits
+            self._samples[:] = samples[-capacity:]
+            self._position = 0
+            self._length = capacity
+            return
+        first_part = min(len(samples), capacity - self._position)
+        self._samples[self._position:self._position + first_part] = samples[:first_part]
+        self._samples[:len(samples) - first_part] = samples[first_part:]
+        self._position = (self._position + len(samples)) % capacity
+        self._length = min(capacity, self._length + len(samples))
+
+    def views(self) -> tuple:
+        """
+        :return: the held audio, oldest first, as one or two memoryviews into the buffer (valid until the next write).
+        """
+        start = (self._position - self._length) % len(self._samples) if self._length > 0 else 0
+        if start + self._length <= len(self._samples):
+            return (memoryview(self._samples[start:start + self._length]),)
+        return memoryview(self._samples[start:]), memoryview(self._samples[:self._position])
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# the modules import each other from the project root (es. "import args")
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,72 @@
+import numpy as np
+
+from sensors.microphone.endpointing import Endpointer
+
+SAMPLE_RATE = 16000
+CHUNK_DURATION = 0.02
+_random = np.random.default_rng(seed=0)
+
+
+def noise(duration: float, amplitude: float = 30) -> np.ndarray:
+    return (_random.normal(0, amplitude, int(SAMPLE_RATE * duration))).astype(np.int16)
+
+
+def voice(duration: float, amplitude: float = 8000) -> np.ndarray:
+    # voiced speech: loud, low zero-crossing rate
+    t = np.arange(int(SAMPLE_RATE * duration)) / SAMPLE_RATE
+    return (amplitude * np.sin(2 * np.pi * 200 * t)).astype(np.int16)
+
+
+def feed(endpointer: Endpointer, samples: np.ndarray, hardware_vad: bool = True) -> list:
+    """Feeds the samples in chunks, returns the speech state after each chunk."""
+    chunk_length = int(SAMPLE_RATE * CHUNK_DURATION)
+    return [
+        endpointer.process(pcm=samples[start:start + chunk_length].tobytes(), hardware_vad=hardware_vad)
+        for start in range(0, len(samples), chunk_length)
+    ]
+
+
+def make_endpointer() -> Endpointer:
+    endpointer = Endpointer(sample_rate=SAMPLE_RATE, min_speech_duration=0.15, hangover_duration=0.4)
+    feed(endpointer, noise(0.5), hardware_vad=False)
+    return endpointer
+
+
+def test_short_bursts_do_not_start_speech():
+    endpointer = make_endpointer()
+    assert not any(feed(endpointer, voice(0.1)))
+    assert not any(feed(endpointer, noise(0.2)))
+    states = feed(endpointer, voice(0.5))
+    # after min_speech_duration
+    assert not states[0] and states[-1]
+
+
+def test_hangover_bridges_short_pauses():
+    endpointer = make_endpointer()
+    feed(endpointer, voice(0.5))
+    # a pause shorter than the hangover does not end the utterance
+    assert all(feed(endpointer, noise(0.3)))
+    assert feed(endpointer, voice(0.1))[-1]
+    states = feed(endpointer, noise(0.6))
+    assert states[0] and not states[-1]
+
+
+def test_speech_needs_the_hardware_flag():
+    endpointer = make_endpointer()
+    assert not any(feed(endpointer, voice(0.5), hardware_vad=False))
+    assert feed(endpointer, voice(0.3), hardware_vad=True)[-1]
+    # the software is still in speech, but the hardware flag has been off for hardware_silence_duration
+    states = feed(endpointer, voice(endpointer.hardware_silence_duration + 0.1), hardware_vad=False)
+    assert states[0] and not states[-1]
+
+
+def test_noise_floor_follows_the_background():
+    endpointer = make_endpointer()
+    quiet_floor = endpointer.noise_floor
+    # louder background noise (hiss, high zero-crossing rate): never speech, the floor rises slowly
+    assert not any(feed(endpointer, noise(2.0, amplitude=300), hardware_vad=False))
+    loud_floor = endpointer.noise_floor
+    assert loud_floor > quiet_floor + 10
+    # and falls fast when the background is quiet again
+    feed(endpointer, noise(0.2), hardware_vad=False)
+    assert endpointer.noise_floor < loud_floor - 10
@@ -0,0 +1,48 @@
+import asyncio
+import threading
+
+from sensors.camera.frame_ring_buffer import FrameRingBuffer
+
+
+class RecordingEncoder:
+    """Encodes a pixel bytearray as itself, recording the threads it runs on."""
+
+    def __init__(self):
+        self.threads = []
+
+    def __call__(self, pixels):
+        self.threads.append(threading.current_thread())
+        return bytes(pixels)
+
+
+def test_lazy_encoding_runs_off_the_event_loop():
+    encoder = RecordingEncoder()
+    frame_buffer = FrameRingBuffer(num_slots=2, slot_size=8, encoder=encoder, image_format='.jpg')
+    frame_buffer.write_pixels(bytearray(b'pixels'), timestamp=1.0)
+
+    async def read():
+        frame = await frame_buffer.read_latest_async()
+        # already encoded: read on the loop, without encoding again
+        again = await frame_buffer.read_latest_async()
+        return frame, again
+
+    frame, again = asyncio.run(read())
+    assert bytes(frame.image) == b'pixels' and bytes(again.image) == b'pixels'
+    assert len(encoder.threads) == 1 and encoder.threads[0] is not threading.main_thread()
+
+
+def test_camera_waits_for_a_reader_encoding_the_same_slot():
+    encoder = RecordingEncoder()
+    frame_buffer = FrameRingBuffer(num_slots=2, slot_size=8, encoder=encoder, image_format='.jpg')
+    written = threading.Event()
+
+    def write():
+        frame_buffer.write_pixels(bytearray(b'new'), timestamp=1.0, encode=True)
+        written.set()
+
+    # a reader is encoding a frame
+    with frame_buffer._encode_lock:
+        threading.Thread(target=write).start()
+        assert not written.wait(timeout=0.1)
+    assert written.wait(timeout=1)
+    assert bytes(frame_buffer.read_latest().image) == b'new'
@@ -0,0 +1,45 @@
+import asyncio
+
+from thread_shared_variables import SharedVariableManager
+from sensors.camera.frame_ring_buffer import FrameRingBuffer
+from ethernet_connection.frame_streamer import FrameStreamerClient, PUSH_MODE
+
+
+class UnsubscribingLink:
+    """Stands for FramedLink: the RDK X3 unsubscribes while the first frame is being sent."""
+
+    def __init__(self, streamer: FrameStreamerClient):
+        self.streamer = streamer
+        self.sent = []
+
+    async def send(self, *buffers) -> None:
+        self.sent.append(b''.join(bytes(buffer) for buffer in buffers))
+        await asyncio.sleep(0)
+        # what _receive_subscriptions does on [b'U'][0]
+        self.streamer.target_fps = 0
+        self.streamer._wakeup.set()
+
+
+def test_unsubscribe_during_send():
+    shared_variable_manager = SharedVariableManager()
+    frame_buffer = FrameRingBuffer(num_slots=4, slot_size=16)
+    shared_variable_manager.set_variable(variable_name='camera_frame_buffer', value=frame_buffer)
+    streamer = FrameStreamerClient(shared_variable_manager=shared_variable_manager, mode=PUSH_MODE, verbose=0)
+    streamer.link = UnsubscribingLink(streamer)
+
+    async def push_while_frames_arrive():
+        streamer._wakeup = asyncio.Event()
+        streamer.target_fps = 30
+        frame_buffer.write(b'jpeg 1', timestamp=1.0, image_format='.jpg')
+        push_task = asyncio.create_task(streamer._push_frames())
+        await asyncio.sleep(0.01)
+        # published after the unsubscription: never sent
+        frame_buffer.write(b'jpeg 2', timestamp=2.0, image_format='.jpg')
+        streamer._wakeup.set()
+        await asyncio.sleep(0.1)
+        # still waiting for a new subscription, not failed with a division by zero
+        assert not push_task.done()
+        push_task.cancel()
+
+    asyncio.run(push_while_frames_arrive())
+    assert len(streamer.link.sent) == 1 and streamer.link.sent[0].endswith(b'jpeg 1')
@@ -0,0 +1,66 @@
+import struct
+
+import pytest
+
+from ethernet_connection.framing import FrameBuffer
+
+
+def frame(payload: bytes) -> bytes:
+    return struct.pack('>I', len(payload)) + payload
+
+
+def feed(frame_buffer: FrameBuffer, data: bytes) -> list:
+    """Receives data as recv_into would, returns the payloads (copied) of the frames completed by it."""
+    view = frame_buffer.writable_view(min_free_space=len(data))
+    view[:len(data)] = data
+    frame_buffer.commit(len(data))
+    return [bytes(payload) for _, payload in frame_buffer.frames()]
+
+
+def test_split_frame_is_reassembled():
+    frame_buffer = FrameBuffer(capacity=16)
+    data = frame(b'hello world')
+    # split inside the header, then inside the payload
+    assert feed(frame_buffer, data[:2]) == []
+    assert feed(frame_buffer, data[2:9]) == []
+    assert feed(frame_buffer, data[9:]) == [b'hello world']
+    assert len(frame_buffer) == 0
+
+
+def test_merged_frames_are_all_returned():
+    frame_buffer = FrameBuffer(capacity=64)
+    data = frame(b'one') + frame(b'') + frame(b'three') + frame(b'fo')[:3]
+    assert feed(frame_buffer, data) == [b'one', b'', b'three']
+    # the partial one is kept for the next receive
+    assert len(frame_buffer) == 3
+    assert feed(frame_buffer, frame(b'fo')[3:]) == [b'fo']
+
+
+def test_frame_bigger_than_the_buffer_grows_it():
+    frame_buffer = FrameBuffer(capacity=8)
+    view = frame_buffer.writable_view(min_free_space=6)
+    view[:6] = frame(b'ab')
+    frame_buffer.commit(6)
+    _, first_payload = frame_buffer.next_frame()
+    big_payload = bytes(range(100))
+    data = frame(big_payload)
+    assert feed(frame_buffer, data[:20]) == []
+    assert feed(frame_buffer, data[20:]) == [big_payload]
+    assert len(frame_buffer._buffer) >= len(data)
+    # the payloads handed out before keep the old buffer alive
+    assert bytes(first_payload) == b'ab'
+
+
+def test_oversized_frame_is_a_corrupted_stream():
+    frame_buffer = FrameBuffer(capacity=16, max_frame_size=10)
+    with pytest.raises(ValueError):
+        feed(frame_buffer, frame(bytes(11)))
+
+
+def test_header_only_messages():
+    frame_buffer = FrameBuffer(header_format='>cB', length_index=None, capacity=4)
+    view = frame_buffer.writable_view(min_free_space=5)
+    view[:5] = b'S\x1eU\x00S'
+    frame_buffer.commit(5)
+    assert [header for header, _ in frame_buffer.frames()] == [(b'S', 30), (b'U', 0)]
+    assert len(frame_buffer) == 1
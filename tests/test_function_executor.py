@@ -0,0 +1,62 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from google_ai_studio import function_declarations
+from google_ai_studio.function_executor import FunctionExecutor
+
+
+def make_executor():
+    forwarded = []
+    beeps = []
+    executor = FunctionExecutor(
+        function_list=function_declarations.function_list,
+        forward=forwarded.append,
+        local_functions={'beep': lambda seconds: beeps.append(seconds)},
+    )
+    return executor, forwarded, beeps
+
+
+def function_call(name: str, args: dict):
+    return SimpleNamespace(id='call_0', name=name, args=args)
+
+
+def test_local_and_forwarded_calls():
+    executor, forwarded, beeps = make_executor()
+    assert 'result' in executor.execute(function_call('beep', {'seconds': 1.5}))
+    assert 'result' in executor.execute(function_call('control_gripper', {'rotation': 90.0, 'opening': True}))
+    assert beeps == [1.5]
+    assert [call.name for call in forwarded] == ['control_gripper']
+
+
+def test_rejected_calls_are_not_run():
+    executor, forwarded, beeps = make_executor()
+    # below the buzzer floor of HardwareInteraction.set_beep
+    assert 'error' in executor.execute(function_call('beep', {'seconds': 0.05}))
+    assert 'error' in executor.execute(function_call('set_target', {'target': 'dog'}))
+    assert 'error' in executor.execute(function_call('not_declared', {}))
+    assert beeps == [] and forwarded == []
+
+
+def test_streaming_session_gets_the_validation_error():
+    pytest.importorskip('google.genai')
+    from google_ai_studio.streaming_reasoning_service import StreamingReasoningService
+
+    executor, _, _ = make_executor()
+    responses = []
+
+    class StubSession:
+        async def send_tool_response(self, function_responses):
+            responses.extend(function_responses)
+
+    service = StreamingReasoningService(
+        client=None,
+        shared_variable_manager=None,
+        model_name='model',
+        handle_text=print,
+        handle_function_call=executor.execute,
+        get_camera_image=lambda: None,
+    )
+    asyncio.run(service._answer_function_calls(StubSession(), [function_call('beep', {'seconds': 9})]))
+    assert 'error' in responses[0].response
@@ -0,0 +1,111 @@
+import threading
+
+import pytest
+
+pytest.importorskip('smbus')
+
+import hardware_interaction
+from hardware_interaction import HardwareInteraction, I2CCommandQueue, NUM_SERVOS, SERVO_PRIORITY, BUZZER_PRIORITY, \
+    LED_PRIORITY
+from thread_shared_variables import SharedVariableManager
+
+_RESET_REGISTER = 0x05
+
+
+class FakeBus:
+    """Stands for smbus.SMBus: records the writes, and holds the bus thread on a reset until released."""
+
+    def __init__(self, smbus_id: int):
+        self.writes = []
+        self.release = threading.Event()
+
+    def write_byte_data(self, address: int, register: int, value: int) -> None:
+        if register == _RESET_REGISTER:
+            self.release.wait(timeout=2)
+        self.writes.append((register, value))
+
+    def write_i2c_block_data(self, address: int, register: int, values: list) -> None:
+        self.writes.append((register, list(values)))
+
+
+@pytest.fixture
+def hardware(monkeypatch):
+    monkeypatch.setattr(hardware_interaction.smbus, 'SMBus', FakeBus)
+    return HardwareInteraction(shared_variable_manager=SharedVariableManager(), async_bus_writes=True, verbose=0)
+
+
+def servo_writes(bus: FakeBus) -> dict:
+    """:return: servo_id -> last angle written."""
+    return {register - 0x50: value for register, value in bus.writes if 0x51 <= register <= 0x56}
+
+
+def test_servo_write_between_poses_is_not_overwritten(hardware):
+    # the bus thread is busy while the commands are queued, so they are coalesced
+    hardware.arm_reset()
+    hardware.set_pose([10] * NUM_SERVOS)
+    hardware.pwm_servo_write(servo_id=1, angle=20)
+    future = hardware.set_pose([None, 40, None, None, None, None])
+    hardware.bus.release.set()
+    future.result(timeout=2)
+    assert hardware.flush()
+
+    assert servo_writes(hardware.bus) == {1: 20, 2: 40, 3: 10, 4: 10, 5: 10, 6: 10}
+    assert hardware.servo_angles == [20, 40, 10, 10, 10, 10]
+    # one write per servo, each one only with its latest angle
+    assert len(hardware.bus.writes) == 1 + NUM_SERVOS
+
+
+def test_control_gripper_moves_the_gripper_servos(hardware):
+    hardware.bus.release.set()
+    parameters = hardware.gripper_parameters
+    assert hardware.control_gripper(rotation=90, opening=True).result(timeout=5)
+    assert hardware.flush()
+
+    angles = servo_writes(hardware.bus)
+    assert angles == {parameters['rotation_servo']: 90, parameters['opening_servo']: parameters['open_angle']}
+
+
+def blocked_queue() -> tuple:
+    """:return: (queue, release event, written list), the bus thread is held until the event is set."""
+    queue = I2CCommandQueue(name='test_i2c_writer')
+    release = threading.Event()
+    written = []
+    queue.submit(priority=SERVO_PRIORITY, function=release.wait, arguments=(2,))
+    return queue, release, written
+
+
+def test_commands_are_written_by_priority_then_submission_order():
+    queue, release, written = blocked_queue()
+    queue.submit(priority=LED_PRIORITY, function=written.append, arguments=('led',))
+    queue.submit(priority=BUZZER_PRIORITY, function=written.append, arguments=('beep 1',))
+    queue.submit(priority=SERVO_PRIORITY, function=written.append, arguments=('servo',))
+    queue.submit(priority=BUZZER_PRIORITY, function=written.append, arguments=('beep 2',))
+    release.set()
+    assert queue.flush()
+    assert written == ['servo', 'beep 1', 'beep 2', 'led']
+
+
+def test_coalesced_commands_write_the_latest_value_once():
+    queue, release, written = blocked_queue()
+    first = queue.submit(priority=LED_PRIORITY, function=written.append, arguments=('red',), key='led')
+    queue.submit(priority=BUZZER_PRIORITY, function=written.append, arguments=('beep',))
+    second = queue.submit(priority=LED_PRIORITY, function=written.append, arguments=('green',), key='led')
+    release.set()
+    assert queue.flush()
+    assert written == ['beep', 'green']
+    # the callers of the superseded command get the result of the latest one
+    assert first is second and first.done()
+
+
+def test_futures_carry_the_errors():
+    queue, release, written = blocked_queue()
+
+    def fail():
+        raise OSError('I2C error')
+
+    failed = queue.submit(priority=SERVO_PRIORITY, function=fail, error_message='test I2C error')
+    succeeded = queue.submit(priority=SERVO_PRIORITY, function=lambda: 42)
+    release.set()
+    assert isinstance(failed.exception(timeout=2), OSError)
+    # the bus thread goes on after a failed command
+    assert succeeded.result(timeout=2) == 42
@@ -0,0 +1,50 @@
+import pytest
+
+pytest.importorskip('google.genai')
+
+from google.genai import types
+
+from google_ai_studio.history_manager import HistoryManager
+
+
+def audio_turn(index: int) -> list:
+    return [
+        types.Content(role='user', parts=[types.Part.from_bytes(data=bytes(1000), mime_type='audio/wav')]),
+        types.Content(role='model', parts=[types.Part(text=f'Answer {index}.')]),
+    ]
+
+
+def tool_round_turn() -> list:
+    """A question answered after a get_camera_image call, within the same turn."""
+    return [
+        types.Content(role='user', parts=[types.Part.from_bytes(data=bytes(1000), mime_type='audio/wav')]),
+        types.Content(role='model', parts=[types.Part.from_function_call(name='get_camera_image', args={})]),
+        types.Content(role='user', parts=[
+            types.Part.from_function_response(name='get_camera_image', response={'result': 'Image attached.'}),
+            types.Part.from_bytes(data=bytes(5000), mime_type='image/jpeg'),
+        ]),
+        types.Content(role='model', parts=[types.Part(text='I see a red cube.')]),
+    ]
+
+
+def test_function_response_stays_in_the_turn_of_its_call():
+    history = audio_turn(0) + tool_round_turn() + audio_turn(1)
+    turns = HistoryManager.split_turns(history)
+    assert [len(turn) for turn in turns] == [2, 4, 2]
+
+
+def test_compact_history_with_tool_round():
+    history = audio_turn(0) + tool_round_turn() + audio_turn(1)
+    # with their media the turns do not fit, only the last one is kept
+    compacted = HistoryManager(max_turns=10, media_turns=3, max_bytes=1500).compact(history)
+    assert compacted[0].role == 'user' and compacted[0].parts[0].function_response is None
+    assert len(compacted) == 2
+
+    # dropping the first turn: the call and its response are kept (or dropped) together
+    compacted = HistoryManager(max_turns=2, media_turns=1).compact(history)
+    assert len(compacted) == 6
+    assert compacted[0].parts[0].function_response is None
+    assert compacted[1].parts[0].function_call.name == 'get_camera_image'
+    assert compacted[2].parts[0].function_response.name == 'get_camera_image'
+    # the old image is replaced by its placeholder
+    assert compacted[2].parts[1].inline_data is None
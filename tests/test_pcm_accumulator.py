@@ -0,0 +1,35 @@
+import io
+import wave
+
+from sensors.microphone.pcm_accumulator import PcmAccumulator
+
+
+def read_wav(wav: bytes) -> tuple:
+    with wave.open(io.BytesIO(wav), mode='rb') as wf:
+        return wf.getframerate(), wf.getnchannels(), wf.readframes(wf.getnframes())
+
+
+def test_buffer_is_reused_across_accepted_recordings():
+    accumulator = PcmAccumulator(sample_rate=16000, channels=1, sample_width=2, max_duration=1)
+    accumulator.reset()
+    buffer = accumulator._buffer
+    accumulator.append(b'\x01\x00' * 100)
+    accumulator.append(memoryview(b'\x02\x00' * 50))
+    first_wav = accumulator.take_wav()
+
+    accumulator.reset()
+    accumulator.append(b'\x03\x00' * 10)
+    second_wav = accumulator.take_wav()
+
+    # no new allocation for the second recording, and the first WAV is not overwritten by it
+    assert accumulator._buffer is buffer
+    assert read_wav(first_wav) == (16000, 1, b'\x01\x00' * 100 + b'\x02\x00' * 50)
+    assert read_wav(second_wav) == (16000, 1, b'\x03\x00' * 10)
+
+
+def test_recording_longer_than_max_duration_grows_the_buffer():
+    accumulator = PcmAccumulator(sample_rate=100, channels=1, sample_width=2, max_duration=1)
+    accumulator.reset()
+    accumulator.append(b'\x05\x00' * 150)
+    assert accumulator.duration == 1.5
+    assert read_wav(accumulator.take_wav())[2] == b'\x05\x00' * 150
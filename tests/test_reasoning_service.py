@@ -0,0 +1,120 @@
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('google.genai')
+
+from google.genai import types
+
+from google_ai_studio.model_router import ModelsUnavailableError
+from google_ai_studio.reasoning_service import ReasoningService
+
+
+class QuotaError(Exception):
+    code = 429
+
+
+class ExhaustedModels:
+    """Stands for client.models: every request fails on the daily quota."""
+
+    def __init__(self):
+        self.requested_models = []
+
+    def generate_content(self, model, contents, config):
+        self.requested_models.append(model)
+        raise QuotaError('429 RESOURCE_EXHAUSTED: GenerateRequestsPerDayPerProjectPerModel-FreeTier')
+
+
+def test_all_models_exhausted():
+    models = ExhaustedModels()
+    notices = []
+    service = ReasoningService(
+        client=SimpleNamespace(models=models),
+        model_name='model-a',
+        fallback_model_names=['model-b'],
+        on_models_unavailable=notices.append,
+    )
+
+    assert service.reasoning(audio_bytes=b'RIFF') == (None, None)
+    assert models.requested_models == ['model-a', 'model-b']
+    assert len(notices) == 1 and isinstance(notices[0], ModelsUnavailableError)
+    # the daily quotas reset at the next midnight of the quota time zone
+    assert time.time() < notices[0].retry_time <= time.time() + 24 * 3600
+
+    # both models are known to be exhausted: the user is told again, without new requests
+    assert service.reasoning(audio_bytes=b'RIFF') == (None, None)
+    assert models.requested_models == ['model-a', 'model-b']
+    assert len(notices) == 2
+
+
+class ScriptedModels:
+    """Stands for client.models: returns the given contents, in order."""
+
+    def __init__(self, contents: list):
+        self.contents = list(contents)
+        self.requests = []
+
+    def generate_content(self, model, contents, config):
+        self.requests.append(contents)
+        content = self.contents.pop(0)
+        return SimpleNamespace(candidates=[SimpleNamespace(content=content)], usage_metadata=None)
+
+
+def test_text_of_every_part_and_tool_round_is_kept():
+    models = ScriptedModels([
+        types.Content(role='model', parts=[
+            types.Part(text='Let me look '),
+            types.Part(text='at the table.'),
+            types.Part.from_function_call(name='get_camera_image', args={}),
+        ]),
+        types.Content(role='model', parts=[types.Part(text='I see a red cube.')]),
+    ])
+    service = ReasoningService(
+        client=SimpleNamespace(models=models),
+        model_name='model-a',
+        get_camera_image=lambda wait=True: b'jpeg',
+    )
+
+    text, function_call = service.reasoning(audio_bytes=b'RIFF')
+    assert text == 'Let me look at the table. I see a red cube.'
+    assert function_call is None
+    # the image is sent back within the same turn
+    assert len(models.requests) == 2 and models.requests[1][-1].parts[0].function_response is not None
+
+
+class FakeChats:
+    """Stands for client.chats: each message gets the same answer, the history is kept like the SDK chats."""
+
+    def create(self, model, config, history=None):
+        chats = self
+
+        class Chat:
+            def __init__(self):
+                self.history = list(history or [])
+
+            def get_history(self):
+                return list(self.history)
+
+            def send_message(self, message):
+                parts = [types.Part(text=item) if isinstance(item, str) else item for item in message]
+                content = types.Content(role='model', parts=[types.Part(text='Answer.')])
+                self.history += [types.Content(role='user', parts=parts), content]
+                return SimpleNamespace(candidates=[SimpleNamespace(content=content)], usage_metadata=None)
+
+        chats.chat = Chat()
+        return chats.chat
+
+
+def test_discarded_turn_is_removed_from_history():
+    chats = FakeChats()
+    service = ReasoningService(client=SimpleNamespace(chats=chats), model_name='model-a', remember_history=True)
+    service.reasoning(audio_bytes=b'first')
+    service.reasoning(audio_bytes=b'second')
+
+    service.discard_last_turn()
+    history = service.chat.get_history()
+    assert len(history) == 2 and history[0].parts[0].inline_data.data == b'first'
+    # only once: the previous turn has been heard
+    service.discard_last_turn()
+    assert len(service.chat.get_history()) == 2
@@ -0,0 +1,76 @@
+import time
+import threading
+
+from google_ai_studio.reasoning_worker_pool import ReasoningWorkerPool
+
+
+class Recorder:
+    def __init__(self, expected: int):
+        self.events = []
+        self.delivered = []
+        self._lock = threading.Lock()
+        self._expected = expected
+        self.finished = threading.Event()
+
+    def record(self, event) -> None:
+        with self._lock:
+            self.events.append(event)
+
+    def deliver(self, request: dict, result) -> None:
+        self.delivered.append(result)
+        self._count()
+
+    def discard(self, request: dict, result) -> None:
+        self.record(('discard', request['name']))
+        self._count()
+
+    def _count(self) -> None:
+        with self._lock:
+            self._expected -= 1
+            if self._expected == 0:
+                self.finished.set()
+
+
+def test_results_are_delivered_in_submission_order():
+    recorder = Recorder(expected=3)
+
+    def process(request: dict):
+        time.sleep(request['duration'])
+        return request['name']
+
+    pool = ReasoningWorkerPool(process=process, deliver=recorder.deliver, num_workers=3)
+    # the last one completes first
+    pool.submit({'audio_bytes': b'', 'name': 'first', 'duration': 0.2})
+    pool.submit({'audio_bytes': b'', 'name': 'second', 'duration': 0.1})
+    pool.submit({'audio_bytes': b'', 'name': 'third', 'duration': 0.0})
+
+    assert recorder.finished.wait(timeout=2)
+    assert recorder.delivered == ['first', 'second', 'third']
+
+
+def test_late_result_is_discarded_before_the_next_request_starts():
+    recorder = Recorder(expected=2)
+
+    def process(request: dict):
+        recorder.record(('start', request['name']))
+        time.sleep(request['duration'])
+        return request['name']
+
+    pool = ReasoningWorkerPool(
+        process=process,
+        deliver=recorder.deliver,
+        discard=recorder.discard,
+        num_workers=2,
+        serialize=True,
+        request_deadline=0.3,
+    )
+    pool.submit({'audio_bytes': b'', 'name': 'late', 'duration': 0.4})
+    time.sleep(0.2)
+    # waits for the late one, which is still running
+    pool.submit({'audio_bytes': b'', 'name': 'on time', 'duration': 0.0})
+
+    assert recorder.finished.wait(timeout=2)
+    assert recorder.delivered == ['on time']
+    assert pool.discarded_count == 1
+    # the late turn is removed (es. from the chat history) before the next request runs
+    assert recorder.events == [('start', 'late'), ('discard', 'late'), ('start', 'on time')]
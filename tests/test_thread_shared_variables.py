@@ -0,0 +1,55 @@
+import asyncio
+import threading
+
+from thread_shared_variables import SharedQueue, SharedVariableManager, DROP_OLDEST, DROP_NEWEST, BLOCK
+
+
+def test_drop_oldest():
+    queue = SharedQueue(max_length=2, overflow_policy=DROP_OLDEST)
+    assert all(queue.put(value) for value in (1, 2, 3))
+    assert queue.copy() == [2, 3] and queue.dropped_count == 1
+
+
+def test_drop_newest():
+    queue = SharedQueue(max_length=2, overflow_policy=DROP_NEWEST)
+    assert queue.put(1) and queue.put(2)
+    assert not queue.put(3)
+    assert queue.copy() == [1, 2] and queue.dropped_count == 1
+
+
+def test_block_waits_for_room():
+    queue = SharedQueue(max_length=1, overflow_policy=BLOCK)
+    queue.put(1)
+    # nobody pops: dropped after the timeout
+    assert not queue.put(2, timeout=0.05)
+    assert queue.dropped_count == 1
+
+    added = []
+    producer = threading.Thread(target=lambda: added.append(queue.put(3, timeout=2)))
+    producer.start()
+    assert queue.pop(timeout=None) == 1
+    producer.join(timeout=2)
+    assert added == [True] and queue.copy() == [3]
+
+
+def test_pop_waits_for_a_value():
+    queue = SharedQueue()
+    assert queue.pop() is None
+    assert queue.pop(timeout=0.05) is None
+    threading.Timer(0.05, queue.put, args=('value',)).start()
+    assert queue.pop(timeout=None) == 'value'
+
+
+def test_pop_from_async_wakes_up_on_a_value_from_another_thread():
+    shared_variable_manager = SharedVariableManager()
+
+    async def consume():
+        consumer = asyncio.create_task(shared_variable_manager.pop_from_async(queue_name='tts_requests'))
+        await asyncio.sleep(0.05)
+        assert not consumer.done()
+        threading.Thread(target=shared_variable_manager.add_to, args=('tts_requests', 'hello')).start()
+        return await asyncio.wait_for(consumer, timeout=2)
+
+    assert asyncio.run(consume()) == 'hello'
+    # the listener is removed once the value has been popped
+    assert shared_variable_manager.tts_requests._listeners == []
@@ -0,0 +1,73 @@
+import time
+import socket
+import struct
+import asyncio
+
+from ethernet_connection.transport import FramedLink
+
+
+def free_port() -> int:
+    """A local port nobody listens on."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def test_backoff_grows_with_jitter_up_to_the_maximum():
+    link = FramedLink(name='test', host='127.0.0.1', port=1, min_retry_interval=0.5, max_retry_interval=4)
+    for consecutive_failures, expected in [(0, 0.5), (1, 1), (2, 2), (3, 4), (10, 4)]:
+        link.health.consecutive_failures = consecutive_failures
+        delays = [link._backoff_delay() for _ in range(50)]
+        assert all(expected / 2 <= delay <= expected for delay in delays)
+
+
+def test_failed_attempts_wait_for_the_backoff():
+    async def attempts():
+        link = FramedLink(name='test', host='127.0.0.1', port=free_port(), min_retry_interval=10)
+        assert not await link.try_connect()
+        # within the backoff delay: no new attempt
+        assert not await link.try_connect()
+        return link
+
+    link = asyncio.run(attempts())
+    assert link.health.connection_attempts == 1 and link.health.consecutive_failures == 1
+    assert link._next_attempt_time > time.monotonic() + 4
+
+
+def test_run_reconnects_after_a_drop_and_a_failing_session():
+    async def serve_and_run():
+        # every connection gets one frame, then is closed by the server
+        async def handle(reader, writer):
+            writer.write(struct.pack('>I', 5) + b'hello')
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_server(handle, host='127.0.0.1', port=0)
+        port = server.sockets[0].getsockname()[1]
+        link = FramedLink(name='test', host='127.0.0.1', port=port, min_retry_interval=0.01, max_retry_interval=0.02)
+        payloads = []
+        sessions_done = asyncio.Event()
+
+        async def session():
+            _, payload = await link.receive_frame()
+            payloads.append(bytes(payload))
+            if len(payloads) == 1:
+                # a bug in the session: logged, the link reconnects anyway
+                raise RuntimeError('session bug')
+            if len(payloads) == 3:
+                sessions_done.set()
+            # the server closes the connection: ConnectionError
+            await link.receive_frame()
+
+        runner = asyncio.create_task(link.run(session=session))
+        await asyncio.wait_for(sessions_done.wait(), timeout=5)
+        runner.cancel()
+        await asyncio.gather(runner, return_exceptions=True)
+        server.close()
+        await server.wait_closed()
+        return link, payloads
+
+    link, payloads = asyncio.run(serve_and_run())
+    assert payloads == [b'hello'] * 3
+    assert link.health.connections >= 3 and link.health.disconnections >= 2
+    assert not link.connected
@@ -0,0 +1,88 @@
+import time
+import concurrent.futures
+
+import pytest
+
+pytest.importorskip('google.genai')
+
+from thread_shared_variables import SharedVariableManager
+from google_ai_studio import tts_service
+from google_ai_studio import service_interface
+from google_ai_studio.tts_cache import TtsCache
+from google_ai_studio.model_router import ModelRouter
+
+
+def make_service(tmp_path, prewarm_phrases: list):
+    # only the TTS parts, without an API client
+    service = service_interface.GoogleAIStudioService.__new__(service_interface.GoogleAIStudioService)
+    service.client = None
+    service.verbose = 0
+    service.shared_variable_manager = SharedVariableManager()
+    service.tts_parameters = {'model_name': 'tts_model', 'voice_name': 'voice', 'save_file': False}
+    service.tts_pipeline_parameters = {'max_parallel_requests': 2, 'min_sentence_length': 20}
+    service.tts_router = ModelRouter(name='tts', model_names=['tts_model'])
+    service.tts_cache = TtsCache(folder_path=str(tmp_path), max_size=10 ** 6)
+    service.prewarm_phrases = prewarm_phrases
+    service.use_tts_service = True
+    service.tts_unavailable_until = 0.0
+    service.audio_asset_bank = RecordingAssetBank()
+    return service
+
+
+class RecordingAssetBank:
+    def __init__(self):
+        self.played = []
+
+    def play(self, shared_variable_manager, key: str) -> bool:
+        self.played.append(key)
+        return True
+
+
+class QuotaError(Exception):
+    code = 429
+
+
+def test_prewarmed_phrases_are_cache_hits(tmp_path, monkeypatch):
+    synthesized = []
+
+    def fake_text_to_speech(text_input, **kwargs):
+        synthesized.append(text_input)
+        return text_input.encode('utf-8')
+
+    monkeypatch.setattr(tts_service, 'text_to_speech', fake_text_to_speech)
+    service = make_service(tmp_path, prewarm_phrases=['Ok.', 'I did not understand that. Could you please repeat it?'])
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        service.prewarm_tts_cache(executor=executor)
+    num_prewarm_requests = len(synthesized)
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        service.synthesize_in_order(text='ok.', executor=executor)
+        service.synthesize_in_order(text='I did not understand that.  Could you please repeat it?', executor=executor)
+
+    # no request after the pre-warm, the audio comes from the cache
+    assert len(synthesized) == num_prewarm_requests
+    assert service.shared_variable_manager.length(queue_name='audio_to_play') == 3
+
+
+def test_tts_outage_is_not_permanent(tmp_path, monkeypatch):
+    synthesized = []
+
+    def exhausted_text_to_speech(text_input, **kwargs):
+        synthesized.append(text_input)
+        raise QuotaError('429 RESOURCE_EXHAUSTED: GenerateRequestsPerDayPerProjectPerModel-FreeTier')
+
+    monkeypatch.setattr(tts_service, 'text_to_speech', exhausted_text_to_speech)
+    service = make_service(tmp_path, prewarm_phrases=[])
+    service.tts_cache.put(text='Ok.', voice_name='voice', model_name='tts_model', pcm_bytes=b'ok audio')
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
+        service.synthesize_in_order(text='This sentence needs the TTS model, which is out of quota.', executor=executor)
+        service.synthesize_in_order(text='Ok.', executor=executor)
+        service.synthesize_in_order(text='Another sentence that cannot be synthesized right now.', executor=executor)
+
+    # one API request, then the router fails fast until the next quota day
+    assert len(synthesized) == 1
+    assert service.use_tts_service
+    assert service.tts_unavailable_until > time.time()
+    # the limit message is played once per outage, the cached sentence is still spoken
+    assert service.audio_asset_bank.played == ['TTS_request_limit']
+    assert service.shared_variable_manager.pop_from(queue_name='audio_to_play') == b'ok audio'
@@ -0,0 +1,53 @@
+import time
+
+import numpy as np
+import pytest
+
+cv2 = pytest.importorskip('cv2')
+
+from sensors.camera.usb_camera import UsbCamera, DECODE_MODE, MJPEG_PASSTHROUGH_MODE
+
+
+class StubCapture:
+    """VideoCapture returning a fixed image from retrieve(), and recording the properties set."""
+
+    def __init__(self, image: np.ndarray):
+        self.image = image
+        self.properties = {}
+
+    def set(self, property_id, value) -> bool:
+        self.properties[property_id] = value
+        return True
+
+    def retrieve(self, image=None):
+        return True, self.image
+
+
+def make_camera(retrieved_image: np.ndarray) -> UsbCamera:
+    camera = UsbCamera(capture_mode=MJPEG_PASSTHROUGH_MODE, verbose=0)
+    camera.video = StubCapture(retrieved_image)
+    camera._grab_latest = time.time
+    return camera
+
+
+def test_passthrough_accepts_v4l2_row_vector():
+    pixels = np.zeros((48, 64, 3), dtype=np.uint8)
+    jpeg = cv2.imencode('.jpg', pixels)[1].reshape(-1)
+    # the V4L2 backend returns the bitstream as a (1, N) array
+    camera = make_camera(retrieved_image=jpeg.reshape(1, -1))
+
+    assert camera._read_frame()
+    assert camera.capture_mode == MJPEG_PASSTHROUGH_MODE
+    assert bytes(camera.frame_buffer.read_latest().image) == jpeg.tobytes()
+    assert cv2.CAP_PROP_CONVERT_RGB not in camera.video.properties
+
+
+def test_passthrough_falls_back_to_decode_mode():
+    # the backend ignored CAP_PROP_CONVERT_RGB and decoded the frame
+    pixels = np.full((48, 64, 3), 127, dtype=np.uint8)
+    camera = make_camera(retrieved_image=pixels)
+
+    assert camera._read_frame()
+    assert camera.capture_mode == DECODE_MODE
+    assert camera.video.properties[cv2.CAP_PROP_CONVERT_RGB] == 1
+    assert np.array_equal(camera.frame_buffer.read_latest_pixels().image, pixels)
@@ -1,108 +1,266 @@
+import asyncio
 import threading
+import collections
+
+# Overflow policies for bounded queues (what happens when a value is added to a full queue)
+DROP_OLDEST = 'drop_oldest'
+DROP_NEWEST = 'drop_newest'
+BLOCK = 'block'
+OVERFLOW_POLICIES = (DROP_OLDEST, DROP_NEWEST, BLOCK)
+
+
+class SharedQueue:
+    """
+    Thread-safe FIFO queue backed by a collections.deque, with its own Condition so that consumers can block
+    until a value is available instead of polling. Optionally bounded, with a configurable overflow policy:
+        - 'drop_oldest': the oldest value is discarded to make room for the new one.
+        - 'drop_newest': the new value is discarded.
+        - 'block': the producer waits (up to a timeout) until a consumer makes room.
+    """
+
+    def __init__(self, max_length: int = None, overflow_policy: str = DROP_OLDEST):
+        assert max_length is None or max_length > 0, 'max_length must be None or a positive integer'
+        assert overflow_policy in OVERFLOW_POLICIES, f'overflow_policy must be one of {OVERFLOW_POLICIES}'
+        self.max_length = max_length
+        self.overflow_policy = overflow_policy
+        self.dropped_count = 0
+        self._items = collections.deque()
+        self._condition = threading.Condition()
+        # callables invoked (without arguments, outside the lock) every time a value is added. Used to wake up
+        # event loops that cannot block on the condition.
+        self._listeners = []
+
+    def put(self, value, timeout: float = None) -> bool:
+        """
+        Appends a value to the queue.
+        :param value: The value to add.
+        :param timeout: Only used with the 'block' policy, maximum time to wait for room (None = wait forever).
+        :return: True if the value was added, False if it was dropped.
+        """
+        with self._condition:
+            if self.max_length is not None and len(self._items) >= self.max_length:
+                if self.overflow_policy == DROP_OLDEST:
+                    self._items.popleft()
+                    self.dropped_count += 1
+                elif self.overflow_policy == DROP_NEWEST:
+                    self.dropped_count += 1
+                    return False
+                else:  # BLOCK
+                    has_room = self._condition.wait_for(
+                        lambda: len(self._items) < self.max_length,
+                        timeout=timeout,
+                    )
+                    if not has_room:
+                        self.dropped_count += 1
+                        return False
+            self._items.append(value)
+            self._condition.notify_all()
+            listeners = self._listeners.copy()
+        for listener in listeners:
+            listener()
+        return True
+
+    def pop(self, timeout: float = 0.0):
+        """
+        Pops the oldest value from the queue.
+        :param timeout: 0 returns immediately, None waits until a value is available, a positive number waits at
+            most that many seconds.
+        :return: The popped value or None if the queue is (still) empty.
+        """
+        with self._condition:
+            if not self._items:
+                if timeout == 0:
+                    return None
+                if not self._condition.wait_for(lambda: len(self._items) > 0, timeout=timeout):
+                    return None
+            value = self._items.popleft()
+            # wake up producers waiting for room ('block' policy)
+            self._condition.notify_all()
+            return value
+
+    def add_listener(self, listener) -> None:
+        with self._condition:
+            self._listeners.append(listener)
+
+    def remove_listener(self, listener) -> None:
+        with self._condition:
+            if listener in self._listeners:
+                self._listeners.remove(listener)
+
+    def remove(self, value) -> bool:
+        with self._condition:
+            try:
+                self._items.remove(value)
+            except ValueError:
+                return False
+            self._condition.notify_all()
+            return True
+
+    def contains(self, value) -> bool:
+        with self._condition:
+            return value in self._items
+
+    def copy(self) -> list:
+        with self._condition:
+            return list(self._items)
+
+    def __len__(self) -> int:
+        with self._condition:
+            return len(self._items)
 
 
 class SharedVariableManager:
-    def __init__(self, verbose: int = 0):
+    def __init__(self, verbose: int = 0, queue_limits: dict = None):
+        """
+        :param verbose: Verbosity level for logging.
+        :param queue_limits: optional dict {queue_name: {'max_length': int, 'overflow_policy': str}} to bound the
+            data queues. Unbounded by default.
+        """
         # internal parameters
         self.verbose = verbose
+        queue_limits = queue_limits if queue_limits is not None else {}
 
         # Shared queues
-        self.reasoning_requests = []
-        self.tts_requests = []
-        self.functions_to_call = []
-        self.audio_to_play = []
-        self.received_ethernet_data = []
+        self.reasoning_requests = SharedQueue(**queue_limits.get('reasoning_requests', {}))
+        self.tts_requests = SharedQueue(**queue_limits.get('tts_requests', {}))
+        self.functions_to_call = SharedQueue(**queue_limits.get('functions_to_call', {}))
+        self.audio_to_play = SharedQueue(**queue_limits.get('audio_to_play', {}))
+        self.received_ethernet_data = SharedQueue(**queue_limits.get('received_ethernet_data', {}))
+        # (event, pcm_bytes) tuples from the microphone listener to the streaming reasoning session, see
+        # MicrophoneListener streaming_mode. Never drop audio here: leave it unbounded.
+        self.audio_stream = SharedQueue(**queue_limits.get('audio_stream', {}))
 
         # Shared variables
-        # this is a dict containing the raw bytes in 'image' and the acquisition time in 'timestamp'
-        self.latest_camera_image = None
+        # FrameRingBuffer (see sensors/camera/frame_ring_buffer.py) holding the latest camera frames, set once by
+        # UsbCamera. Consumers call read_latest() on it and register listeners to be woken up by new frames.
+        self.camera_frame_buffer = None
 
-        # Locks for thread safety
-        self.reasoning_requests_lock = threading.Lock()
-        self.tts_requests_lock = threading.Lock()
-        self.functions_to_call_lock = threading.Lock()
-        self.audio_to_play_lock = threading.Lock()
-        self.received_ethernet_data_lock = threading.Lock()
-        self.latest_camera_image_lock = threading.Lock()
+        # Locks for thread safety (queues carry their own condition)
+        self.camera_frame_buffer_lock = threading.Lock()
+        # callables invoked after a variable is set, see add_listener()
+        self._variable_listeners = {}
 
         # variables and locks for components logic
-        self.running_components = []
+        self.running_components = SharedQueue()
         # "expected_component_number" will count the number of components/services the system is expected to have based
         # on the "add_to" calls on "running_components"
         self.expected_component_number = 0
-        self.already_counted_components = []
-        self.running_components_lock = threading.Lock()
+        self.already_counted_components = SharedQueue()
         self.expected_component_number_lock = threading.Lock()
         self.already_counted_components_lock = threading.Lock()
 
     # QUEUE METHODS
-    def add_to(self, queue_name: str, value) -> None:
+    def add_to(self, queue_name: str, value, timeout: float = None) -> bool:
         """
-        Adds a value to a shared variable list.
-        :param queue_name: The name of the shared variable list.
-        :param value: The value to add to the list.
+        Adds a value to a shared queue, waking up any consumer blocked on it.
+        :param queue_name: The name of the shared queue.
+        :param value: The value to add to the queue.
+        :param timeout: Only used by bounded queues with the 'block' policy, maximum time to wait for room.
+        :return: True if the value was added, False if it was dropped because the queue is full.
         """
         # if we are adding values to the running_components list, we need to increase the expected_component_number,
         # but only if the component is not already counted. Es. ethernet client could be added many times.
         increase_component_number = False
         if queue_name == 'running_components':
             with self.already_counted_components_lock:
-                if value not in self.already_counted_components:
-                    self.already_counted_components.append(value)
+                if not self.already_counted_components.contains(value):
+                    self.already_counted_components.put(value)
                     increase_component_number = True
             if increase_component_number:
                 with self.expected_component_number_lock:
                     self.expected_component_number += 1
 
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            getattr(self, queue_name).append(value)
+        added = getattr(self, queue_name).put(value, timeout=timeout)
+        if not added and self.verbose >= 2:
+            print(f'Queue "{queue_name}" full, value dropped.')
+        return added
 
-    def pop_from(self, queue_name: str):
+    def pop_from(self, queue_name: str, timeout: float = 0.0):
         """
-        Pops a value from a shared variable list.
-        :param queue_name: The name of the shared variable list.
-        :return: The popped value or None if the list is empty.
+        Pops a value from a shared queue.
+        :param queue_name: The name of the shared queue.
+        :param timeout: 0 (default) returns immediately, None blocks until a value is available, a positive number
+            blocks at most that many seconds.
+        :return: The popped value or None if the queue is empty.
         """
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            variable_list = getattr(self, queue_name)
-            if len(variable_list) > 0:
-                return variable_list.pop(0)
-            return None
+        return getattr(self, queue_name).pop(timeout=timeout)
+
+    async def pop_from_async(self, queue_name: str):
+        """
+        Awaitable version of pop_from() for coroutines running on an asyncio event loop: it suspends the coroutine
+        (without blocking the loop) until a value is available, then pops it.
+        :param queue_name: The name of the shared queue.
+        :return: The popped value.
+        """
+        queue = getattr(self, queue_name)
+        loop = asyncio.get_running_loop()
+        while True:
+            value = queue.pop()
+            if value is not None:
+                return value
+            wakeup = loop.create_future()
+
+            def listener():
+                loop.call_soon_threadsafe(lambda: wakeup.done() or wakeup.set_result(None))
+
+            queue.add_listener(listener)
+            try:
+                # a value could have been added between the first pop and add_listener
+                value = queue.pop()
+                if value is not None:
+                    return value
+                await wakeup
+            finally:
+                queue.remove_listener(listener)
 
     def remove_from(self, queue_name: str, value) -> bool:
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            variable_list = getattr(self, queue_name)
-            if value in variable_list:
-                variable_list.remove(value)
-                return True
-            return False
+        return getattr(self, queue_name).remove(value)
 
     def has_value(self, queue_name: str, value) -> bool:
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            variable_list = getattr(self, queue_name)
-            return value in variable_list
+        return getattr(self, queue_name).contains(value)
 
     def length(self, queue_name: str) -> int:
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            return len(getattr(self, queue_name))
+        return len(getattr(self, queue_name))
 
     def get_copy(self, queue_name: str) -> list:
-        lock = getattr(self, f'{queue_name}_lock')
-        with lock:
-            return getattr(self, queue_name).copy()
+        return getattr(self, queue_name).copy()
 
     # VARIABLE METHODS
     def set_variable(self, variable_name: str, value) -> None:
         lock = getattr(self, f'{variable_name}_lock')
         with lock:
             setattr(self, variable_name, value)
+            listeners = self._variable_listeners.get(variable_name, []).copy()
+        for listener in listeners:
+            listener()
 
     def get_variable(self, variable_name: str):
         lock = getattr(self, f'{variable_name}_lock')
         with lock:
             return getattr(self, variable_name)
+
+    # LISTENER METHODS
+    def add_listener(self, name: str, listener) -> None:
+        """
+        Registers a callable (no arguments) invoked every time a value is added to the queue, or the variable is set,
+        called "name". Listeners run on the producer thread, so they must be quick and thread-safe (es.
+        loop.call_soon_threadsafe).
+        """
+        shared_object = getattr(self, name)
+        if isinstance(shared_object, SharedQueue):
+            shared_object.add_listener(listener)
+        else:
+            lock = getattr(self, f'{name}_lock')
+            with lock:
+                self._variable_listeners.setdefault(name, []).append(listener)
+
+    def remove_listener(self, name: str, listener) -> None:
+        shared_object = getattr(self, name)
+        if isinstance(shared_object, SharedQueue):
+            shared_object.remove_listener(listener)
+        else:
+            lock = getattr(self, f'{name}_lock')
+            with lock:
+                listeners = self._variable_listeners.get(name, [])
+                if listener in listeners:
+                    listeners.remove(listener)